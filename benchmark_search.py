@@ -0,0 +1,304 @@
+"""
+Search microbenchmark: latency, throughput, memory and result equivalence per search engine
+"""
+import re
+import sys
+import time
+import random
+import logging
+import argparse
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any, Tuple, Callable, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from config import BASE_DIR
+from database import Database
+from lexicon import get_lexicon
+from catalog_generator import build_catalog_db
+from tfidf_index import TfidfIndex
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BENCH_DIR = BASE_DIR / "bench_data"
+
+# Keyword engines of Database.search_products plus the TF-IDF engine of RAGService.retrieve_with_scoring
+ENGINES = Database.SEARCH_ENGINES + ("tfidf",)
+
+QUERY_KINDS = ("brand", "category", "brand_category", "noise")
+
+NOISE_WORDS = ["سلام", "ارزان", "جدید", "hello", "pro", "مشکی", "گارانتی", "xyz", "فوری", "تخفیف"]
+
+
+def build_query_corpus(count: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """Return count (kind, query) pairs spread evenly over the query kinds"""
+    rnd = random.Random(seed)
+    lexicon = get_lexicon()
+    brand_variants = sorted(lexicon.brand_of)
+    categories = sorted(lexicon.category_words)
+    fillers = sorted(lexicon.stop_words)
+    
+    corpus = []
+    for i in range(count):
+        kind = QUERY_KINDS[i % len(QUERY_KINDS)]
+        if kind == "brand":
+            words = [rnd.choice(fillers), rnd.choice(brand_variants)]
+        elif kind == "category":
+            words = [rnd.choice(fillers), rnd.choice(categories), rnd.choice(fillers)]
+        elif kind == "brand_category":
+            words = [rnd.choice(categories), rnd.choice(brand_variants), rnd.choice(fillers)]
+        else:
+            words = rnd.sample(NOISE_WORDS, 2)
+        corpus.append((kind, " ".join(words)))
+    return corpus
+
+
+def reference_search(db: Database, rows: List[Any], query: str, limit: int) -> List[int]:
+    """Full-scan regex scorer search_products used before the index, over normalized text; returns ranked ids"""
+    brand_keywords, category_keywords, other_keywords = db._analyze_query(query)
+    if not (brand_keywords or category_keywords or other_keywords):
+        return []
+    
+    def is_word_match(keyword, text):
+        pattern = r'(?:^|\s|[^\w\u0600-\u06FF])' + re.escape(keyword) + r'(?:$|\s|[^\w\u0600-\u06FF])'
+        return re.search(pattern, text) is not None
+    
+    def score_group(keywords, name_weight, desc_weight, name_lower, desc_lower):
+        score = 0
+        matched = 0
+        for keyword in keywords:
+            if is_word_match(keyword, name_lower):
+                score += name_weight
+                matched += 1
+            elif is_word_match(keyword, desc_lower):
+                score += desc_weight
+                matched += 1
+        return score, matched
+    
+    scored = []
+    for row in rows:
+        name_lower = row["name_normalized"]
+        desc_lower = row["description_normalized"]
+        
+        brand_score, matched_brand = score_group(brand_keywords, 50, 20, name_lower, desc_lower)
+        other_score, matched_other = score_group(other_keywords, 15, 5, name_lower, desc_lower)
+        category_score, matched_category = score_group(category_keywords, 5, 2, name_lower, desc_lower)
+        
+        if brand_keywords and matched_brand == 0:
+            continue
+        if brand_keywords and category_keywords and matched_category == 0:
+            continue
+        
+        score = brand_score + other_score + category_score
+        total_matched = matched_brand + matched_other + matched_category
+        if total_matched > 1:
+            score += total_matched * 10
+        if matched_brand > 0 and matched_category > 0:
+            score += 30
+        
+        if score > 0:
+            scored.append((score, row["id"]))
+    
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [product_id for _, product_id in scored[:limit]]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of values"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def open_engine(db_path: Path, engine: str, limit: int) -> Tuple[Database, Callable[[str], List[int]]]:
+    """Open the catalog and return a function searching it with engine, returning ranked ids"""
+    if engine == "tfidf":
+        db = Database(db_path)
+        index = TfidfIndex.load_or_build(db, db_path.parent / f"{db_path.stem}_tfidf")
+        return db, lambda query: [product_id for product_id, _ in index.search(query, limit)]
+    
+    db = Database(db_path, search_engine=engine)
+    # Repeated corpus queries would measure the retrieval cache instead of the engine
+    db.retrieval_cache = None
+    return db, lambda query: [product["id"] for product in db.search_products(query, limit=limit)]
+
+
+def peak_rss() -> Optional[int]:
+    """Peak resident set size of this process in bytes, None where it is not available"""
+    # On Linux ru_maxrss keeps the parent's peak across exec, VmHWM starts over
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure_engine(
+    db_path: Path,
+    engine: str,
+    corpus: List[Tuple[str, str]],
+    limit: int
+) -> Dict[str, Any]:
+    """
+    Latency, throughput, build time and memory of one engine over the corpus
+    
+    Meant to run in a fresh process (see measure_engine_isolated): the peak RSS
+    growth then covers everything the engine holds, including the SQLite page
+    cache and memory-mapped arrays, which the Python heap peak does not count.
+    """
+    rss_before = peak_rss()
+    
+    start = time.perf_counter()
+    db, search = open_engine(db_path, engine, limit)
+    search(corpus[0][1])
+    first_search = time.perf_counter() - start
+    
+    latencies: Dict[str, List[float]] = {kind: [] for kind in QUERY_KINDS}
+    results: Dict[str, List[int]] = {}
+    start = time.perf_counter()
+    for kind, query in corpus:
+        query_start = time.perf_counter()
+        product_ids = search(query)
+        latencies[kind].append(time.perf_counter() - query_start)
+        results[query] = product_ids
+    elapsed = time.perf_counter() - start
+    db.close()
+    rss_after = peak_rss()
+    
+    # Heap pass: tracemalloc slows everything down and its own bookkeeping grows
+    # the RSS, so it runs after the pass above
+    tracemalloc.start()
+    db, search = open_engine(db_path, engine, limit)
+    for _, query in corpus:
+        search(query)
+    _, peak_heap = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.close()
+    
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "first_search": first_search,
+        "peak_rss": rss_after - rss_before if rss_before is not None else None,
+        "peak_heap": peak_heap,
+        "throughput": len(corpus) / elapsed,
+        "p50": percentile(all_latencies, 0.5),
+        "p99": percentile(all_latencies, 0.99),
+        "by_kind": {
+            kind: (percentile(values, 0.5), percentile(values, 0.99))
+            for kind, values in latencies.items() if values
+        },
+        "results": results
+    }
+
+
+def measure_engine_isolated(
+    db_path: Path,
+    engine: str,
+    corpus: List[Tuple[str, str]],
+    limit: int
+) -> Dict[str, Any]:
+    """Run measure_engine in a new process, so memory held by earlier engines is not counted"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(measure_engine, db_path, engine, corpus, limit).result()
+
+
+def check_equivalence(
+    db_path: Path,
+    results: Dict[str, List[int]],
+    queries: List[str],
+    limit: int
+) -> Tuple[float, float, List[str]]:
+    """
+    Compare ranked results with the reference scorer
+    
+    Returns:
+        Exact ranked-match rate, mean overlap@limit and the queries that differ
+    """
+    db = Database(db_path)
+    with db.get_read_connection() as conn:
+        rows = conn.execute(
+            "SELECT id, name_normalized, description_normalized FROM products ORDER BY id"
+        ).fetchall()
+    
+    exact = 0
+    overlap = 0.0
+    mismatches = []
+    for query in queries:
+        expected = reference_search(db, rows, query, limit)
+        actual = results[query]
+        if actual == expected:
+            exact += 1
+        else:
+            mismatches.append(query)
+        overlap += len(set(actual) & set(expected)) / len(expected) if expected else float(not actual)
+    db.close()
+    
+    return exact / len(queries), overlap / len(queries), mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark product search engines")
+    parser.add_argument("--sizes", default="1000,10000", help="Comma separated catalog sizes, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--engines", default=",".join(ENGINES), help="Comma separated search engines")
+    parser.add_argument("--queries", type=int, default=400, help="Number of benchmark queries")
+    parser.add_argument("--check-queries", type=int, default=100, help="Queries checked against the reference scorer")
+    parser.add_argument("--check-max-size", type=int, default=100000, help="Largest catalog checked against the reference scorer")
+    parser.add_argument("--limit", type=int, default=5, help="Results per query")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of catalogs and queries")
+    parser.add_argument("--strict", action="store_true", help="Exit with an error if the python engine differs from the reference")
+    args = parser.parse_args()
+    
+    sizes = [int(size) for size in args.sizes.split(",")]
+    engines = args.engines.split(",")
+    corpus = build_query_corpus(args.queries, args.seed)
+    check_queries = list(dict.fromkeys(query for _, query in corpus))[:args.check_queries]
+    failed = False
+    
+    for size in sizes:
+        db_path = build_catalog_db(BENCH_DIR / f"catalog_{size}_{args.seed}.sqlite", size, args.seed)
+        logger.info(f"\n=== {size:,} products, {len(corpus)} queries ===")
+        
+        for engine in engines:
+            report = measure_engine_isolated(db_path, engine, corpus, args.limit)
+            peak_rss = f"{report['peak_rss'] / 1024 / 1024:.1f} MB" if report["peak_rss"] is not None else "n/a"
+            logger.info(
+                f"{engine:>6}: p50 {report['p50'] * 1000:.3f} ms, p99 {report['p99'] * 1000:.3f} ms, "
+                f"{report['throughput']:,.0f} queries/s, first search {report['first_search'] * 1000:.1f} ms, "
+                f"peak RSS +{peak_rss} (Python heap {report['peak_heap'] / 1024 / 1024:.1f} MB)"
+            )
+            for kind, (p50, p99) in report["by_kind"].items():
+                logger.info(f"        {kind:<15} p50 {p50 * 1000:.3f} ms, p99 {p99 * 1000:.3f} ms")
+            
+            if size > args.check_max_size:
+                continue
+            
+            exact_rate, overlap, mismatches = check_equivalence(db_path, report["results"], check_queries, args.limit)
+            logger.info(f"        equivalence: {exact_rate:.1%} exact, overlap@{args.limit} {overlap:.1%}")
+            for query in mismatches[:3]:
+                logger.info(f"        differs: '{query}'")
+            if engine == "python" and mismatches:
+                failed = True
+    
+    if failed and args.strict:
+        raise SystemExit("python engine results differ from the reference scorer")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Bounded in-memory caches
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional time-to-live and hit/miss counters"""
+    
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None
+    ):
+        if maxsize < 1:
+            raise ValueError("Cache size must be at least 1")
+        
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return cached value or None, refreshing its LRU position"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                self._evicted(key, value)
+                return None
+            
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key: Hashable, value: Any):
+        """Store value, evicting the least recently used entries above maxsize"""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            
+            while len(self._data) > self.maxsize:
+                old_key, (old_value, _) = self._data.popitem(last=False)
+                self.evictions += 1
+                self._evicted(old_key, old_value)
+    
+    def pop(self, key: Hashable) -> Optional[Any]:
+        """Remove key and return its value"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[0] if entry is not None else None
+    
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._data.clear()
+    
+    def _evicted(self, key: Hashable, value: Any):
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,126 @@
+"""
+Synthetic Persian/English product catalog generator for benchmarks
+"""
+import re
+import random
+import logging
+import argparse
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from config import SAMPLE_CATALOG_PATH
+from database import Database
+from catalog_reader import ProductRecord, read_catalog
+from lexicon import get_lexicon
+
+logger = logging.getLogger(__name__)
+
+ZWNJ = "\u200c"
+LATIN_WORD = re.compile(r"^[A-Za-z][A-Za-z0-9+\-]*$")
+NUMBER = re.compile(r"\d+")
+MODEL_SUFFIXES = ["", "", "X", "S", " Pro", " Max", " Lite"]
+
+
+def _brand_variants() -> Dict[str, List[str]]:
+    """Map each lowercased brand spelling to all its Persian/English spellings"""
+    variants_by_word = {}
+    for variants in get_lexicon().brands.values():
+        spellings = [variant.title() if variant.isascii() else variant for variant in variants]
+        for variant in variants:
+            variants_by_word[variant] = spellings
+    return variants_by_word
+
+
+def _catalog_parts() -> Dict[str, Dict[str, list]]:
+    """Group sample products by category word with the brands and series seen in each category"""
+    brand_variants = _brand_variants()
+    categories: Dict[str, Dict[str, list]] = {}
+    
+    for _, name, description, price in read_catalog(SAMPLE_CATALOG_PATH):
+        words = name.split()
+        category = categories.setdefault(words[0], {"products": [], "brands": [], "series": []})
+        category["products"].append((name, description, price))
+        
+        if len(words) > 1:
+            brand = words[1]
+            category["brands"].extend(brand_variants.get(brand.lower(), [brand]))
+        category["series"].extend(
+            word for word in words[2:] if LATIN_WORD.match(word) and not word.isdigit()
+        )
+    
+    for category in categories.values():
+        if not category["series"]:
+            category["series"] = ["Plus"]
+    
+    return categories
+
+
+def generate_products(count: int, seed: int = 0) -> Iterator[ProductRecord]:
+    """
+    Generate count realistic products from the sample catalog
+    
+    Names combine a sample category, a brand seen in that category (in its Persian
+    or English spelling) and a random series/model. Descriptions reuse sample
+    descriptions of the same category with perturbed numbers, and some rows drop
+    the ZWNJ in compound words.
+    """
+    rnd = random.Random(seed)
+    categories = _catalog_parts()
+    category_names = sorted(categories)
+    
+    for i in range(count):
+        category_name = rnd.choice(category_names)
+        category = categories[category_name]
+        _, template_description, template_price = rnd.choice(category["products"])
+        
+        model = f"{rnd.choice(category['series'])} {rnd.randint(1, 99)}{rnd.choice(MODEL_SUFFIXES)}"
+        name = f"{category_name} {rnd.choice(category['brands'])} {model}"
+        description = NUMBER.sub(
+            lambda match: str(max(1, int(int(match.group()) * rnd.uniform(0.5, 2)))),
+            template_description
+        )
+        
+        if rnd.random() < 0.1:
+            name = name.replace(ZWNJ, "")
+            description = description.replace(ZWNJ, "")
+        
+        price = round(template_price * rnd.uniform(0.5, 1.8), -3)
+        yield f"GEN-{seed}-{i:07d}", name, description, price
+
+
+def build_catalog_db(path: Path, count: int, seed: int = 0) -> Path:
+    """Create a product database with count generated products, reusing an existing file"""
+    if path.exists():
+        return path
+    
+    path.parent.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Generating catalog of {count:,} products at {path}")
+    
+    db = Database(path, sample_data=False)
+    try:
+        db.import_products(generate_products(count, seed))
+        with db.get_connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except BaseException:
+        db.close()
+        path.unlink(missing_ok=True)
+        raise
+    
+    db.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic product catalog database")
+    parser.add_argument("--size", type=int, default=10000, help="Number of products")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--output", type=Path, required=True, help="SQLite file to create")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    build_catalog_db(args.output, args.size, args.seed)
+    logger.info(f"Catalog written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Streaming readers of product catalog files (CSV and JSONL)
+"""
+import csv
+import json
+import math
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+# (sku, name, description, price); sku is None for products without an external id
+ProductRecord = Tuple[Optional[str], str, Optional[str], float]
+
+FORMATS = ("csv", "jsonl")
+
+
+def detect_format(path: Path) -> str:
+    """Catalog format from the file extension"""
+    suffix = path.suffix.lower().lstrip(".")
+    if suffix in ("jsonl", "ndjson"):
+        return "jsonl"
+    if suffix == "csv":
+        return "csv"
+    raise ValueError(f"Cannot detect catalog format of {path}, expected one of {FORMATS}")
+
+
+def to_record(data: Dict[str, Any]) -> ProductRecord:
+    """Validate one catalog entry with name, price and optional sku and description"""
+    name = (data.get("name") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    
+    try:
+        price = float(data.get("price"))
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid price {data.get('price')!r}")
+    if not math.isfinite(price) or price < 0:
+        raise ValueError(f"invalid price {price}")
+    
+    sku = data.get("sku")
+    if sku is not None:
+        sku = str(sku).strip() or None
+    description = data.get("description") or None
+    return sku, name, description, price
+
+
+def read_catalog(
+    path: Path,
+    file_format: Optional[str] = None,
+    on_error: Optional[Callable[[int, Exception], None]] = None
+) -> Iterator[ProductRecord]:
+    """
+    Yield the products of a catalog file one by one, in constant memory
+    
+    Args:
+        path: CSV file with a header row or JSONL file with one object per line
+        file_format: "csv" or "jsonl", detected from the extension if not given
+        on_error: Called with the line number and error of an invalid entry, which is
+            then skipped; without it the first invalid entry raises ValueError
+    
+    Returns:
+        Iterator of (sku, name, description, price) records
+    """
+    file_format = file_format or detect_format(path)
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown catalog format {file_format}, expected one of {FORMATS}")
+    
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if file_format == "csv":
+            reader = csv.DictReader(f)
+            entries = ((reader.line_num, row) for row in reader)
+        else:
+            entries = ((line_number, line) for line_number, line in enumerate(f, 1) if line.strip())
+        
+        for line_number, entry in entries:
+            try:
+                data = json.loads(entry) if file_format == "jsonl" else entry
+                if not isinstance(data, dict):
+                    raise ValueError("entry is not an object")
+                yield to_record(data)
+            except ValueError as e:
+                if on_error is None:
+                    raise ValueError(f"{path}:{line_number}: {e}") from e
+                on_error(line_number, e)
@@ -0,0 +1,165 @@
+"""
+Circuit breaker short-circuiting calls to a failing dependency
+"""
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from config import (
+    LLM_BREAKER_FAILURE_RATE, LLM_BREAKER_WINDOW, LLM_BREAKER_MIN_CALLS,
+    LLM_BREAKER_OPEN_SECONDS, LLM_BREAKER_HALF_OPEN_PROBES
+)
+from metrics import BREAKER_STATE, BREAKER_TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Gauge values of the states
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker
+    
+    While closed, the outcomes of the last `window` calls are kept, and the breaker
+    opens once at least `min_calls` of them were seen and the share of failures
+    reaches `failure_rate`. An open breaker rejects every call for `open_seconds`,
+    then turns half-open and lets `half_open_probes` calls through: the breaker closes
+    when all of them succeed and opens again on the first failure.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = LLM_BREAKER_FAILURE_RATE,
+        window: int = LLM_BREAKER_WINDOW,
+        min_calls: int = LLM_BREAKER_MIN_CALLS,
+        open_seconds: float = LLM_BREAKER_OPEN_SECONDS,
+        half_open_probes: int = LLM_BREAKER_HALF_OPEN_PROBES
+    ):
+        if not 0 < failure_rate <= 1:
+            raise ValueError("Breaker failure rate must be in (0, 1]")
+        if window < 1 or half_open_probes < 1:
+            raise ValueError("Breaker window and half-open probes must be at least 1")
+        
+        self.name = name
+        self.failure_rate = failure_rate
+        self.window = window
+        self.min_calls = min(min_calls, window)
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        
+        self._state = CLOSED
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self._last_transition: Optional[float] = None
+        self._rejected = 0
+        self._lock = threading.Lock()
+        
+        BREAKER_STATE.set(STATE_VALUES[CLOSED], breaker=name)
+    
+    @property
+    def state(self) -> str:
+        """Current state, turning an expired open breaker half-open"""
+        with self._lock:
+            self._check_open_expired()
+            return self._state
+    
+    def allow_request(self) -> bool:
+        """
+        Whether a call may go through now
+        
+        A call that is allowed must be finished with record_success, record_failure
+        or release, so half-open probes are accounted for.
+        """
+        with self._lock:
+            self._check_open_expired()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes_started < self.half_open_probes:
+                self._probes_started += 1
+                return True
+            self._rejected += 1
+            return False
+    
+    def record_success(self):
+        """Record a successful call"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_succeeded += 1
+                if self._probes_succeeded >= self.half_open_probes:
+                    self._transition(CLOSED)
+            elif self._state == CLOSED:
+                self._record_outcome(False)
+    
+    def record_failure(self):
+        """Record a failed or timed out call"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(OPEN)
+            elif self._state == CLOSED:
+                self._record_outcome(True)
+                calls = len(self._outcomes)
+                if calls >= self.min_calls and self._failures / calls >= self.failure_rate:
+                    self._transition(OPEN)
+    
+    def release(self):
+        """Finish an allowed call whose outcome says nothing about the dependency (e.g. cancelled)"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes_started > self._probes_succeeded:
+                self._probes_started -= 1
+    
+    def _record_outcome(self, failed: bool):
+        if len(self._outcomes) == self._outcomes.maxlen and self._outcomes[0]:
+            self._failures -= 1
+        self._outcomes.append(failed)
+        if failed:
+            self._failures += 1
+    
+    def _check_open_expired(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+    
+    def _transition(self, state: str):
+        previous = self._state
+        self._state = state
+        self._last_transition = time.time()
+        self._outcomes.clear()
+        self._failures = 0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        
+        BREAKER_STATE.set(STATE_VALUES[state], breaker=self.name)
+        BREAKER_TRANSITIONS.inc(breaker=self.name, from_state=previous, to_state=state)
+        log = logger.info if state == CLOSED else logger.warning
+        log(f"Circuit breaker {self.name}: {previous} -> {state}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """State, recent failure rate and rejected calls"""
+        with self._lock:
+            self._check_open_expired()
+            calls = len(self._outcomes)
+            return {
+                "state": self._state,
+                "recent_calls": calls,
+                "recent_failure_rate": round(self._failures / calls, 4) if calls else 0.0,
+                "failure_rate_threshold": self.failure_rate,
+                "open_seconds": self.open_seconds,
+                "retry_in_seconds": (
+                    round(max(self.open_seconds - (time.monotonic() - self._opened_at), 0), 1)
+                    if self._state == OPEN else None
+                ),
+                "last_transition": self._last_transition,
+                "rejected_calls": self._rejected
+            }
@@ -12,20 +12,133 @@ load_dotenv()
 BASE_DIR = Path(__file__).resolve().parent
 
 # Database path
-DB_DIR = BASE_DIR / "db"
+DB_DIR = Path(os.getenv("DB_DIR", BASE_DIR / "db"))  # Product, reply and rate limit databases
 DB_PATH = DB_DIR / "app_data.sqlite"
 
+# Catalog data files
+DATA_DIR = BASE_DIR / "data"
+SAMPLE_CATALOG_PATH = DATA_DIR / "sample_products.csv"  # Loaded into an empty database
+IMPORT_BATCH_SIZE = 50000  # Rows per executemany transaction of a bulk import
+
+# Database connection pool settings (per worker process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 2))  # Read-write connections
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 8))  # Read-only connections for search and listing
+DB_POOL_TIMEOUT = 5.0  # Seconds to wait for a free connection
+DB_STATEMENT_CACHE_SIZE = 256  # Prepared statements cached per connection
+DB_PRAGMAS = {
+    "journal_mode": os.getenv("DB_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("DB_MMAP_SIZE", 256 * 1024 * 1024)),
+    "cache_size": -16000,  # Negative value is in KiB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,  # Milliseconds
+}
+
+# Logging settings
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" (one object per line) or "text"
+LOG_QUEUE_SIZE = 10000  # Records waiting for the writer thread, further records are dropped
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "INFO=1.0")  # Share of per-request records kept per level, e.g. "INFO=0.1,DEBUG=0"
+
+# Request tracing (Server-Timing header and cProfile captures)
+TRACE_HEADER = "X-Debug-Trace"  # Requests carrying this header with TRACE_TOKEN get a Server-Timing header with stage timings
+TRACE_TOKEN = os.getenv("TRACE_TOKEN", "")  # Required value of the trace header, empty disables Server-Timing headers
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))  # Share of requests traced without the header
+TRACE_PROFILE_DIR = os.getenv("TRACE_PROFILE_DIR", "")  # Directory for cProfile captures of sampled requests, empty disables them
+TRACE_PROFILE_MAX_FILES = 100  # Newest captures kept in TRACE_PROFILE_DIR
+
 # API settings
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", 8000))
+API_WORKERS = int(os.getenv("API_WORKERS", os.cpu_count() or 1))  # Worker processes in production mode
+
+# LLM settings
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")  # "gemini" or "local" (offline replies rendered from products)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))  # Concurrent LLM calls per worker
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 10))  # Latency SLO of the LLM path (queueing and call), the fallback reply is sent when it expires
+LLM_MIN_CALL_SHARE = 0.5  # Share of the SLO that must remain to start a backend call; requests queued longer are shed as overloaded
+
+# LLM circuit breaker: fails fast to the fallback reply while the provider is failing
+LLM_BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", 0.5))  # Share of failed or timed out calls that opens the breaker
+LLM_BREAKER_WINDOW = 20  # Most recent calls the failure rate is computed over
+LLM_BREAKER_MIN_CALLS = 10  # Calls needed in the window before the breaker may open
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", 30))  # Time calls are skipped before probing again
+LLM_BREAKER_HALF_OPEN_PROBES = 2  # Successful probe calls needed to close the breaker again
 
 # Gemini API settings
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+# Local LLM backend settings (synthetic latency for load tests and degraded mode)
+LOCAL_LLM_LATENCY_DISTRIBUTION = os.getenv("LOCAL_LLM_LATENCY_DISTRIBUTION", "lognormal")  # fixed, uniform or lognormal
+LOCAL_LLM_LATENCY_MS = float(os.getenv("LOCAL_LLM_LATENCY_MS", 300))  # Median latency, 0 disables the delay
+LOCAL_LLM_LATENCY_SPREAD = float(os.getenv("LOCAL_LLM_LATENCY_SPREAD", 0.5))  # uniform: +/- fraction of median, lognormal: sigma
+LOCAL_LLM_SEED = int(os.getenv("LOCAL_LLM_SEED", 0))
+
+# LLM response cache settings
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1024))  # Maximum cached replies, 0 disables the cache
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 600))
+
+# Reply store settings (idempotent handling of redelivered messages)
+REPLY_STORE_PATH = DB_DIR / "replies.sqlite"
+REPLY_STORE_RETENTION_SECONDS = int(os.getenv("REPLY_STORE_RETENTION_SECONDS", 7 * 24 * 3600))
+REPLY_STORE_MEMORY_SIZE = 10000  # Recent replies kept in memory
+REPLY_STORE_COMPACT_EVERY = 1000  # Stored replies between two compactions
+REPLY_STORE_IN_FLIGHT_TIMEOUT = 60.0  # Seconds before an unfinished message may be processed again
+REPLY_STORE_POLL_INTERVAL = 0.05  # Seconds between checks for a message processed by another worker
 
 # RAG settings
 MAX_RETRIEVAL_RESULTS = 5  # Maximum number of products returned from database
 
+# Conversation context settings (per worker process)
+CONTEXT_MAX_SENDERS = int(os.getenv("CONTEXT_MAX_SENDERS", 10000))  # Senders whose recent turns are kept, 0 disables follow-up handling
+CONTEXT_MAX_TURNS = 6  # Turns kept per sender
+CONTEXT_MAX_BYTES = int(os.getenv("CONTEXT_MAX_BYTES", 32 * 1024 * 1024))  # Hard cap on the estimated memory of all contexts
+CONTEXT_TTL_SECONDS = 1800  # A message after this much silence starts a new conversation
+
+# Prompt settings
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 1500))  # Maximum estimated tokens per prompt
+PROMPT_BYTES_PER_TOKEN = int(os.getenv("PROMPT_BYTES_PER_TOKEN", 3))  # UTF-8 bytes per token estimate (conservative for Persian)
+PROMPT_MIN_DESCRIPTION_BYTES = 120  # Descriptions are not cut shorter than this while budget remains
+
+# Catalog listing and statistics
+PRODUCT_LIST_BATCH_SIZE = int(os.getenv("PRODUCT_LIST_BATCH_SIZE", 500))  # Rows fetched per keyset query while streaming /products
+PRODUCT_LIST_MAX_LIMIT = int(os.getenv("PRODUCT_LIST_MAX_LIMIT", 10000))  # Most products one /products request returns
+PRICE_PERCENTILES = (25, 50, 75, 90, 99)  # Price percentiles reported by /stats
+
+# Catalog writes
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", 1))  # Seconds between checks for catalog changes made by other processes
+CATALOG_CHANGES_RETAINED = int(os.getenv("CATALOG_CHANGES_RETAINED", 10000))  # Change log rows kept for workers catching up; workers further behind reload the whole catalog
+
+# Query analysis lexicon (stop words, category words, brand aliases)
+LEXICON_PATH = Path(os.getenv("LEXICON_PATH", DATA_DIR / "lexicon.json"))
+LEXICON_RELOAD_INTERVAL = float(os.getenv("LEXICON_RELOAD_INTERVAL", 5))  # Seconds between file change checks, 0 disables reloading
+
+# Search settings
+SEARCH_ENGINE = os.getenv("SEARCH_ENGINE", "python")  # "python" (in-memory index) or "fts" (SQLite FTS5)
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", 4096))  # Cached search results by analyzed keywords, 0 disables the cache
+FTS_NAME_WEIGHT = 10.0  # bm25 weight of the product name column
+FTS_DESCRIPTION_WEIGHT = 4.0  # bm25 weight of the product description column
+FTS_BRAND_BOOST = 3  # Times each brand keyword is repeated in the bm25 ranking expression
+FTS_OTHER_BOOST = 2  # Times each other keyword is repeated in the bm25 ranking expression
+FTS_CATEGORY_BOOST = 1  # Times each category keyword is repeated in the bm25 ranking expression
+
+# TF-IDF retrieval settings (RAGService.retrieve_with_scoring)
+TFIDF_INDEX_DIR = DB_DIR / "tfidf"  # Memory-mapped matrices, one directory per catalog snapshot
+TFIDF_NGRAM_RANGE = (2, 4)  # Character n-gram lengths
+TFIDF_FEATURES = 2 ** 18  # Hashed n-gram feature space
+TFIDF_NAME_WEIGHT = 2  # Name n-grams count this many times more than description n-grams
+TFIDF_MIN_SCORE = 0.2  # Minimum cosine similarity of a returned product
+
 # Security settings
 MAX_MESSAGE_LENGTH = 1000  # Maximum message length
-RATE_LIMIT = "10/minute"  # Rate limit for requests
+RATE_LIMIT = os.getenv("RATE_LIMIT", "10/minute")  # Token bucket per key: burst size and refill rate
+RATE_LIMIT_KEYS = tuple(os.getenv("RATE_LIMIT_KEYS", "ip,sender").split(","))  # Each request is limited per client IP and/or sender_id
+RATE_LIMIT_DB_PATH = DB_DIR / "rate_limits.sqlite"  # Buckets shared by all worker processes
+RATE_LIMIT_PRUNE_EVERY = 1000  # Requests per worker between deletions of idle buckets
+MAX_BATCH_SIZE = 500  # Maximum messages in one /simulate_dm/batch request
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 16))  # Concurrent LLM calls per batch
+ADMIN_HEADER = "X-Admin-Token"  # Header carrying the admin token of /admin endpoints
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # Required value of the admin header, empty disables the /admin endpoints
+ADMIN_MAX_PRODUCTS = 1000  # Maximum products in one /admin/products request
 
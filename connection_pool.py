@@ -0,0 +1,149 @@
+"""
+Pooled SQLite connections
+"""
+import sqlite3
+import queue
+import threading
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional
+from contextlib import contextmanager
+
+from config import DB_POOL_TIMEOUT, DB_STATEMENT_CACHE_SIZE, DB_PRAGMAS
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """Bounded pool of reusable SQLite connections shared by the threads of one worker"""
+    
+    def __init__(
+        self,
+        db_path: Path,
+        size: int,
+        read_only: bool = False,
+        pragmas: Optional[Dict[str, Any]] = None,
+        timeout: float = DB_POOL_TIMEOUT,
+        cached_statements: int = DB_STATEMENT_CACHE_SIZE
+    ):
+        if size < 1:
+            raise ValueError("Connection pool size must be at least 1")
+        
+        self.db_path = db_path
+        self.size = size
+        self.read_only = read_only
+        self.pragmas = DB_PRAGMAS if pragmas is None else pragmas
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection and apply the configured pragmas"""
+        if self.read_only:
+            conn = sqlite3.connect(
+                f"file:{self.db_path}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+                cached_statements=self.cached_statements
+            )
+        else:
+            conn = sqlite3.connect(
+                self.db_path,
+                check_same_thread=False,
+                cached_statements=self.cached_statements
+            )
+        conn.row_factory = sqlite3.Row
+        
+        for name, value in self.pragmas.items():
+            # journal_mode is a property of the database file, only writers may change it
+            if self.read_only and name == "journal_mode":
+                continue
+            conn.execute(f"PRAGMA {name} = {value}")
+        
+        if self.read_only:
+            conn.execute("PRAGMA query_only = ON")
+        
+        return conn
+    
+    def acquire(self) -> sqlite3.Connection:
+        """Take an idle connection, opening a new one while under the pool size"""
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(
+                f"No database connection available after {self.timeout} seconds"
+            )
+    
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool, closing it if it is no longer usable"""
+        if self._closed:
+            conn.close()
+            return
+        
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding broken database connection: {e}")
+            with self._lock:
+                self._created -= 1
+            conn.close()
+            return
+        
+        self._idle.put_nowait(conn)
+    
+    @contextmanager
+    def connection(self):
+        """Context manager lending a pooled connection"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+    
+    def close(self):
+        """Close all idle connections; connections in use are closed when released"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+    
+    def stats(self) -> Dict[str, int]:
+        """Pool occupancy"""
+        idle = self._idle.qsize()
+        return {
+            "size": self.size,
+            "open": self._created,
+            "idle": idle,
+            "in_use": self._created - idle
+        }
@@ -0,0 +1,162 @@
+"""
+Bounded per-sender conversation context kept in memory
+"""
+import sys
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+from config import (
+    CONTEXT_MAX_SENDERS, CONTEXT_MAX_TURNS, CONTEXT_MAX_BYTES, CONTEXT_TTL_SECONDS
+)
+
+# (user message, bot reply); the reply is None until it is generated
+Turn = Tuple[str, Optional[str]]
+
+# Approximate bytes of one context and one turn besides their strings: the context
+# object, its ring buffer, the LRU slot and the turn tuple
+CONTEXT_OVERHEAD = 1000
+TURN_OVERHEAD = 100
+PRODUCT_ID_SIZE = 36
+
+
+class ConversationContext:
+    """Recent turns of one sender and the products retrieved for the last message"""
+    
+    __slots__ = ("turns", "product_ids", "updated_at", "size")
+    
+    def __init__(self, max_turns: int):
+        self.turns: Deque[Turn] = deque(maxlen=max_turns)
+        self.product_ids: Tuple[int, ...] = ()
+        self.updated_at = time.monotonic()
+        # Counted by the store once the first turn is added
+        self.size = 0
+    
+    def recompute_size(self, sender_id: str) -> int:
+        """Estimated memory of the context in bytes"""
+        self.size = (
+            CONTEXT_OVERHEAD
+            + sys.getsizeof(sender_id)
+            + sum(TURN_OVERHEAD + sys.getsizeof(text) + sys.getsizeof(reply) for text, reply in self.turns)
+            + PRODUCT_ID_SIZE * len(self.product_ids)
+        )
+        return self.size
+
+
+class ConversationStore:
+    """
+    Conversation contexts keyed by sender_id with LRU eviction
+    
+    Each context keeps at most max_turns turns in a ring buffer. Contexts are evicted
+    least recently used first whenever there are more than max_senders of them or
+    their estimated memory exceeds max_bytes, and contexts idle for longer than ttl
+    are ignored.
+    """
+    
+    def __init__(
+        self,
+        max_senders: int = CONTEXT_MAX_SENDERS,
+        max_turns: int = CONTEXT_MAX_TURNS,
+        max_bytes: int = CONTEXT_MAX_BYTES,
+        ttl: float = CONTEXT_TTL_SECONDS
+    ):
+        if max_senders < 1 or max_turns < 1:
+            raise ValueError("Conversation store needs room for at least one sender and turn")
+        
+        self.max_senders = max_senders
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._contexts: "OrderedDict[str, ConversationContext]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._contexts)
+    
+    def last_product_ids(self, sender_id: str) -> Tuple[int, ...]:
+        """Ids of the products retrieved for the sender's last message, if the conversation is recent"""
+        with self._lock:
+            context = self._live_context(sender_id)
+            return context.product_ids if context is not None else ()
+    
+    def turns(self, sender_id: str) -> List[Turn]:
+        """Recent turns of the sender, oldest first"""
+        with self._lock:
+            context = self._live_context(sender_id)
+            return list(context.turns) if context is not None else []
+    
+    def add_message(self, sender_id: str, text: str, product_ids: Sequence[int]):
+        """Start a turn with a user message and the products retrieved for it"""
+        with self._lock:
+            context = self._live_context(sender_id)
+            if context is None:
+                context = self._contexts[sender_id] = ConversationContext(self.max_turns)
+            
+            context.turns.append((text, None))
+            context.product_ids = tuple(product_ids)
+            self._touch(sender_id, context)
+    
+    def add_reply(self, sender_id: str, reply: str):
+        """Complete the sender's last turn with the bot reply"""
+        with self._lock:
+            context = self._contexts.get(sender_id)
+            if context is None or not context.turns:
+                return
+            
+            text, _ = context.turns[-1]
+            context.turns[-1] = (text, reply)
+            self._touch(sender_id, context)
+    
+    def clear(self):
+        """Remove all contexts"""
+        with self._lock:
+            self._contexts.clear()
+            self._bytes = 0
+    
+    def _live_context(self, sender_id: str) -> Optional[ConversationContext]:
+        """Context of the sender unless it expired, which removes it"""
+        context = self._contexts.get(sender_id)
+        if context is not None and time.monotonic() - context.updated_at > self.ttl:
+            self._remove(sender_id)
+            self.expirations += 1
+            return None
+        return context
+    
+    def _touch(self, sender_id: str, context: ConversationContext):
+        """Account for a changed context, mark it most recently used and enforce the limits"""
+        self._bytes -= context.size
+        self._bytes += context.recompute_size(sender_id)
+        context.updated_at = time.monotonic()
+        self._contexts.move_to_end(sender_id)
+        
+        while self._contexts and (len(self._contexts) > self.max_senders or self._bytes > self.max_bytes):
+            oldest = next(iter(self._contexts))
+            self._remove(oldest)
+            self.evictions += 1
+    
+    def _remove(self, sender_id: str):
+        context = self._contexts.pop(sender_id)
+        self._bytes -= context.size
+    
+    def memory_bytes(self) -> int:
+        """Estimated memory held by the contexts"""
+        return self._bytes
+    
+    def stats(self) -> Dict[str, Any]:
+        """Size, memory usage and eviction counters"""
+        with self._lock:
+            turns = sum(len(context.turns) for context in self._contexts.values())
+            return {
+                "senders": len(self._contexts),
+                "max_senders": self.max_senders,
+                "turns": turns,
+                "memory_bytes": self._bytes,
+                "max_memory_bytes": self.max_bytes,
+                "memory_usage": round(self._bytes / self.max_bytes, 4) if self.max_bytes else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
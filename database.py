@@ -1,24 +1,120 @@
 """
 SQLite database management
 """
+import math
+import time
 import sqlite3
+import threading
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Set, Tuple, Iterable, Iterator, Optional, Callable
 import logging
 from contextlib import contextmanager
 
-from config import DB_PATH, DB_DIR
+from config import (
+    DB_PATH, DB_DIR, DB_POOL_SIZE, DB_READ_POOL_SIZE, SAMPLE_CATALOG_PATH, IMPORT_BATCH_SIZE,
+    PRODUCT_LIST_BATCH_SIZE, PRICE_PERCENTILES, CATALOG_REFRESH_INTERVAL, CATALOG_CHANGES_RETAINED,
+    SEARCH_ENGINE, RETRIEVAL_CACHE_SIZE, FTS_NAME_WEIGHT, FTS_DESCRIPTION_WEIGHT,
+    FTS_BRAND_BOOST, FTS_OTHER_BOOST, FTS_CATEGORY_BOOST
+)
+from connection_pool import ConnectionPool
+from cache import LRUCache
+from search_index import ProductIndex
+from lexicon import get_lexicon
+from text_normalizer import normalize_text, token_string
+from catalog_reader import ProductRecord, read_catalog
+from metrics import observe_stage
 
 logger = logging.getLogger(__name__)
 
+# Columns added after the first release, created on older databases at startup
+ADDED_COLUMNS = {
+    "sku": "TEXT",
+    "name_normalized": "TEXT",
+    "description_normalized": "TEXT",
+    "name_tokens": "TEXT",
+    "description_tokens": "TEXT",
+}
+
+
+def query_keywords(query: str) -> List[str]:
+    """Split a query into normalized words, dropping stop words and single characters"""
+    return get_lexicon().keywords(normalize_text(query))
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query to its keywords, so near-identical messages compare equal"""
+    return " ".join(query_keywords(query))
+
+
+FTS_TRIGGERS = ("products_fts_ai", "products_fts_ad", "products_fts_au")
+CHANGE_TRIGGERS = ("catalog_changes_ai", "catalog_changes_ad", "catalog_changes_au")
+
+CATALOG_VERSION_SQL = "SELECT COALESCE(MAX(version), 0) FROM catalog_changes"
+
+PRODUCT_COLUMNS = "id, name, description, price, name_normalized, description_normalized, name_tokens, description_tokens"
+
+# Insert or update by id or sku, for the write API
+UPSERT_SQL = """
+    INSERT INTO products (
+        name, description, price,
+        name_normalized, description_normalized, name_tokens, description_tokens, sku, id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET
+        name = excluded.name,
+        description = excluded.description,
+        price = excluded.price,
+        name_normalized = excluded.name_normalized,
+        description_normalized = excluded.description_normalized,
+        name_tokens = excluded.name_tokens,
+        description_tokens = excluded.description_tokens,
+        sku = excluded.sku
+    ON CONFLICT (sku) DO UPDATE SET
+        name = excluded.name,
+        description = excluded.description,
+        price = excluded.price,
+        name_normalized = excluded.name_normalized,
+        description_normalized = excluded.description_normalized,
+        name_tokens = excluded.name_tokens,
+        description_tokens = excluded.description_tokens
+    RETURNING id
+"""
+
+
+def normalized_product(name: str, description: str, price: float) -> Tuple:
+    """Product row followed by its normalized and tokenized columns"""
+    name_normalized = normalize_text(name)
+    description_normalized = normalize_text(description)
+    return (
+        name, description, price,
+        name_normalized, description_normalized,
+        token_string(name_normalized), token_string(description_normalized)
+    )
+
 
 class Database:
     """Database management class"""
     
-    def __init__(self, db_path: Path = DB_PATH):
+    SEARCH_ENGINES = ("python", "fts")
+    
+    def __init__(self, db_path: Path = DB_PATH, search_engine: str = SEARCH_ENGINE, sample_data: bool = True):
+        if search_engine not in self.SEARCH_ENGINES:
+            raise ValueError(f"Unknown search engine: {search_engine}")
+        
         self.db_path = db_path
+        self.search_engine = search_engine
+        self.fts_available = False
+        self.pool = ConnectionPool(db_path, DB_POOL_SIZE)
+        self.read_pool = ConnectionPool(db_path, DB_READ_POOL_SIZE, read_only=True)
+        self._index: Optional[ProductIndex] = None
+        self._index_lock = threading.Lock()
+        self._catalog_version = 0
+        self._next_catalog_check = 0.0
+        self._change_listeners: List[Callable[[Optional[Set[int]]], None]] = []
+        # Search results by analyzed keywords, limit and catalog version
+        self.retrieval_cache = LRUCache(RETRIEVAL_CACHE_SIZE) if RETRIEVAL_CACHE_SIZE > 0 else None
         self._ensure_db_directory()
-        self._init_db()
+        self._init_db(sample_data)
+        self._catalog_version = self._read_catalog_version()
     
     def _ensure_db_directory(self):
         """Ensure database directory exists"""
@@ -27,19 +123,38 @@ class Database:
     @contextmanager
     def get_connection(self):
         """Context manager for secure database connection management"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        try:
-            yield conn
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Database transaction error: {e}")
-            raise
-        finally:
-            conn.close()
+        with self.pool.connection() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Database transaction error: {e}")
+                raise
+    
+    @contextmanager
+    def get_read_connection(self):
+        """Context manager for a pooled read-only connection (search and listing queries)"""
+        with self.read_pool.connection() as conn:
+            try:
+                yield conn
+            except Exception as e:
+                logger.error(f"Database read error: {e}")
+                raise
+    
+    def pool_stats(self) -> Dict[str, Dict[str, int]]:
+        """Occupancy of the read-write and read-only connection pools"""
+        return {
+            "write": self.pool.stats(),
+            "read": self.read_pool.stats()
+        }
+    
+    def close(self):
+        """Close all pooled connections"""
+        self.pool.close()
+        self.read_pool.close()
     
-    def _init_db(self):
+    def _init_db(self, sample_data: bool = True):
         """Create products table if it doesn't exist"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
@@ -48,342 +163,719 @@ class Database:
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     name TEXT NOT NULL,
                     description TEXT,
-                    price REAL NOT NULL
+                    price REAL NOT NULL,
+                    sku TEXT,
+                    name_normalized TEXT,
+                    description_normalized TEXT,
+                    name_tokens TEXT,
+                    description_tokens TEXT
                 )
             """)
             
+            self._migrate_columns(cursor)
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS products_sku ON products (sku)")
+            # Lets the price percentiles in catalog_stats walk the index instead of sorting
+            cursor.execute("CREATE INDEX IF NOT EXISTS products_price ON products (price)")
+            self._init_change_log(cursor)
+            self.fts_available = self._init_fts(cursor)
+            
             # Check if data exists
             cursor.execute("SELECT COUNT(*) FROM products")
             count = cursor.fetchone()[0]
-            
-            if count == 0:
-                logger.info("Database is empty. Adding sample data...")
-                self._populate_sample_data()
+        
+        if count == 0 and sample_data:
+            logger.info("Database is empty. Adding sample data...")
+            self._populate_sample_data()
     
-    def _populate_sample_data(self):
-        """Add 100+ sample products to database"""
-        sample_products = [
-            # گوشی‌های موبایل
-            ("گوشی سامسونگ Galaxy S23", "گوشی پرچمدار سامسونگ با پردازنده Snapdragon 8 Gen 2، صفحه نمایش 6.1 اینچ، دوربین 50 مگاپیکسل", 35000000),
-            ("گوشی اپل iPhone 14 Pro", "آیفون پرچمدار با تراشه A16 Bionic، صفحه نمایش ProMotion 6.1 اینچ، دوربین 48 مگاپیکسل", 55000000),
-            ("گوشی شیائومی Redmi Note 12", "گوشی میان‌رده با پردازنده Snapdragon 685، صفحه نمایش 6.67 اینچ AMOLED، دوربین 50 مگاپیکسل", 8500000),
-            ("گوشی سامسونگ Galaxy A54", "گوشی میان‌رده با پردازنده Exynos 1380، صفحه نمایش 6.4 اینچ Super AMOLED", 14500000),
-            ("گوشی اپل iPhone 13", "آیفون با تراشه A15 Bionic، صفحه نمایش 6.1 اینچ، دوربین دوگانه 12 مگاپیکسل", 42000000),
-            ("گوشی شیائومی Poco X5 Pro", "گوشی گیمینگ با پردازنده Snapdragon 778G، صفحه نمایش 120Hz", 9500000),
-            ("گوشی سامسونگ Galaxy Z Fold 5", "گوشی تاشو پرچمدار با صفحه نمایش 7.6 اینچ داخلی و 6.2 اینچ خارجی", 75000000),
-            ("گوشی اپل iPhone SE 2022", "آیفون مقرون به صرفه با تراشه A15 Bionic و Touch ID", 18000000),
-            ("گوشی شیائومی Mi 13 Pro", "گوشی پرچمدار با دوربین Leica، پردازنده Snapdragon 8 Gen 2", 38000000),
-            ("گوشی گوگل Pixel 7", "گوشی با تراشه Google Tensor G2 و دوربین محاسباتی پیشرفته", 28000000),
-            
-            # لپ‌تاپ‌ها
-            ("لپ‌تاپ Dell XPS 13", "لپ‌تاپ نازک و سبک با پردازنده Intel Core i7 نسل 12، رم 16GB، SSD 512GB", 45000000),
-            ("لپ‌تاپ MacBook Air M2", "لپ‌تاپ اپل با تراشه M2، صفحه نمایش Liquid Retina 13.6 اینچ", 52000000),
-            ("لپ‌تاپ HP Pavilion 15", "لپ‌تاپ همه‌کاره با پردازنده AMD Ryzen 5، رم 8GB، SSD 256GB", 18000000),
-            ("لپ‌تاپ Lenovo ThinkPad X1", "لپ‌تاپ بیزینس با پردازنده Intel Core i7، رم 16GB، صفحه نمایش 14 اینچ", 48000000),
-            ("لپ‌تاپ Asus ROG Strix G15", "لپ‌تاپ گیمینگ با پردازنده AMD Ryzen 9، کارت گرافیک RTX 3070", 65000000),
-            ("لپ‌تاپ MacBook Pro 14", "لپ‌تاپ پرچمدار اپل با تراشه M2 Pro، صفحه نمایش Liquid Retina XDR", 95000000),
-            ("لپ‌تاپ Acer Aspire 5", "لپ‌تاپ مقرون به صرفه با پردازنده Intel Core i5 نسل 11، رم 8GB", 15000000),
-            ("لپ‌تاپ MSI Creator Z16", "لپ‌تاپ کریتور با صفحه نمایش لمسی، پردازنده Intel Core i9", 85000000),
-            ("لپ‌تاپ Microsoft Surface Laptop 5", "لپ‌تاپ با طراحی منحصر به فرد و صفحه نمایش لمسی", 42000000),
-            ("لپ‌تاپ Razer Blade 15", "لپ‌تاپ گیمینگ نازک با کارت گرافیک RTX 4070", 95000000),
-            
-            # تبلت‌ها
-            ("تبلت iPad Air 2022", "تبلت اپل با تراشه M1، صفحه نمایش 10.9 اینچ Liquid Retina", 28000000),
-            ("تبلت Samsung Galaxy Tab S9", "تبلت اندروید پرچمدار با صفحه نمایش 11 اینچ AMOLED", 32000000),
-            ("تبلت iPad Pro 12.9", "تبلت حرفه‌ای اپل با تراشه M2، صفحه نمایش Liquid Retina XDR", 58000000),
-            ("تبلت Samsung Galaxy Tab A8", "تبلت مقرون به صرفه با صفحه نمایش 10.5 اینچ", 8500000),
-            ("تبلت Lenovo Tab P11 Pro", "تبلت اندروید با صفحه نمایش 11.5 اینچ OLED", 15000000),
-            
-            # ساعت هوشمند
-            ("ساعت هوشمند Apple Watch Series 8", "ساعت هوشمند با سنسورهای سلامتی پیشرفته، صفحه نمایش Always-On", 18000000),
-            ("ساعت هوشمند Samsung Galaxy Watch 6", "ساعت هوشمند اندروید با ردیابی سلامتی و GPS", 12000000),
-            ("ساعت هوشمند Garmin Fenix 7", "ساعت هوشمند ورزشی با GPS و نقشه توپوگرافی", 25000000),
-            ("ساعت هوشمند Xiaomi Mi Band 8", "مچ‌بند هوشمند مقرون به صرفه با ردیابی فعالیت", 1200000),
-            ("ساعت هوشمند Huawei Watch GT 3", "ساعت هوشمند با عمر باتری طولانی و طراحی کلاسیک", 8500000),
-            
-            # هدفون و ایرپاد
-            ("ایرپاد Apple AirPods Pro 2", "ایرپاد با حذف نویز فعال، صدای فضایی، باتری تا 6 ساعت", 12000000),
-            ("هدفون Sony WH-1000XM5", "هدفون بی‌سیم با بهترین حذف نویز، صدای Hi-Res", 15000000),
-            ("ایرپاد Samsung Galaxy Buds 2 Pro", "ایرپاد پرچمدار با حذف نویز هوشمند، صدای 360 درجه", 6500000),
-            ("هدفون Bose QuietComfort 45", "هدفون با حذف نویز برتر و راحتی بالا", 14000000),
-            ("ایرپاد JBL Wave 200TWS", "ایرپاد مقرون به صرفه با کیفیت صدای خوب", 2200000),
-            ("هدفون Audio-Technica ATH-M50x", "هدفون استودیویی حرفه‌ای با صدای دقیق", 6500000),
-            
-            # دوربین
-            ("دوربین Canon EOS R6 Mark II", "دوربین بدون آینه فول فریم با سنسور 24 مگاپیکسل", 125000000),
-            ("دوربین Sony Alpha A7 IV", "دوربین حرفه‌ای با سنسور 33 مگاپیکسل، فیلمبرداری 4K", 135000000),
-            ("دوربین Nikon Z6 II", "دوربین بدون آینه با سنسور 24.5 مگاپیکسل", 95000000),
-            ("دوربین Fujifilm X-T5", "دوربین APS-C با سنسور 40 مگاپیکسل", 78000000),
-            ("دوربین GoPro Hero 11", "دوربین اکشن با قابلیت فیلمبرداری 5.3K", 18000000),
-            ("دوربین DJI Osmo Action 3", "دوربین اکشن با صفحه نمایش دوگانه", 15000000),
-            
-            # کنسول بازی
-            ("کنسول Sony PlayStation 5", "کنسول نسل نهمی با SSD فوق سریع و کنترلر DualSense", 28000000),
-            ("کنسول Microsoft Xbox Series X", "کنسول قدرتمند با پشتیبانی 4K و 120fps", 25000000),
-            ("کنسول Nintendo Switch OLED", "کنسول هیبریدی با صفحه نمایش 7 اینچ OLED", 15000000),
-            ("کنسول Steam Deck", "کنسول دستی PC گیمینگ", 22000000),
-            
-            # اسپیکر
-            ("اسپیکر JBL Charge 5", "اسپیکر بلوتوث ضد آب با باتری 20 ساعته", 5500000),
-            ("اسپیکر Sony SRS-XB43", "اسپیکر قدرتمند با بیس عمیق و نورپردازی LED", 7500000),
-            ("اسپیکر Bose SoundLink Revolve+", "اسپیکر 360 درجه با صدای استریو", 12000000),
-            ("اسپیکر Marshall Emberton II", "اسپیکر با طراحی کلاسیک و صدای قدرتمند", 6800000),
-            ("اسپیکر Amazon Echo Dot 5", "اسپیکر هوشمند با دستیار صوتی Alexa", 2500000),
-            
-            # مانیتور
-            ("مانیتور Dell UltraSharp U2723DE", "مانیتور 27 اینچ 4K با پنل IPS و USB-C", 22000000),
-            ("مانیتور LG UltraGear 27GN950", "مانیتور گیمینگ 27 اینچ 4K با 144Hz", 28000000),
-            ("مانیتور Samsung Odyssey G7", "مانیتور گیمینگ منحنی 32 اینچ با 240Hz", 32000000),
-            ("مانیتور ASUS ProArt PA278QV", "مانیتور حرفه‌ای 27 اینچ برای طراحی", 18000000),
-            ("مانیتور BenQ PD2700U", "مانیتور 27 اینچ 4K برای طراحان", 16000000),
-            
-            # کیبورد و ماوس
-            ("کیبورد مکانیکال Keychron K2", "کیبورد مکانیکال بی‌سیم با سوئیچ‌های Gateron", 4500000),
-            ("کیبورد Logitech MX Keys", "کیبورد بی‌سیم پرمیوم با نورپردازی هوشمند", 5200000),
-            ("ماوس Logitech MX Master 3S", "ماوس ارگونومیک بی‌سیم با دقت بالا", 4200000),
-            ("ماوس Razer DeathAdder V3", "ماوس گیمینگ با سنسور 30000 DPI", 3500000),
-            ("کیبورد Corsair K70 RGB", "کیبورد مکانیکال گیمینگ با نورپردازی RGB", 6500000),
-            
-            # شارژر و پاوربانک
-            ("شارژر Anker PowerPort III", "شارژر سریع 65 وات با 3 پورت USB", 1800000),
-            ("پاوربانک Xiaomi 20000mAh", "پاوربانک با ظرفیت بالا و شارژ سریع 33W", 1500000),
-            ("پاوربانک Anker PowerCore 26800", "پاوربانک قدرتمند با 3 پورت خروجی", 2800000),
-            ("شارژر Apple MagSafe", "شارژر بی‌سیم 15 وات برای آیفون", 2200000),
-            ("شارژر Samsung 45W Super Fast", "شارژر سریع سامسونگ با کابل USB-C", 1200000),
-            
-            # روتر و شبکه
-            ("روتر TP-Link Archer AX73", "روتر WiFi 6 با سرعت تا 5400 Mbps", 4500000),
-            ("روتر ASUS RT-AX86U", "روتر گیمینگ WiFi 6 با پورت 2.5G", 8500000),
-            ("روتر Xiaomi AX3000", "روتر مقرون به صرفه با WiFi 6", 1500000),
-            ("مش وایفای Google Nest WiFi", "سیستم مش وایفای با پوشش گسترده", 12000000),
-            
-            # هارد و SSD
-            ("هارد اکسترنال WD My Passport 2TB", "هارد اکسترنال قابل حمل با USB 3.2", 3500000),
-            ("SSD اکسترنال Samsung T7 1TB", "SSD خارجی سریع با سرعت تا 1050 MB/s", 5200000),
-            ("هارد اکسترنال Seagate Expansion 4TB", "هارد اکسترنال با ظرفیت بالا", 4800000),
-            ("SSD داخلی Samsung 980 PRO 1TB", "SSD NVMe با سرعت بالا", 4500000),
-            
-            # کابل و لوازم جانبی
-            ("کابل HDMI Belkin Ultra High Speed", "کابل HDMI 2.1 با پشتیبانی 8K", 850000),
-            ("کابل USB-C Anker Powerline III", "کابل USB-C با طول عمر بالا", 650000),
-            ("هاب USB-C Anker 7-in-1", "هاب چندکاره با HDMI، USB، و SD Card", 2200000),
-            ("پایه لپ‌تاپ Rain Design mStand", "پایه آلومینیومی ارگونومیک", 2500000),
-            
-            # چاپگر و اسکنر
-            ("چاپگر HP LaserJet Pro M404dn", "چاپگر لیزری سیاه و سفید", 12000000),
-            ("چاپگر Canon PIXMA G6020", "چاپگر جوهرافشان رنگی با مخزن", 9500000),
-            ("چاپگر Epson EcoTank L3250", "چاپگر سه‌کاره با مخزن جوهر", 7500000),
-            ("اسکنر Fujitsu ScanSnap iX1600", "اسکنر اسناد با سرعت بالا", 18000000),
+    def _migrate_columns(self, cursor: sqlite3.Cursor):
+        """Add new columns to an older products table and normalize rows missing them"""
+        cursor.execute("PRAGMA table_info(products)")
+        existing = {row["name"] for row in cursor.fetchall()}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in existing:
+                logger.info(f"Adding column {column} to products")
+                cursor.execute(f"ALTER TABLE products ADD COLUMN {column} {column_type}")
+        
+        # Rows written before the migration (or by other tools) are normalized here
+        cursor.execute("SELECT id, name, description, price FROM products WHERE name_tokens IS NULL")
+        rows = cursor.fetchall()
+        if rows:
+            logger.info(f"Normalizing {len(rows)} products...")
+            cursor.executemany(
+                """
+                UPDATE products
+                SET name_normalized = ?, description_normalized = ?, name_tokens = ?, description_tokens = ?
+                WHERE id = ?
+                """,
+                [normalized_product(row["name"], row["description"], row["price"])[3:] + (row["id"],) for row in rows]
+            )
+    
+    def _init_change_log(self, cursor: sqlite3.Cursor):
+        """
+        Create the catalog change log and the triggers filling it
+        
+        Every inserted, updated or deleted product adds a row, whose AUTOINCREMENT key
+        is the catalog version. A row without product_id stands for a change of the
+        whole catalog (a bulk import).
+        """
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_changes (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id INTEGER
+            )
+        """)
+        self._create_change_triggers(cursor)
+    
+    def _create_change_triggers(self, cursor: sqlite3.Cursor):
+        """Create the triggers recording product changes in the change log"""
+        cursor.executescript("""
+            CREATE TRIGGER IF NOT EXISTS catalog_changes_ai AFTER INSERT ON products BEGIN
+                INSERT INTO catalog_changes (product_id) VALUES (new.id);
+            END;
             
-            # وب‌کم و میکروفون
-            ("وب‌کم Logitech C920 HD Pro", "وب‌کم 1080p با میکروفون استریو", 3200000),
-            ("وب‌کم Razer Kiyo Pro", "وب‌کم حرفه‌ای با سنسور بزرگ", 5500000),
-            ("میکروفون Blue Yeti", "میکروفون USB حرفه‌ای برای استریم و پادکست", 6500000),
-            ("میکروفون HyperX QuadCast S", "میکروفون استریم با نورپردازی RGB", 7200000),
+            CREATE TRIGGER IF NOT EXISTS catalog_changes_ad AFTER DELETE ON products BEGIN
+                INSERT INTO catalog_changes (product_id) VALUES (old.id);
+            END;
             
-            # لوازم جانبی موبایل
-            ("قاب محافظ Spigen Ultra Hybrid", "قاب شفاف محافظ برای گوشی‌های مختلف", 450000),
-            ("گلس محافظ صفحه Belkin ScreenForce", "گلس تمپرد با ضربه‌گیر", 350000),
-            ("پایه نگهدارنده موبایل Anker MagGo", "پایه مگنتی برای آیفون", 1200000),
-            ("رینگ لایت Neewer 18 اینچ", "رینگ لایت برای عکاسی و ویدیو", 2800000),
+            CREATE TRIGGER IF NOT EXISTS catalog_changes_au AFTER UPDATE ON products BEGIN
+                INSERT INTO catalog_changes (product_id) SELECT old.id WHERE old.id != new.id;
+                INSERT INTO catalog_changes (product_id) VALUES (new.id);
+            END;
+        """)
+    
+    def _init_fts(self, cursor: sqlite3.Cursor) -> bool:
+        """Create the FTS5 index over the normalized columns and the triggers keeping it in sync"""
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+        row = cursor.fetchone()
+        exists = row is not None
+        
+        # Triggers are missing if a bulk import was interrupted, the index must be rebuilt
+        cursor.execute(
+            f"SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN ({', '.join('?' * len(FTS_TRIGGERS))})",
+            FTS_TRIGGERS
+        )
+        in_sync = cursor.fetchone()[0] == len(FTS_TRIGGERS)
+        
+        if exists and "name_normalized" not in row["sql"]:
+            logger.info("Dropping FTS index over raw product text")
+            cursor.executescript("""
+                DROP TRIGGER IF EXISTS products_fts_ai;
+                DROP TRIGGER IF EXISTS products_fts_ad;
+                DROP TRIGGER IF EXISTS products_fts_au;
+                DROP TABLE products_fts;
+            """)
+            exists = False
+            in_sync = False
+        
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                    name_normalized, description_normalized, content='products', content_rowid='id'
+                )
+            """)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 is not available, falling back to Python search: {e}")
+            return False
+        
+        self._create_fts_triggers(cursor)
+        
+        if not exists or not in_sync:
+            logger.info("Building FTS index for existing products...")
+            cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+        
+        return True
+    
+    def _create_fts_triggers(self, cursor: sqlite3.Cursor):
+        """Create the triggers keeping the FTS index in sync with the products table"""
+        cursor.executescript("""
+            CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+                INSERT INTO products_fts(rowid, name_normalized, description_normalized)
+                VALUES (new.id, new.name_normalized, new.description_normalized);
+            END;
             
-            # گجت‌های هوشمند
-            ("دستیار صوتی Amazon Echo Show 10", "نمایشگر هوشمند با چرخش خودکار", 12000000),
-            ("لامپ هوشمند Philips Hue", "لامپ LED هوشمند با 16 میلیون رنگ", 2200000),
-            ("پریز هوشمند TP-Link Kasa", "پریز هوشمند با کنترل از راه دور", 850000),
-            ("ترموستات هوشمند Nest Learning", "ترموستات یادگیرنده با صرفه‌جویی انرژی", 8500000),
+            CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+                INSERT INTO products_fts(products_fts, rowid, name_normalized, description_normalized)
+                VALUES ('delete', old.id, old.name_normalized, old.description_normalized);
+            END;
             
-            # دوچرخه برقی و اسکوتر
-            ("اسکوتر برقی Xiaomi Mi Electric Scooter 3", "اسکوتر برقی با برد 30 کیلومتر", 15000000),
-            ("دوچرخه برقی Fiido D11", "دوچرخه برقی تاشو با باتری لیتیومی", 22000000),
+            CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE ON products BEGIN
+                INSERT INTO products_fts(products_fts, rowid, name_normalized, description_normalized)
+                VALUES ('delete', old.id, old.name_normalized, old.description_normalized);
+                INSERT INTO products_fts(rowid, name_normalized, description_normalized)
+                VALUES (new.id, new.name_normalized, new.description_normalized);
+            END;
+        """)
+    
+    def _populate_sample_data(self):
+        """Add the sample catalog (100+ products) to database"""
+        count = self.import_products(read_catalog(SAMPLE_CATALOG_PATH))
+        logger.info(f"{count} products successfully added to database.")
+    
+    def import_products(
+        self,
+        records: Iterable[ProductRecord],
+        batch_size: int = IMPORT_BATCH_SIZE,
+        progress: Optional[Callable[[int], None]] = None
+    ) -> int:
+        """
+        Bulk insert (sku, name, description, price) records, updating products with the same sku
+        
+        Records are consumed as a stream and written in executemany transactions of
+        batch_size rows. The FTS triggers are dropped during the import and the FTS
+        index is rebuilt once at the end, even if the import fails part way.
+        
+        Args:
+            records: Products to write; records without sku are always inserted
+            batch_size: Rows per transaction
+            progress: Called with the number of rows written after each batch
+        
+        Returns:
+            Number of records written
+        """
+        written = 0
+        with self.pool.connection() as conn:
+            # Logging every row would make the change log as large as the import
+            triggers = CHANGE_TRIGGERS + (FTS_TRIGGERS if self.fts_available else ())
+            conn.executescript("".join(f"DROP TRIGGER IF EXISTS {trigger};" for trigger in triggers))
             
-            # عینک هوشمند
-            ("عینک هوشمند Meta Ray-Ban", "عینک هوشمند با دوربین و اسپیکر", 18000000),
+            try:
+                batch = []
+                for sku, name, description, price in records:
+                    batch.append(normalized_product(name, description, price) + (sku,))
+                    if len(batch) >= batch_size:
+                        written += self._write_import_batch(conn, batch)
+                        batch = []
+                        if progress is not None:
+                            progress(written)
+                
+                if batch:
+                    written += self._write_import_batch(conn, batch)
+                    if progress is not None:
+                        progress(written)
             
-            # ربات جاروبرقی
-            ("ربات جاروبرقی Roborock S7", "ربات جاروبرقی با قابلیت دستمال زدن", 18000000),
-            ("ربات جاروبرقی Xiaomi Mi Robot Vacuum", "ربات جاروبرقی با ناوبری لیزری", 8500000),
-        ]
+            finally:
+                conn.rollback()
+                self._create_change_triggers(conn.cursor())
+                # Readers at any earlier version reload the whole catalog, so the log can be truncated
+                conn.execute("DELETE FROM catalog_changes")
+                conn.execute("INSERT INTO catalog_changes (product_id) VALUES (NULL)")
+                conn.commit()
+                if self.fts_available:
+                    with observe_stage("fts_rebuild"):
+                        self._create_fts_triggers(conn.cursor())
+                        conn.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+                        conn.commit()
+        
+        self.refresh_catalog()
+        return written
+    
+    def _write_import_batch(self, conn: sqlite3.Connection, batch: List[Tuple]) -> int:
+        """Upsert one batch of normalized import rows in a single transaction"""
+        conn.executemany(
+            """
+            INSERT INTO products (
+                name, description, price,
+                name_normalized, description_normalized, name_tokens, description_tokens, sku
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (sku) DO UPDATE SET
+                name = excluded.name,
+                description = excluded.description,
+                price = excluded.price,
+                name_normalized = excluded.name_normalized,
+                description_normalized = excluded.description_normalized,
+                name_tokens = excluded.name_tokens,
+                description_tokens = excluded.description_tokens
+            """,
+            batch
+        )
+        conn.commit()
+        return len(batch)
+    
+    def upsert_products(self, products: Iterable[Dict[str, Any]]) -> List[int]:
+        """
+        Insert or update products in one transaction and return their ids
+        
+        A product with an id replaces the product with that id, otherwise one with a
+        sku replaces the product with that sku; other products are inserted.
         
+        Args:
+            products: Dicts with name, description, price and optional id and sku
+        
+        Returns:
+            Ids of the written products, in input order
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.executemany(
-                "INSERT INTO products (name, description, price) VALUES (?, ?, ?)",
-                sample_products
+            product_ids = [
+                cursor.execute(
+                    UPSERT_SQL,
+                    normalized_product(product["name"], product.get("description"), product["price"])
+                    + (product.get("sku"), product.get("id"))
+                ).fetchone()[0]
+                for product in products
+            ]
+        
+        self.refresh_catalog()
+        return product_ids
+    
+    def delete_products(self, product_ids: Iterable[int]) -> int:
+        """Delete products by id in one transaction and return how many existed"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            deleted = sum(
+                cursor.execute("DELETE FROM products WHERE id = ?", (product_id,)).rowcount
+                for product_id in set(product_ids)
             )
-            logger.info(f"{len(sample_products)} products successfully added to database.")
+        
+        self.refresh_catalog()
+        return deleted
     
-    def search_products(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
-        """Search products based on keywords with intelligent scoring"""
-        query_cleaned = query.strip().lower()
+    @property
+    def catalog_version(self) -> int:
+        """Catalog version this process has caught up with"""
+        return self._catalog_version
+    
+    def add_change_listener(self, listener: Callable[[Optional[Set[int]]], None]):
+        """
+        Call listener with the ids of changed products whenever a catalog change is picked up
         
-        stop_words = {
-            'قیمت', 'چقدر', 'چقدره', 'چند', 'چنده', 'کدوم', 'کدام', 
-            'میخوام', 'میخواهم', 'بگو', 'بگید', 'لطفا', 'لطفاً',
-            'چیه', 'چیست', 'هست', 'است', 'دارید', 'داره', 'دارد',
-            'برای', 'تو', 'در', 'با', 'از', 'به', 'را', 'رو'
-        }
+        The ids are None when the whole catalog may have changed. Listeners run in the
+        thread that picked up the change and must not call back into the database.
+        """
+        self._change_listeners.append(listener)
+    
+    def _read_catalog_version(self) -> int:
+        with self.get_read_connection() as conn:
+            return conn.execute(CATALOG_VERSION_SQL).fetchone()[0]
+    
+    def refresh_catalog(self) -> int:
+        """
+        Pick up catalog changes now, waiting for a refresh in progress, and return the version
         
-        category_words = {
-            'گوشی', 'موبایل', 'تلفن',
-            'لپتاپ', 'لپ‌تاپ', 'نوتبوک',
-            'تبلت', 
-            'ساعت', 'هدفون', 'ایرپاد',
-            'دوربین', 'کنسول', 'اسپیکر',
-            'مانیتور', 'کیبورد', 'ماوس',
-            'شارژر', 'پاوربانک', 'روتر',
-            'هارد', 'چاپگر', 'اسکنر',
-        }
+        Called after writes, which also prune the change log: only the last
+        CATALOG_CHANGES_RETAINED changes are kept for other workers to catch up with.
+        """
+        with self._index_lock:
+            self._refresh_catalog()
+            self._next_catalog_check = time.monotonic() + CATALOG_REFRESH_INTERVAL
+        self._prune_catalog_changes(self._catalog_version - CATALOG_CHANGES_RETAINED)
+        return self._catalog_version
+    
+    def _prune_catalog_changes(self, up_to_version: int):
+        """Delete change log entries at or below up_to_version, keeping the latest one"""
+        if up_to_version <= 0:
+            return
+        with self.get_connection() as conn:
+            conn.execute(
+                "DELETE FROM catalog_changes WHERE version <= ? AND version < (SELECT MAX(version) FROM catalog_changes)",
+                (up_to_version,)
+            )
+    
+    def check_catalog(self):
+        """
+        Pick up changes written by other processes, at most every CATALOG_REFRESH_INTERVAL
         
-        brand_identifiers = {
-            'آیفون': ['آیفون', 'iphone', 'ایفون'],
-            'اپل': ['اپل', 'apple'],
-            'مک': ['مک', 'mac', 'macbook', 'مکبوک', 'بوک'],
-            'سامسونگ': ['سامسونگ', 'samsung'],
-            'گلکسی': ['گلکسی', 'galaxy'],
-            'شیائومی': ['شیائومی', 'xiaomi', 'شائومی'],
-            'می': ['می'],
-            'ردمی': ['ردمی', 'redmi'],
-            'دل': ['dell', 'دل'],
-            'اچ پی': ['hp', 'اچ‌پی'],
-            'لنوو': ['lenovo', 'لنوو'],
-            'ایسوس': ['asus', 'ایسوس'],
-            'ایسر': ['acer', 'ایسر'],
-            'ام اس آی': ['msi', 'ام‌اس‌آی'],
-            'مایکروسافت': ['microsoft', 'surface', 'مایکروسافت'],
-            'گوگل': ['google', 'pixel', 'گوگل'],
-            'سونی': ['sony', 'سونی'],
-            'نیکون': ['nikon', 'نیکون'],
-            'کانن': ['canon', 'کانن'],
-        }
+        Searches never wait here: if another thread is already refreshing, the search
+        goes on with the current snapshot.
+        """
+        if time.monotonic() < self._next_catalog_check or not self._index_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_catalog_check = time.monotonic() + CATALOG_REFRESH_INTERVAL
+            self._refresh_catalog()
+        except Exception as e:
+            logger.error(f"Error refreshing catalog snapshot: {e}")
+        finally:
+            self._index_lock.release()
+    
+    def _refresh_catalog(self):
+        """
+        Read changes since the last version seen and swap in an updated search snapshot
         
-        raw_keywords = [word for word in query_cleaned.split() if len(word) > 1 and word not in stop_words]
+        Changed rows are read in the same transaction as the version, and the new
+        snapshot replaces the old one with a single assignment: searches holding the
+        old snapshot finish on it unchanged. Called with _index_lock held.
+        """
+        index = self._index
+        with self.get_read_connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                version = conn.execute(CATALOG_VERSION_SQL).fetchone()[0]
+                if version == self._catalog_version and (index is None or index.version == version):
+                    return
+                
+                since = self._catalog_version if index is None else min(self._catalog_version, index.version)
+                changes = conn.execute(
+                    "SELECT version, product_id FROM catalog_changes WHERE version > ? ORDER BY version", (since,)
+                ).fetchall()
+                # The version going back means the database was replaced; a gap after
+                # since means the changes this process missed were already pruned
+                reload_all = (
+                    version < since
+                    or (changes and changes[0][0] > since + 1)
+                    or any(product_id is None for _, product_id in changes)
+                )
+                changed_ids = {product_id for _, product_id in changes if product_id is not None}
+                
+                if index is not None:
+                    with observe_stage("catalog_snapshot_update"):
+                        if reload_all:
+                            rows = conn.execute(f"SELECT {PRODUCT_COLUMNS} FROM products ORDER BY id")
+                            index = ProductIndex(rows, version)
+                        else:
+                            index_ids = {product_id for change, product_id in changes if change > index.version}
+                            index = self._updated_index(conn, index, index_ids, version)
+            finally:
+                conn.rollback()
         
-        brand_keywords = []
-        category_keywords = []
-        other_keywords = []
+        self._index = index
+        previous = self._catalog_version
+        self._catalog_version = version
+        if self.retrieval_cache is not None:
+            # Entries of older versions can no longer be hit
+            self.retrieval_cache.clear()
+        logger.info(
+            f"Catalog version {previous} -> {version}: "
+            + ("full reload" if reload_all else f"{len(changed_ids)} changed products")
+        )
         
-        for keyword in raw_keywords:
-            is_brand = False
-            for brand_name, variants in brand_identifiers.items():
-                if keyword in variants:
-                    brand_keywords.extend(variants)
-                    is_brand = True
-                    break
-            
-            if not is_brand:
-                if keyword in category_words:
-                    category_keywords.append(keyword)
-                else:
-                    other_keywords.append(keyword)
+        for listener in self._change_listeners:
+            try:
+                listener(None if reload_all else changed_ids)
+            except Exception as e:
+                logger.error(f"Error in catalog change listener: {e}")
+    
+    @staticmethod
+    def _updated_index(conn: sqlite3.Connection, index: ProductIndex, product_ids: Set[int], version: int) -> ProductIndex:
+        """Copy of index with the current rows of product_ids"""
+        rows = []
+        id_list = list(product_ids)
+        # Stays below SQLite's limit on bound parameters
+        for start in range(0, len(id_list), 500):
+            chunk = id_list[start:start + 500]
+            rows += conn.execute(
+                f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id IN ({', '.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+        deleted_ids = product_ids - {row["id"] for row in rows}
+        return index.apply_changes(rows, deleted_ids, version)
+    
+    def _get_index(self) -> ProductIndex:
+        """Return the current search snapshot, building it on first use"""
+        index = self._index
+        if index is not None:
+            return index
         
-        brand_keywords = list(set(brand_keywords))
-        category_keywords = list(set(category_keywords))
-        other_keywords = list(set(other_keywords))
+        with self._index_lock:
+            if self._index is None:
+                with self.get_read_connection() as conn, observe_stage("search_sql_fetch"):
+                    conn.execute("BEGIN")
+                    try:
+                        version = conn.execute(CATALOG_VERSION_SQL).fetchone()[0]
+                        rows = conn.execute(f"SELECT {PRODUCT_COLUMNS} FROM products ORDER BY id").fetchall()
+                    finally:
+                        conn.rollback()
+                with observe_stage("search_index_build"):
+                    self._index = ProductIndex(rows, version)
+                logger.info(f"Search index built with {len(self._index)} products at catalog version {version}")
+            return self._index
+    
+    def _analyze_query(self, query: str) -> Tuple[List[str], List[str], List[str]]:
+        """Split query into brand, category and other keywords"""
+        return get_lexicon().analyze(query)
+    
+    @observe_stage("search_products")
+    def search_products(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Search products based on keywords with intelligent scoring"""
+        brand_keywords, category_keywords, other_keywords = self._analyze_query(query)
         
         unique_keywords = brand_keywords + other_keywords + category_keywords
         
         if not unique_keywords:
             return []
         
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, name, description, price FROM products")
-            all_products = cursor.fetchall()
-            
-            def is_word_match(keyword, text):
-                """Check if keyword appears as a complete word in text"""
-                import re
-                pattern = r'(?:^|\s|[^\w\u0600-\u06FF])' + re.escape(keyword) + r'(?:$|\s|[^\w\u0600-\u06FF])'
-                return re.search(pattern, text) is not None
-            
-            scored_products = []
-            for product in all_products:
-                name_lower = product["name"].lower()
-                desc_lower = (product["description"] or "").lower()
-                
-                score = 0
-                matched_brand_keywords = 0
-                matched_other_keywords = 0
-                matched_category_keywords = 0
-                
-                for keyword in brand_keywords:
-                    if is_word_match(keyword, name_lower):
-                        score += 50
-                        matched_brand_keywords += 1
-                    elif is_word_match(keyword, desc_lower):
-                        score += 20
-                        matched_brand_keywords += 1
-                
-                for keyword in other_keywords:
-                    if is_word_match(keyword, name_lower):
-                        score += 15
-                        matched_other_keywords += 1
-                    elif is_word_match(keyword, desc_lower):
-                        score += 5
-                        matched_other_keywords += 1
-                
-                for keyword in category_keywords:
-                    if is_word_match(keyword, name_lower):
-                        score += 5
-                        matched_category_keywords += 1
-                    elif is_word_match(keyword, desc_lower):
-                        score += 2
-                        matched_category_keywords += 1
-                
-                if brand_keywords and matched_brand_keywords == 0:
-                    continue
-                
-                if brand_keywords and category_keywords:
-                    if matched_brand_keywords == 0 or matched_category_keywords == 0:
-                        continue
-                
-                total_matched = matched_brand_keywords + matched_other_keywords + matched_category_keywords
-                if total_matched > 1:
-                    score += total_matched * 10
-                
-                if matched_brand_keywords > 0 and matched_category_keywords > 0:
-                    score += 30
-                
-                if score > 0:
-                    scored_products.append({
-                        "product": product,
-                        "score": score,
-                        "matched_brand": matched_brand_keywords,
-                        "matched_other": matched_other_keywords,
-                        "matched_category": matched_category_keywords
-                    })
-            
-            scored_products.sort(key=lambda x: x["score"], reverse=True)
-            top_products = scored_products[:limit]
-            
-            results = []
-            for item in top_products:
-                product = item["product"]
-                results.append({
-                    "id": product["id"],
-                    "name": product["name"],
-                    "description": product["description"],
-                    "price": product["price"]
-                })
-            
+        self.check_catalog()
+        if self.search_engine == "fts" and self.fts_available:
+            cache_key = self._retrieval_key(brand_keywords, category_keywords, other_keywords, limit, self._catalog_version)
+            results = self._cached_results(cache_key)
+            if results is None:
+                with self.get_read_connection() as conn:
+                    results = self._search_fts(conn, brand_keywords, category_keywords, other_keywords, limit)
+                self._cache_results(cache_key, results)
             return results
+        
+        index = self._get_index()
+        cache_key = self._retrieval_key(brand_keywords, category_keywords, other_keywords, limit, index.version)
+        results = self._cached_results(cache_key)
+        if results is None:
+            with observe_stage("search_scoring"):
+                results = index.search(brand_keywords, category_keywords, other_keywords, limit=limit)
+            self._cache_results(cache_key, results)
+        return results
     
-    def get_all_products(self, limit: int = 100) -> List[Dict[str, Any]]:
-        """Get all products"""
-        with self.get_connection() as conn:
+    def search_products_many(self, queries: List[str], limit: int = 5) -> Dict[str, List[Dict[str, Any]]]:
+        """Search several queries against one consistent snapshot of the catalog"""
+        analyzed = {query: self._analyze_query(query) for query in queries}
+        results: Dict[str, List[Dict[str, Any]]] = {}
+        self.check_catalog()
+        
+        if self.search_engine == "fts" and self.fts_available:
+            version = self._catalog_version
+            with self.get_read_connection() as conn:
+                # A single read transaction sees the same catalog for every query
+                conn.execute("BEGIN")
+                try:
+                    for query, (brand_keywords, category_keywords, other_keywords) in analyzed.items():
+                        if not (brand_keywords or category_keywords or other_keywords):
+                            results[query] = []
+                            continue
+                        
+                        cache_key = self._retrieval_key(brand_keywords, category_keywords, other_keywords, limit, version)
+                        results[query] = self._cached_results(cache_key)
+                        if results[query] is None:
+                            results[query] = self._search_fts(
+                                conn, brand_keywords, category_keywords, other_keywords, limit
+                            )
+                            self._cache_results(cache_key, results[query])
+                finally:
+                    conn.rollback()
+            return results
+        
+        index = self._get_index()
+        for query, (brand_keywords, category_keywords, other_keywords) in analyzed.items():
+            if not (brand_keywords or category_keywords or other_keywords):
+                results[query] = []
+                continue
+            
+            cache_key = self._retrieval_key(brand_keywords, category_keywords, other_keywords, limit, index.version)
+            results[query] = self._cached_results(cache_key)
+            if results[query] is None:
+                results[query] = index.search(brand_keywords, category_keywords, other_keywords, limit=limit)
+                self._cache_results(cache_key, results[query])
+        return results
+    
+    @staticmethod
+    def _retrieval_key(
+        brand_keywords: List[str],
+        category_keywords: List[str],
+        other_keywords: List[str],
+        limit: int,
+        version: int
+    ) -> Tuple:
+        """
+        Retrieval cache key of analyzed keywords
+        
+        Both engines score keyword groups regardless of keyword order and break ties
+        by id, so each group is sorted: messages with the same keywords in any order
+        share an entry. The catalog version the search runs against is part of the key.
+        """
+        return (
+            tuple(sorted(brand_keywords)),
+            tuple(sorted(category_keywords)),
+            tuple(sorted(other_keywords)),
+            limit,
+            version
+        )
+    
+    def _cached_results(self, cache_key: Tuple) -> Optional[List[Dict[str, Any]]]:
+        """Copies of cached search results, so callers may modify them"""
+        if self.retrieval_cache is None:
+            return None
+        results = self.retrieval_cache.get(cache_key)
+        return [dict(product) for product in results] if results is not None else None
+    
+    def _cache_results(self, cache_key: Tuple, results: List[Dict[str, Any]]):
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.set(cache_key, tuple(dict(product) for product in results))
+    
+    def _search_fts(
+        self,
+        conn: sqlite3.Connection,
+        brand_keywords: List[str],
+        category_keywords: List[str],
+        other_keywords: List[str],
+        limit: int
+    ) -> List[Dict[str, Any]]:
+        """Search products through the FTS5 table, ranked by bm25 inside SQLite"""
+        match_query = self._build_fts_query(brand_keywords, category_keywords, other_keywords)
+        
+        with observe_stage("search_sql_fetch"):
             cursor = conn.cursor()
-            cursor.execute("SELECT id, name, description, price FROM products LIMIT ?", (limit,))
+            cursor.execute("""
+                SELECT p.id, p.name, p.description, p.price, bm25(products_fts, ?, ?) AS rank
+                FROM products_fts
+                JOIN products p ON p.id = products_fts.rowid
+                WHERE products_fts MATCH ?
+                ORDER BY rank, p.id
+                LIMIT ?
+            """, (FTS_NAME_WEIGHT, FTS_DESCRIPTION_WEIGHT, match_query, limit))
             rows = cursor.fetchall()
+        
+        return [
+            {
+                "id": row["id"],
+                "name": row["name"],
+                "description": row["description"],
+                "price": row["price"],
+                # bm25 is lower for better matches
+                "score": round(-row["rank"], 4)
+            }
+            for row in rows
+        ]
+    
+    @staticmethod
+    def _build_fts_query(
+        brand_keywords: List[str],
+        category_keywords: List[str],
+        other_keywords: List[str]
+    ) -> str:
+        """
+        Build an FTS5 MATCH expression with the same filtering rules as the Python scorer
+        
+        Brand keywords (and category keywords, when a brand is given) are required.
+        Every keyword is also repeated in an optional branch according to its group
+        boost, so bm25 weights brand matches above other and category matches.
+        """
+        def phrase(keyword: str) -> str:
+            return '"' + keyword.replace('"', '""') + '"'
+        
+        def any_of(keywords: List[str]) -> str:
+            return "(" + " OR ".join(phrase(keyword) for keyword in keywords) + ")"
+        
+        weighted_keywords = (
+            brand_keywords * FTS_BRAND_BOOST
+            + other_keywords * FTS_OTHER_BOOST
+            + category_keywords * FTS_CATEGORY_BOOST
+        )
+        weighted = any_of(weighted_keywords)
+        
+        if brand_keywords and category_keywords:
+            required = f"{any_of(brand_keywords)} AND {any_of(category_keywords)}"
+        elif brand_keywords:
+            required = any_of(brand_keywords)
+        else:
+            return weighted
+        
+        return f"({required}) OR (({required}) AND {weighted})"
+    
+    def get_all_products(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Get the first products in id order"""
+        return list(self.iter_products(limit=limit))
+    
+    def iter_products(
+        self,
+        after_id: int = 0,
+        limit: Optional[int] = None,
+        batch_size: int = PRODUCT_LIST_BATCH_SIZE
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yield products in id order, starting after after_id
+        
+        Rows are read with keyset pagination (id > last id seen) in batches of
+        batch_size, and a read connection is only held while a batch is fetched, so
+        memory stays constant and a slow consumer does not pin a pooled connection.
+        Products added or removed while iterating may or may not be included.
+        """
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            with self.get_read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT id, name, description, price FROM products WHERE id > ? ORDER BY id LIMIT ?",
+                    (after_id, size)
+                )
+                rows = cursor.fetchall()
             
-            results = []
             for row in rows:
-                results.append({
+                yield {
                     "id": row["id"],
                     "name": row["name"],
                     "description": row["description"],
                     "price": row["price"]
-                })
+                }
             
-            return results
-
+            if len(rows) < size:
+                return
+            after_id = rows[-1]["id"]
+            if remaining is not None:
+                remaining -= len(rows)
+    
+    def catalog_stats(self, percentiles: Iterable[float] = PRICE_PERCENTILES) -> Dict[str, Any]:
+        """
+        Product count, price distribution and per-category product counts computed in SQL
+        
+        Percentiles use the nearest-rank method and are read through the price index.
+        A product is counted in every category whose word appears in its name, so the
+        category counts may add up to more than the product count.
+        """
+        category_words = sorted(get_lexicon().category_words)
+        with self.get_read_connection() as conn:
+            cursor = conn.cursor()
+            # One read transaction, so all aggregates describe the same snapshot
+            cursor.execute("BEGIN")
+            try:
+                cursor.execute("SELECT COUNT(*), MIN(price), MAX(price), AVG(price) FROM products")
+                count, min_price, max_price, avg_price = cursor.fetchone()
+                
+                price_percentiles = {}
+                for percentile in percentiles:
+                    price = None
+                    if count:
+                        rank = max(math.ceil(percentile / 100 * count), 1)
+                        cursor.execute("SELECT price FROM products ORDER BY price LIMIT 1 OFFSET ?", (rank - 1,))
+                        price = cursor.fetchone()[0]
+                    price_percentiles[f"p{percentile:g}"] = price
+                
+                categories = {}
+                if category_words and count:
+                    # Counts every category in a single scan of the tokens column
+                    counts = ", ".join("SUM(instr(' ' || name_tokens || ' ', ?) > 0)" for _ in category_words)
+                    cursor.execute(
+                        f"SELECT {counts} FROM products",
+                        [f" {word} " for word in category_words]
+                    )
+                    categories = dict(zip(category_words, cursor.fetchone()))
+            finally:
+                cursor.execute("COMMIT")
+        
+        return {
+            "total_products": count,
+            "price": {
+                "min": min_price,
+                "max": max_price,
+                "avg": round(avg_price, 2) if avg_price is not None else None,
+                "percentiles": price_percentiles
+            },
+            "categories": {word: n for word, n in categories.items() if n}
+        }
+    
+    def ping(self) -> bool:
+        """Cheap liveness query on a read connection"""
+        with self.get_read_connection() as conn:
+            return conn.execute("SELECT 1").fetchone()[0] == 1
+    
+    def get_products_by_ids(self, product_ids: List[int]) -> List[Dict[str, Any]]:
+        """Get products by id, in the order of product_ids (missing ids are skipped)"""
+        if not product_ids:
+            return []
+        
+        placeholders = ", ".join("?" for _ in product_ids)
+        with self.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, name, description, price FROM products WHERE id IN ({placeholders})",
+                list(product_ids)
+            )
+            rows = {row["id"]: row for row in cursor.fetchall()}
+        
+        return [
+            {
+                "id": row["id"],
+                "name": row["name"],
+                "description": row["description"],
+                "price": row["price"]
+            }
+            for row in (rows.get(product_id) for product_id in product_ids)
+            if row is not None
+        ]
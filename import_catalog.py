@@ -0,0 +1,68 @@
+"""
+Bulk product catalog import from CSV or JSONL files
+"""
+import time
+import logging
+import argparse
+from pathlib import Path
+
+from database import Database
+from catalog_reader import FORMATS, read_catalog
+from config import DB_PATH, IMPORT_BATCH_SIZE
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MAX_REPORTED_ERRORS = 20
+
+
+def main():
+    """Import a catalog file into the products table"""
+    parser = argparse.ArgumentParser(
+        description=(
+            "Import products from a CSV file (header: sku,name,description,price) or a JSONL file "
+            "(one object per line with the same keys). Products with an existing sku are updated."
+        )
+    )
+    parser.add_argument("path", type=Path, help="Catalog file")
+    parser.add_argument("--format", choices=FORMATS, help="File format, detected from the extension by default")
+    parser.add_argument("--db", type=Path, default=DB_PATH, help="SQLite database to import into")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="Rows per transaction")
+    args = parser.parse_args()
+    
+    errors = 0
+    
+    def on_error(line_number: int, error: Exception):
+        nonlocal errors
+        errors += 1
+        if errors <= MAX_REPORTED_ERRORS:
+            logger.warning(f"Skipping line {line_number}: {error}")
+    
+    start = time.perf_counter()
+    
+    def progress(written: int):
+        elapsed = time.perf_counter() - start
+        logger.info(f"{written:,} rows written ({written / elapsed:,.0f} rows/s)")
+    
+    db = Database(args.db, sample_data=False)
+    try:
+        written = db.import_products(
+            read_catalog(args.path, args.format, on_error=on_error),
+            batch_size=args.batch_size,
+            progress=progress
+        )
+    finally:
+        db.close()
+    
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Imported {written:,} products in {elapsed:.1f}s ({written / max(elapsed, 1e-9):,.0f} rows/s), "
+        f"{errors:,} invalid rows skipped"
+    )
+
+
+if __name__ == "__main__":
+    main()
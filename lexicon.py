@@ -0,0 +1,136 @@
+"""
+Query-analysis lexicon: stop words, category words and brand aliases loaded from a data file
+"""
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import List, Dict, Tuple, Iterable, Optional
+
+from config import LEXICON_PATH, LEXICON_RELOAD_INTERVAL
+from text_normalizer import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+class Lexicon:
+    """
+    Immutable vocabulary used to split a query into brand, category and other keywords
+    
+    Words are normalized like product text, so spelling variants in the file
+    (e.g. with or without ZWNJ) collapse into one entry.
+    """
+    
+    def __init__(
+        self,
+        stop_words: Iterable[str],
+        category_words: Iterable[str],
+        brands: Dict[str, List[str]]
+    ):
+        self.stop_words = frozenset(normalize_text(word) for word in stop_words)
+        self.category_words = frozenset(normalize_text(word) for word in category_words)
+        self.brands: Dict[str, Tuple[str, ...]] = {
+            brand: tuple(dict.fromkeys(normalize_text(variant) for variant in variants))
+            for brand, variants in brands.items()
+        }
+        
+        # Reverse lookup of a variant to its brand; the first brand listing a variant wins
+        self.brand_of: Dict[str, str] = {}
+        for brand, variants in self.brands.items():
+            for variant in variants:
+                self.brand_of.setdefault(variant, brand)
+    
+    @classmethod
+    def from_file(cls, path: Path) -> "Lexicon":
+        """Load a lexicon from a JSON file with stop_words, category_words and brands"""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["stop_words"], data["category_words"], data["brands"])
+    
+    def keywords(self, query: str) -> List[str]:
+        """Split a normalized query into words, dropping stop words and single characters"""
+        return [word for word in query.split() if len(word) > 1 and word not in self.stop_words]
+    
+    def analyze(self, query: str) -> Tuple[List[str], List[str], List[str]]:
+        """Split query into brand, category and other keywords"""
+        # Dicts keep the keyword groups free of duplicates in a stable order
+        brand_keywords: Dict[str, None] = {}
+        category_keywords: Dict[str, None] = {}
+        other_keywords: Dict[str, None] = {}
+        
+        for keyword in self.keywords(normalize_text(query)):
+            brand = self.brand_of.get(keyword)
+            if brand is not None:
+                brand_keywords.update(dict.fromkeys(self.brands[brand]))
+            elif keyword in self.category_words:
+                category_keywords[keyword] = None
+            else:
+                other_keywords[keyword] = None
+        
+        return list(brand_keywords), list(category_keywords), list(other_keywords)
+
+
+class LexiconLoader:
+    """
+    Holds the current lexicon and reloads it when its file changes
+    
+    The file's modification time is checked at most once per reload_interval, and a
+    new lexicon is swapped in as a whole, so searches always see a consistent one.
+    A file that fails to load is logged and the previous lexicon is kept.
+    """
+    
+    def __init__(self, path: Path = LEXICON_PATH, reload_interval: float = LEXICON_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lexicon: Optional[Lexicon] = None
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+    
+    def get(self) -> Lexicon:
+        """Return the current lexicon, reloading it if the file changed"""
+        lexicon = self._lexicon
+        if lexicon is not None and (self.reload_interval <= 0 or time.monotonic() < self._next_check):
+            return lexicon
+        
+        with self._lock:
+            if self._lexicon is None or time.monotonic() >= self._next_check:
+                self._next_check = time.monotonic() + self.reload_interval
+                self._reload_if_changed()
+            return self._lexicon
+    
+    def reload(self) -> Lexicon:
+        """Load the file now, even if it did not change"""
+        with self._lock:
+            self._mtime = None
+            self._reload_if_changed()
+            return self._lexicon
+    
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime and self._lexicon is not None:
+                return
+            lexicon = Lexicon.from_file(self.path)
+        except Exception as e:
+            if self._lexicon is None:
+                raise
+            logger.error(f"Error reloading lexicon from {self.path}, keeping the previous one: {e}")
+            return
+        
+        self._lexicon = lexicon
+        self._mtime = mtime
+        logger.info(
+            f"Lexicon loaded: {len(lexicon.brands)} brands, {len(lexicon.brand_of)} brand variants, "
+            f"{len(lexicon.category_words)} category words, {len(lexicon.stop_words)} stop words"
+        )
+
+
+lexicon_loader = LexiconLoader()
+
+
+def get_lexicon() -> Lexicon:
+    """Return the current lexicon"""
+    return lexicon_loader.get()
@@ -0,0 +1,238 @@
+"""
+LLM backends used by the LLM service
+"""
+import time
+import random
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, AsyncIterator
+
+from config import (
+    LLM_BACKEND, GEMINI_API_KEY, GEMINI_MODEL,
+    LOCAL_LLM_LATENCY_DISTRIBUTION, LOCAL_LLM_LATENCY_MS, LOCAL_LLM_LATENCY_SPREAD, LOCAL_LLM_SEED
+)
+
+logger = logging.getLogger(__name__)
+
+PERSIAN_DIGITS = str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹")
+
+
+class LLMBackend(ABC):
+    """Interface of a text generation backend; subclasses missing a method cannot be instantiated"""
+    
+    name = "base"
+    
+    @abstractmethod
+    def generate(self, prompt: str, user_message: str, retrieved_products: List[Dict[str, Any]]) -> str:
+        """Return the generated reply, an empty string if nothing was generated"""
+    
+    @abstractmethod
+    async def generate_async(self, prompt: str, user_message: str, retrieved_products: List[Dict[str, Any]]) -> str:
+        """Return the generated reply without blocking the event loop"""
+    
+    async def stream(
+        self,
+        prompt: str,
+        user_message: str,
+        retrieved_products: List[Dict[str, Any]]
+    ) -> AsyncIterator[str]:
+        """Yield the reply in chunks as it is generated, by default as a single chunk"""
+        yield await self.generate_async(prompt, user_message, retrieved_products)
+
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini API"""
+    
+    name = "gemini"
+    
+    def __init__(self, api_key: str = GEMINI_API_KEY, model_name: str = GEMINI_MODEL):
+        if not api_key:
+            raise ValueError(
+                "Gemini API key not set. "
+                "Please set the GEMINI_API_KEY environment variable."
+            )
+        
+        # Imported here so the local backend runs without the Gemini SDK installed
+        import google.generativeai as genai
+        
+        self.api_key = api_key
+        genai.configure(api_key=self.api_key)
+        
+        self.generation_config = {
+            "temperature": 0.7,
+            "top_p": 0.95,
+            "top_k": 40,
+            "max_output_tokens": 1024,
+        }
+        
+        self.safety_settings = [
+            {
+                "category": "HARM_CATEGORY_HARASSMENT",
+                "threshold": "BLOCK_NONE"
+            },
+            {
+                "category": "HARM_CATEGORY_HATE_SPEECH",
+                "threshold": "BLOCK_NONE"
+            },
+            {
+                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+                "threshold": "BLOCK_NONE"
+            },
+            {
+                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+                "threshold": "BLOCK_NONE"
+            },
+        ]
+        
+        self.model = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=self.generation_config,
+            safety_settings=self.safety_settings
+        )
+    
+    def generate(self, prompt: str, user_message: str, retrieved_products: List[Dict[str, Any]]) -> str:
+        response = self.model.generate_content(prompt)
+        return response.text or ""
+    
+    async def generate_async(self, prompt: str, user_message: str, retrieved_products: List[Dict[str, Any]]) -> str:
+        response = await self.model.generate_content_async(prompt)
+        return response.text or ""
+    
+    async def stream(
+        self,
+        prompt: str,
+        user_message: str,
+        retrieved_products: List[Dict[str, Any]]
+    ) -> AsyncIterator[str]:
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            yield chunk.text
+
+
+class LocalBackend(LLMBackend):
+    """
+    Deterministic offline backend rendering replies from the retrieved products
+    
+    Replies depend only on the message and the products; only the synthetic latency
+    is random. Used for load tests and as a cheap mode during provider incidents.
+    """
+    
+    name = "local"
+    
+    LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+    
+    PRICE_WORDS = ("قیمت", "چند", "چنده", "هزینه", "ارزان", "ارزون", "ارزونترین", "ارزان‌ترین", "price")
+    
+    def __init__(
+        self,
+        latency_distribution: str = LOCAL_LLM_LATENCY_DISTRIBUTION,
+        latency_ms: float = LOCAL_LLM_LATENCY_MS,
+        latency_spread: float = LOCAL_LLM_LATENCY_SPREAD,
+        seed: int = LOCAL_LLM_SEED,
+        chunk_words: int = 4
+    ):
+        if latency_distribution not in self.LATENCY_DISTRIBUTIONS:
+            raise ValueError(
+                f"Unknown latency distribution '{latency_distribution}', "
+                f"expected one of {self.LATENCY_DISTRIBUTIONS}"
+            )
+        
+        self.latency_distribution = latency_distribution
+        self.latency_ms = latency_ms
+        self.latency_spread = latency_spread
+        self.chunk_words = chunk_words
+        self._random = random.Random(seed)
+    
+    def sample_latency(self) -> float:
+        """Synthetic generation time in seconds"""
+        if self.latency_ms <= 0:
+            return 0.0
+        if self.latency_distribution == "uniform":
+            spread = self.latency_ms * self.latency_spread
+            latency_ms = self._random.uniform(self.latency_ms - spread, self.latency_ms + spread)
+        elif self.latency_distribution == "lognormal":
+            # latency_ms is the median, latency_spread the sigma of the underlying normal
+            latency_ms = self.latency_ms * self._random.lognormvariate(0, self.latency_spread)
+        else:
+            latency_ms = self.latency_ms
+        return max(latency_ms, 0.0) / 1000
+    
+    def generate(self, prompt: str, user_message: str, retrieved_products: List[Dict[str, Any]]) -> str:
+        time.sleep(self.sample_latency())
+        return self.render(user_message, retrieved_products)
+    
+    async def generate_async(self, prompt: str, user_message: str, retrieved_products: List[Dict[str, Any]]) -> str:
+        await asyncio.sleep(self.sample_latency())
+        return self.render(user_message, retrieved_products)
+    
+    async def stream(
+        self,
+        prompt: str,
+        user_message: str,
+        retrieved_products: List[Dict[str, Any]]
+    ) -> AsyncIterator[str]:
+        words = self.render(user_message, retrieved_products).split(" ")
+        chunks = [
+            " ".join(words[i:i + self.chunk_words]) + (" " if i + self.chunk_words < len(words) else "")
+            for i in range(0, len(words), self.chunk_words)
+        ]
+        
+        # A third of the time goes to the first chunk, the rest is spread over the others
+        latency = self.sample_latency()
+        await asyncio.sleep(latency / 3)
+        for i, chunk in enumerate(chunks):
+            if i:
+                await asyncio.sleep(latency * 2 / 3 / (len(chunks) - 1))
+            yield chunk
+    
+    @staticmethod
+    def _format_price(price: float) -> str:
+        return f"{price:,.0f}".replace(',', '،').translate(PERSIAN_DIGITS)
+    
+    def render(self, user_message: str, retrieved_products: List[Dict[str, Any]]) -> str:
+        """Reply describing the retrieved products"""
+        if not retrieved_products:
+            return (
+                "متاسفانه محصولی مطابق درخواست شما پیدا نکردم. "
+                "لطفا نام محصول یا برند مورد نظرتان را دقیق‌تر بنویسید تا بهتر راهنمایی‌تان کنم."
+            )
+        
+        asks_price = any(word in user_message.lower() for word in self.PRICE_WORDS)
+        
+        if len(retrieved_products) == 1:
+            product = retrieved_products[0]
+            price = self._format_price(product["price"])
+            if asks_price:
+                return f"قیمت {product['name']} {price} تومان است. {product['description'] or ''}".strip()
+            return f"{product['name']} موجود است: {product['description'] or ''} قیمت: {price} تومان."
+        
+        lines = [f"{len(retrieved_products)} محصول مرتبط پیدا کردم:".translate(PERSIAN_DIGITS)]
+        for product in retrieved_products:
+            lines.append(f"- {product['name']}: {self._format_price(product['price'])} تومان")
+        
+        cheapest = min(retrieved_products, key=lambda product: product["price"])
+        most_expensive = max(retrieved_products, key=lambda product: product["price"])
+        if asks_price or cheapest is most_expensive:
+            lines.append(f"مقرون به صرفه‌ترین گزینه {cheapest['name']} است.")
+        else:
+            lines.append(
+                f"اگر بودجه محدودی دارید {cheapest['name']} و اگر بهترین کیفیت را می‌خواهید "
+                f"{most_expensive['name']} را پیشنهاد می‌کنم."
+            )
+        return "\n".join(lines)
+
+
+BACKENDS = {
+    GeminiBackend.name: GeminiBackend,
+    LocalBackend.name: LocalBackend,
+}
+
+
+def create_backend(name: str = LLM_BACKEND) -> LLMBackend:
+    """Create the backend selected by name"""
+    backend_class = BACKENDS.get(name)
+    if backend_class is None:
+        raise ValueError(f"Unknown LLM backend '{name}', expected one of {tuple(BACKENDS)}")
+    logger.info(f"Using {name} LLM backend")
+    return backend_class()
@@ -1,59 +1,53 @@
 """
-LLM service for connecting to Gemini API
+LLM service generating replies through a pluggable backend
 """
-import os
+import time
+import asyncio
 import logging
-from typing import List, Dict, Any
-import google.generativeai as genai
-from config import GEMINI_API_KEY
+import concurrent.futures
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Tuple, Hashable, AsyncIterator
+from config import LLM_MAX_CONCURRENCY, LLM_TIMEOUT_SECONDS, LLM_MIN_CALL_SHARE, RESPONSE_CACHE_SIZE
+from llm_backends import LLMBackend, create_backend
+from response_cache import ResponseCache
+from prompt_builder import PromptBuilder
+from circuit_breaker import CircuitBreaker
+from singleflight import SingleFlight
+from logging_config import PER_REQUEST
+from metrics import STAGE_LATENCY, FALLBACK_RESPONSES, observe_stage
 
 logger = logging.getLogger(__name__)
 
 
+class FallbackReply(str):
+    """Reply built without the LLM; not worth keeping once the LLM is available again"""
+
+
+class LLMOverloaded(Exception):
+    """No concurrency slot freed up while enough of the latency SLO remained for a backend call"""
+
+
 class LLMService:
-    """Class for managing connection to Google Gemini API"""
+    """Class for generating replies with the configured LLM backend (Gemini or local)"""
     
-    def __init__(self, api_key: str = GEMINI_API_KEY):
-        if not api_key:
-            raise ValueError(
-                "Gemini API key not set. "
-                "Please set the GEMINI_API_KEY environment variable."
-            )
-        
-        self.api_key = api_key
-        genai.configure(api_key=self.api_key)
-        
-        self.generation_config = {
-            "temperature": 0.7,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 1024,
-        }
-        
-        self.safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_NONE"
-            },
-        ]
-        
-        self.model = genai.GenerativeModel(
-            model_name="gemini-1.5-flash",
-            generation_config=self.generation_config,
-            safety_settings=self.safety_settings
-        )
+    def __init__(
+        self,
+        backend: Optional[LLMBackend] = None,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        min_call_share: float = LLM_MIN_CALL_SHARE
+    ):
+        self.backend = backend if backend is not None else create_backend()
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        # Backend calls are only started with at least this much of the SLO left
+        self.min_call_seconds = timeout * min_call_share
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.breaker = CircuitBreaker("llm")
+        self.generation_flight = SingleFlight("generate")
+        self.response_cache = ResponseCache() if RESPONSE_CACHE_SIZE > 0 else None
+        self.prompt_builder = PromptBuilder()
     
     def generate_response(
         self,
@@ -62,83 +56,291 @@ class LLMService:
     ) -> str:
         """Generate intelligent response based on user message and retrieved products"""
         try:
+            cache_key, cached_reply = self._cached_reply(user_message, retrieved_products)
+            if cached_reply is not None:
+                return cached_reply
+            
             prompt = self._build_prompt(user_message, retrieved_products)
-            response = self.model.generate_content(prompt)
+            if not self.breaker.allow_request():
+                return self.fallback_response(retrieved_products, reason="circuit_open")
+            
+            start_by = time.monotonic() + self.timeout - self.min_call_seconds
+            
+            def call() -> str:
+                if time.monotonic() > start_by:
+                    raise LLMOverloaded("Waited too long for a free LLM thread")
+                return self.backend.generate(prompt, user_message, retrieved_products)
             
-            if not response.text:
-                logger.warning("Empty response received from Gemini")
-                return self._fallback_response(retrieved_products)
+            # The backend call runs in a thread so the caller can give up on it at the deadline
+            with observe_stage("llm_call"):
+                future = self._get_executor().submit(call)
+                try:
+                    reply = future.result(timeout=self.timeout)
+                except concurrent.futures.TimeoutError:
+                    if future.cancel():
+                        # Still queued behind other calls: overload, not a backend failure
+                        self.breaker.release()
+                        return self._overloaded_response(retrieved_products)
+                    self.breaker.record_failure()
+                    logger.warning(f"{self.backend.name} backend did not respond within {self.timeout} seconds")
+                    return self.fallback_response(retrieved_products, reason="timeout")
+                except LLMOverloaded:
+                    self.breaker.release()
+                    return self._overloaded_response(retrieved_products)
+                except Exception:
+                    self.breaker.record_failure()
+                    raise
+            self.breaker.record_success()
             
-            return response.text.strip()
+            if not reply:
+                logger.warning(f"Empty response received from {self.backend.name} backend")
+                return self.fallback_response(retrieved_products, reason="empty")
+            
+            return self._store_reply(cache_key, reply.strip())
         
         except Exception as e:
-            logger.error(f"Error generating response from Gemini: {e}")
-            return self._fallback_response(retrieved_products)
+            logger.error(f"Error generating response from {self.backend.name} backend: {e}")
+            return self.fallback_response(retrieved_products)
     
-    def _build_prompt(
+    def _cached_reply(
+        self,
+        user_message: str,
+        retrieved_products: List[Dict[str, Any]]
+    ) -> Tuple[Optional[Hashable], Optional[str]]:
+        """Look up a previously generated reply for the same query and products"""
+        if self.response_cache is None:
+            return None, None
+        
+        cache_key = self.response_cache.make_key(user_message, retrieved_products)
+        return cache_key, self.response_cache.get(cache_key)
+    
+    def _store_reply(self, cache_key: Optional[Hashable], reply: str) -> str:
+        """Cache a generated reply (fallback replies are never cached)"""
+        if self.response_cache is not None and cache_key is not None:
+            self.response_cache.set(cache_key, reply)
+        return reply
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Semaphore capping concurrent LLM calls, created inside the running event loop"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+    
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Threads running blocking backend calls, capped like concurrent async calls"""
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_concurrency, thread_name_prefix="llm"
+            )
+        return self._executor
+    
+    @asynccontextmanager
+    async def _concurrency_slot(self, deadline: float):
+        """
+        Hold one of the max_concurrency slots for a backend call
+        
+        Raises LLMOverloaded when no slot frees up before less than min_call_seconds
+        of the SLO deadline (event loop time) is left.
+        """
+        semaphore = self._get_semaphore()
+        wait = deadline - self.min_call_seconds - asyncio.get_running_loop().time()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=max(wait, 0))
+        except asyncio.TimeoutError:
+            raise LLMOverloaded(f"No free LLM slot within {max(wait, 0):.2f} seconds") from None
+        try:
+            yield
+        finally:
+            semaphore.release()
+    
+    async def generate_response_async(
         self,
         user_message: str,
         retrieved_products: List[Dict[str, Any]]
     ) -> str:
-        """Build prompt for sending to LLM"""
+        """
+        Generate response without blocking the event loop
         
-        if not retrieved_products:
-            prompt = f"""You are an online store assistant that responds in Persian.
-The user sent a message but no related products were found in the database.
-
-User message: {user_message}
-
-Please inform the user in Persian and in a friendly tone that unfortunately we couldn't find the product they're looking for and ask them to ask their question more clearly or mention another product name.
-"""
-            return prompt
+        Concurrent calls for the same normalized query and products share one
+        generation. The wait for a concurrency slot and the backend call share the
+        latency SLO (timeout); when it expires, when no slot frees up in time, or
+        while the circuit breaker is open, the fallback reply is returned. Only
+        failures and timeouts of the backend call itself count for the breaker.
+        """
+        try:
+            cache_key, cached_reply = self._cached_reply(user_message, retrieved_products)
+            if cached_reply is not None:
+                return cached_reply
+            
+            flight_key = cache_key if cache_key is not None else ResponseCache.make_key(user_message, retrieved_products)
+            reply, _ = await self.generation_flight.do(
+                flight_key,
+                lambda: self._generate_async(user_message, retrieved_products, cache_key)
+            )
+            return reply
         
-        products_text = ""
-        for i, product in enumerate(retrieved_products, 1):
-            price_formatted = f"{product['price']:,.0f}".replace(',', '،')
-            products_text += f"""
-Product {i}:
-Name: {product['name']}
-Description: {product['description']}
-Price: {price_formatted} تومان
----
-"""
+        except Exception as e:
+            logger.error(f"Error generating response from {self.backend.name} backend: {e}")
+            return self.fallback_response(retrieved_products)
+    
+    async def _generate_async(
+        self,
+        user_message: str,
+        retrieved_products: List[Dict[str, Any]],
+        cache_key: Optional[Hashable]
+    ) -> str:
+        """Generate and cache a reply, or return the fallback reply"""
+        try:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout
+            prompt = self._build_prompt(user_message, retrieved_products)
+            if not self.breaker.allow_request():
+                return self.fallback_response(retrieved_products, reason="circuit_open")
+            
+            try:
+                async with self._concurrency_slot(deadline):
+                    with observe_stage("llm_call"):
+                        reply = await asyncio.wait_for(
+                            self.backend.generate_async(prompt, user_message, retrieved_products),
+                            timeout=max(deadline - loop.time(), 0)
+                        )
+            except (LLMOverloaded, asyncio.CancelledError):
+                self.breaker.release()
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+            
+            if not reply:
+                logger.warning(f"Empty response received from {self.backend.name} backend")
+                return self.fallback_response(retrieved_products, reason="empty")
+            
+            return self._store_reply(cache_key, reply.strip())
         
-        prompt = f"""You are an online store assistant that responds in Persian.
-Your task is to help customers find and buy products.
-
-User message: {user_message}
-
-Related products found:
-{products_text}
-
-Instructions:
-1. Write the response completely in Persian
-2. If the user asks about price, mention prices clearly and with Persian numbers
-3. If the user asks about specifications, give complete descriptions
-4. If multiple similar products are found, introduce all of them and mention their differences
-5. Use a friendly and professional tone
-6. Keep the response short and useful (maximum 3-4 sentences)
-7. If possible, provide a smart recommendation based on user needs
-8. Don't use English numbers, all numbers should be Persian
-9. Use Persian numbers instead of English ones
-
-Response:"""
+        except LLMOverloaded:
+            return self._overloaded_response(retrieved_products)
+        
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.backend.name} backend did not respond within {self.timeout} seconds")
+            return self.fallback_response(retrieved_products, reason="timeout")
+        
+        except Exception as e:
+            logger.error(f"Error generating response from {self.backend.name} backend: {e}")
+            return self.fallback_response(retrieved_products)
+    
+    async def generate_response_stream(
+        self,
+        user_message: str,
+        retrieved_products: List[Dict[str, Any]]
+    ) -> AsyncIterator[Dict[str, str]]:
+        """
+        Generate response incrementally as the backend produces it
+        
+        Yields {"type": "delta", "text": ...} events. If generation fails part way,
+        a final {"type": "fallback", "text": ...} event carries the fallback reply,
+        which replaces any text streamed so far. The whole stream, including the wait
+        for a concurrency slot, must finish within the latency SLO (timeout).
+        """
+        cache_key, cached_reply = self._cached_reply(user_message, retrieved_products)
+        if cached_reply is not None:
+            yield {"type": "delta", "text": cached_reply}
+            return
+        
+        if not self.breaker.allow_request():
+            yield {"type": "fallback", "text": self.fallback_response(retrieved_products, reason="circuit_open")}
+            return
         
-        return prompt
+        chunks: List[str] = []
+        outcome_recorded = False
+        try:
+            prompt = self._build_prompt(user_message, retrieved_products)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout
+            
+            async with self._concurrency_slot(deadline):
+                started = time.perf_counter()
+                iterator = self.backend.stream(prompt, user_message, retrieved_products).__aiter__()
+                while True:
+                    try:
+                        text = await asyncio.wait_for(
+                            iterator.__anext__(),
+                            timeout=max(deadline - loop.time(), 0)
+                        )
+                    except StopAsyncIteration:
+                        break
+                    
+                    if not chunks:
+                        STAGE_LATENCY.observe(time.perf_counter() - started, stage="llm_first_chunk")
+                        text = text.lstrip()
+                    if text:
+                        chunks.append(text)
+                        yield {"type": "delta", "text": text}
+                
+                STAGE_LATENCY.observe(time.perf_counter() - started, stage="llm_stream")
+            
+            self.breaker.record_success()
+            outcome_recorded = True
+            
+            if not chunks:
+                logger.warning(f"Empty response received from {self.backend.name} backend")
+                yield {"type": "fallback", "text": self.fallback_response(retrieved_products, reason="empty")}
+                return
+            
+            self._store_reply(cache_key, "".join(chunks).strip())
+        
+        except LLMOverloaded:
+            self.breaker.release()
+            outcome_recorded = True
+            yield {"type": "fallback", "text": self._overloaded_response(retrieved_products)}
+        
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            outcome_recorded = True
+            logger.warning(f"{self.backend.name} backend did not finish streaming within {self.timeout} seconds")
+            yield {"type": "fallback", "text": self.fallback_response(retrieved_products, reason="timeout")}
+        
+        except Exception as e:
+            self.breaker.record_failure()
+            outcome_recorded = True
+            logger.error(f"Error streaming response from {self.backend.name} backend: {e}")
+            yield {"type": "fallback", "text": self.fallback_response(retrieved_products)}
+        
+        finally:
+            # The client went away (generator closed or cancelled) before the outcome was known
+            if not outcome_recorded:
+                self.breaker.release()
     
-    def _fallback_response(self, retrieved_products: List[Dict[str, Any]]) -> str:
-        """Fallback response in case of LLM error"""
+    @observe_stage("build_prompt")
+    def _build_prompt(
+        self,
+        user_message: str,
+        retrieved_products: List[Dict[str, Any]]
+    ) -> str:
+        """Build prompt for sending to LLM, within the prompt token budget"""
+        return self.prompt_builder.build(user_message, retrieved_products)
+    
+    def _overloaded_response(self, retrieved_products: List[Dict[str, Any]]) -> str:
+        """Fallback reply for a request shed because every concurrency slot stayed busy"""
+        logger.warning("No free %s backend slot in time, sending the fallback reply", self.backend.name, extra=PER_REQUEST)
+        return self.fallback_response(retrieved_products, reason="overloaded")
+    
+    @observe_stage("fallback_response")
+    def fallback_response(self, retrieved_products: List[Dict[str, Any]], reason: str = "error") -> FallbackReply:
+        """Fallback reply built from the retrieved products, sent when the LLM reply is not available"""
+        FALLBACK_RESPONSES.inc(reason=reason)
+        
         if not retrieved_products:
-            return "متاسفانه محصول مورد نظر شما را پیدا نکردم. لطفا سوال خود را واضح‌تر مطرح کنید."
+            return FallbackReply("متاسفانه محصول مورد نظر شما را پیدا نکردم. لطفا سوال خود را واضح‌تر مطرح کنید.")
         
         if len(retrieved_products) == 1:
             product = retrieved_products[0]
             price_formatted = f"{product['price']:,.0f}".replace(',', '،')
-            return f"{product['name']} با قیمت {price_formatted} تومان موجود است."
+            return FallbackReply(f"{product['name']} با قیمت {price_formatted} تومان موجود است.")
         else:
             response = f"تعداد {len(retrieved_products)} محصول مرتبط پیدا شد:\n"
             for product in retrieved_products[:3]:
                 price_formatted = f"{product['price']:,.0f}".replace(',', '،')
                 response += f"- {product['name']}: {price_formatted} تومان\n"
-            return response
+            return FallbackReply(response)
 
@@ -0,0 +1,123 @@
+"""
+Queue-based logging: application threads only enqueue records, a background thread writes them
+"""
+import sys
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+from typing import Dict, Optional
+
+from config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES
+from metrics import LOG_RECORDS_DROPPED
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+JSON_FORMAT = '%(asctime)s %(name)s %(levelname)s %(message)s'
+
+# Marks the records logged for every request, which are subject to sampling:
+# logger.info("Retrieved products count: %d", count, extra=PER_REQUEST)
+PER_REQUEST = {"per_request": True}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def parse_sample_rates(spec: str) -> Dict[int, float]:
+    """Parse per-level sample rates such as "INFO=0.1,DEBUG=0" into {level number: rate}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        level = logging.getLevelName(name.strip().upper())
+        if not isinstance(level, int):
+            raise ValueError(f"Unknown log level {name!r} in sample rates {spec!r}")
+        rates[level] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a configured share of per-request records of each level"""
+    
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "per_request", False):
+            return True
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        LOG_RECORDS_DROPPED.inc(reason="sampled")
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without formatting them
+    
+    The message is only rendered from msg and args by the listener's formatter, so
+    logging costs the caller a record and a queue put. When the queue is full the
+    record is dropped rather than blocking the request.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason="queue_full")
+
+
+def _formatter(log_format: str) -> logging.Formatter:
+    if log_format == "text":
+        return logging.Formatter(TEXT_FORMAT)
+    if log_format != "json":
+        raise ValueError(f"Unknown log format {log_format!r}, expected 'json' or 'text'")
+    
+    try:
+        from pythonjsonlogger.json import JsonFormatter
+    except ImportError:
+        # python-json-logger < 3.1
+        from pythonjsonlogger.jsonlogger import JsonFormatter
+    return JsonFormatter(
+        JSON_FORMAT,
+        rename_fields={"asctime": "time", "levelname": "level", "name": "logger"},
+        json_ensure_ascii=False
+    )
+
+
+def setup_logging(
+    level: str = LOG_LEVEL,
+    log_format: str = LOG_FORMAT,
+    queue_size: int = LOG_QUEUE_SIZE,
+    sample_rates: str = LOG_SAMPLE_RATES
+) -> logging.handlers.QueueListener:
+    """
+    Route all records of the root logger through a queue to a stdout writer thread
+    
+    Calling it again returns the running listener.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(_formatter(log_format))
+    
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=queue_size)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(parse_sample_rates(sample_rates)))
+    
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    # Flush queued records on interpreter exit
+    atexit.register(_listener.stop)
+    return _listener
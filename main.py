@@ -1,25 +1,40 @@
 """
 Main API service - Instagram Direct Message simulator with RAG and LLM
 """
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, validator
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
+from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from pydantic import BaseModel, Field, ValidationError, validator, model_validator
+import os
+import sys
+import secrets
+import sqlite3
+import math
+import asyncio
+import json
 import logging
-from typing import Optional
-import uvicorn
+import argparse
+from pathlib import Path
+from collections import Counter
+from typing import Optional, List, Dict, Any, Set
 
-from config import API_HOST, API_PORT, MAX_MESSAGE_LENGTH, RATE_LIMIT
-from database import Database
+from config import (
+    API_HOST, API_PORT, API_WORKERS, MAX_MESSAGE_LENGTH, RATE_LIMIT, RATE_LIMIT_KEYS,
+    MAX_BATCH_SIZE, BATCH_CONCURRENCY, CONTEXT_MAX_SENDERS, TRACE_HEADER, PRODUCT_LIST_MAX_LIMIT,
+    ADMIN_HEADER, ADMIN_TOKEN, ADMIN_MAX_PRODUCTS
+)
+from database import Database, normalize_query
 from rag_service import RAGService
-from llm_service import LLMService
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from llm_service import LLMService, FallbackReply
+from reply_store import ReplyStore
+from conversation_context import ConversationStore
+from rate_limiter import RateLimiter, RateLimitExceeded
+from logging_config import setup_logging, PER_REQUEST
+from tracing import Tracer
+from metrics import (
+    REGISTRY, PROMETHEUS_CONTENT_TYPE, RATE_LIMITED_REQUESTS, Gauge, observe_stage
 )
+
+setup_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
@@ -28,9 +43,34 @@ app = FastAPI(
     version="1.0.0"
 )
 
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+RATE_LIMIT_KEY_KINDS = ("ip", "sender")
+
+if set(RATE_LIMIT_KEYS) - set(RATE_LIMIT_KEY_KINDS):
+    raise ValueError(f"Unknown RATE_LIMIT_KEYS {RATE_LIMIT_KEYS}, expected some of {RATE_LIMIT_KEY_KINDS}")
+
+
+def rate_limit_keys(request: Optional[Request], sender_id: Optional[str] = None) -> List[str]:
+    """Rate limit keys of a message: its client IP (unless request is None) and sender"""
+    values = {
+        "ip": request.client.host if request is not None and request.client else None,
+        "sender": sender_id
+    }
+    return [f"{kind}:{values[kind]}" for kind in RATE_LIMIT_KEYS if values[kind]]
+
+
+async def enforce_rate_limit(request: Request, sender_id: Optional[str] = None):
+    """Count a request against the rate limits of its client IP and sender"""
+    await rate_limiter.hit_async(rate_limit_keys(request, sender_id))
+
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    RATE_LIMITED_REQUESTS.inc(path=request.url.path)
+    return JSONResponse(
+        status_code=429,
+        content={"error": f"Rate limit exceeded: {RATE_LIMIT}"},
+        headers={"Retry-After": str(max(math.ceil(exc.retry_after), 1))}
+    )
 
 
 class DirectMessage(BaseModel):
@@ -39,6 +79,12 @@ class DirectMessage(BaseModel):
     message_id: str = Field(..., description="Message ID", min_length=1, max_length=100)
     text: str = Field(..., description="Message text", min_length=1)
     
+    @model_validator(mode="wrap")
+    @classmethod
+    def measure_validation(cls, values, handler):
+        with observe_stage("validation"):
+            return handler(values)
+    
     @validator('text')
     def validate_text_length(cls, v):
         if len(v) > MAX_MESSAGE_LENGTH:
@@ -55,15 +101,119 @@ class DirectMessage(BaseModel):
 class BotResponse(BaseModel):
     """Output response model"""
     reply: str = Field(..., description="Bot response in Persian")
+
+
+class BatchRequest(BaseModel):
+    """Batch input model, messages are validated one by one"""
+    messages: List[Dict[str, Any]] = Field(
+        ..., description="Direct messages", min_length=1, max_length=MAX_BATCH_SIZE
+    )
+
+
+class BatchItemResult(BaseModel):
+    """Result of one message of a batch"""
+    message_id: Optional[str] = Field(None, description="Message ID")
+    sender_id: Optional[str] = Field(None, description="Sender ID")
+    reply: Optional[str] = Field(None, description="Bot response in Persian")
+    error: Optional[str] = Field(None, description="Error processing this message")
+
+
+class BatchResponse(BaseModel):
+    """Batch output model, results are in input order"""
+    results: List[BatchItemResult]
+
+
+class ProductInput(BaseModel):
+    """Product written through the admin API"""
+    id: Optional[int] = Field(None, description="Id of the product to replace", ge=1)
+    sku: Optional[str] = Field(None, description="External product id, replaces the product with this sku", min_length=1, max_length=100)
+    name: str = Field(..., description="Product name", min_length=1, max_length=500)
+    description: Optional[str] = Field(None, description="Product description", max_length=5000)
+    price: float = Field(..., description="Price (Toman)", ge=0)
+
+
+class ProductUpsertRequest(BaseModel):
+    """Products to insert or update in one transaction"""
+    products: List[ProductInput] = Field(..., min_length=1, max_length=ADMIN_MAX_PRODUCTS)
+
+def invalidate_replies(product_ids: Optional[Set[int]]):
+    """Drop cached replies mentioning changed products, or all of them if any product may have changed"""
+    response_cache = llm_service.response_cache
+    if response_cache is None:
+        return
+    if product_ids is None:
+        response_cache.clear()
+        return
+    for product_id in product_ids:
+        response_cache.invalidate_product(product_id)
+
+
 try:
     db = Database()
-    rag_service = RAGService(db)
+    conversation_store = ConversationStore() if CONTEXT_MAX_SENDERS > 0 else None
+    rag_service = RAGService(db, conversation_store)
     llm_service = LLMService()
+    reply_store = ReplyStore()
+    rate_limiter = RateLimiter()
+    tracer = Tracer()
+    db.add_change_listener(invalidate_replies)
     logger.info("Services initialized successfully")
 except Exception as e:
     logger.error(f"Error initializing services: {e}")
     raise
 
+Gauge(
+    "db_pool_connections",
+    "Connections of the database pools by state",
+    ["pool", "state"],
+    callback=lambda: {
+        (pool, state): value
+        for pool, stats in db.pool_stats().items()
+        for state, value in stats.items()
+    }
+)
+Gauge(
+    "cache_entries",
+    "Entries held by in-memory caches",
+    ["cache"],
+    callback=lambda: {
+        ("retrieval_cache",): len(db.retrieval_cache) if db.retrieval_cache is not None else 0,
+        ("response_cache",): len(llm_service.response_cache) if llm_service.response_cache is not None else 0,
+        ("reply_store",): reply_store.memory_size(),
+        ("conversation_context",): len(conversation_store) if conversation_store is not None else 0
+    }
+)
+Gauge(
+    "conversation_context_memory_bytes",
+    "Estimated memory held by per-sender conversation contexts",
+    callback=lambda: conversation_store.memory_bytes() if conversation_store is not None else 0
+)
+Gauge(
+    "catalog_version",
+    "Catalog version the search snapshot of this worker is at",
+    callback=lambda: db.catalog_version
+)
+
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    """Time the stages of traced requests, returning them to token holders and profiling sampled ones"""
+    trace = tracer.start(f"{request.method} {request.url.path}", request.headers.get(TRACE_HEADER))
+    if trace is None:
+        return await call_next(request)
+    
+    profile = tracer.start_profile(trace)
+    try:
+        response = await call_next(request)
+    finally:
+        if profile is not None:
+            tracer.finish_profile(trace, profile)
+    
+    if trace.requested:
+        # Streamed bodies are still being generated, their later stages are not included
+        response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
 
 @app.get("/")
 async def root():
@@ -72,8 +222,14 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "/simulate_dm": "Send message to bot (POST)",
+            "/simulate_dm/stream": "Send message to bot, reply streamed as NDJSON (POST)",
+            "/simulate_dm/batch": "Send many messages to bot at once (POST)",
+            "/products": "Product listing streamed as NDJSON, paginated with after_id (GET)",
             "/health": "Health check (GET)",
-            "/stats": "Database stats (GET)"
+            "/stats": "Catalog and service stats (GET)",
+            "/admin/products": "Insert or update products (PUT, admin token required)",
+            "/admin/products/{product_id}": "Delete a product (DELETE, admin token required)",
+            "/metrics": "Latency and counter metrics in Prometheus format (GET)"
         }
     }
 
@@ -81,11 +237,12 @@ async def root():
 @app.get("/health")
 async def health_check():
     try:
-        products = db.get_all_products(limit=1)
+        await asyncio.to_thread(db.ping)
         return {
             "status": "healthy",
             "database": "connected",
-            "llm": "configured"
+            "llm": llm_service.backend.name,
+            "llm_circuit": llm_service.breaker.state
         }
     except Exception as e:
         logger.error(f"Error in health check: {e}")
@@ -95,9 +252,21 @@ async def health_check():
 @app.get("/stats")
 async def get_stats():
     try:
-        products = db.get_all_products(limit=1000)
+        catalog = await asyncio.to_thread(db.catalog_stats)
+        response_cache = llm_service.response_cache
         return {
-            "total_products": len(products),
+            "total_products": catalog["total_products"],
+            "catalog_version": db.catalog_version,
+            "catalog": catalog,
+            "retrieval_cache": db.retrieval_cache.stats() if db.retrieval_cache is not None else None,
+            "response_cache": response_cache.stats() if response_cache is not None else None,
+            "reply_store": await asyncio.to_thread(reply_store.stats),
+            "conversation_context": conversation_store.stats() if conversation_store is not None else None,
+            "llm_circuit_breaker": llm_service.breaker.stats(),
+            "coalescing": {
+                "retrieve": rag_service.retrieval_flight.stats(),
+                "generate": llm_service.generation_flight.stats()
+            },
             "status": "ok"
         }
     except Exception as e:
@@ -105,24 +274,103 @@ async def get_stats():
         raise HTTPException(status_code=500, detail="Error getting statistics")
 
 
+@app.get("/products")
+async def list_products(
+    request: Request,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(PRODUCT_LIST_MAX_LIMIT, ge=1, le=PRODUCT_LIST_MAX_LIMIT)
+):
+    """
+    Products in id order streamed as NDJSON
+    
+    Each "product" line carries one product and the final "done" line carries
+    next_after_id, the after_id of the next page (null after the last page).
+    """
+    await enforce_rate_limit(request)
+    
+    def events():
+        # Runs in the threadpool, rows are read in batches while the response is sent
+        returned = 0
+        last_id = after_id
+        for product in db.iter_products(after_id=after_id, limit=limit):
+            returned += 1
+            last_id = product["id"]
+            yield _ndjson({"type": "product", "product": product})
+        yield _ndjson({"type": "done", "count": returned, "next_after_id": last_id if returned == limit else None})
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+def require_admin(request: Request):
+    """Reject requests without the admin token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API is disabled")
+    if not secrets.compare_digest(request.headers.get(ADMIN_HEADER, ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.put("/admin/products")
+async def upsert_products(request: Request, body: ProductUpsertRequest):
+    """Insert or update products; searches see them once the response is sent"""
+    require_admin(request)
+    try:
+        product_ids = await asyncio.to_thread(
+            db.upsert_products, [product.model_dump() for product in body.products]
+        )
+    except sqlite3.IntegrityError as e:
+        raise HTTPException(status_code=409, detail=f"Conflicting product: {e}")
+    
+    logger.info(f"Upserted {len(product_ids)} products, catalog version {db.catalog_version}")
+    return {"ids": product_ids, "catalog_version": db.catalog_version}
+
+
+@app.delete("/admin/products/{product_id}")
+async def delete_product(request: Request, product_id: int):
+    """Delete a product"""
+    require_admin(request)
+    deleted = await asyncio.to_thread(db.delete_products, [product_id])
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    logger.info(f"Deleted product {product_id}, catalog version {db.catalog_version}")
+    return {"deleted": deleted, "catalog_version": db.catalog_version}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @app.post("/simulate_dm", response_model=BotResponse)
-@limiter.limit(RATE_LIMIT)
 async def simulate_direct_message(request: Request, message: DirectMessage):
     """Instagram Direct Message simulator"""
+    await enforce_rate_limit(request, message.sender_id)
     try:
         logger.info(
-            f"New message - sender_id: {message.sender_id}, "
-            f"message_id: {message.message_id}, text: {message.text}"
+            "New message - sender_id: %s, message_id: %s, text: %.100s",
+            message.sender_id, message.message_id, message.text,
+            extra=PER_REQUEST
         )
         
-        retrieved_products = rag_service.retrieve(message.text)
-        logger.info(f"Retrieved products count: {len(retrieved_products)}")
+        async def produce_reply() -> str:
+            retrieved_products = await rag_service.retrieve_in_context_async(message.sender_id, message.text)
+            logger.info("Retrieved products count: %d", len(retrieved_products), extra=PER_REQUEST)
+            
+            reply = await llm_service.generate_response_async(
+                user_message=message.text,
+                retrieved_products=retrieved_products
+            )
+            if conversation_store is not None:
+                conversation_store.add_reply(message.sender_id, reply)
+            return reply
         
-        bot_reply = llm_service.generate_response(
-            user_message=message.text,
-            retrieved_products=retrieved_products
+        bot_reply, replayed = await reply_store.get_or_create(
+            message.sender_id, message.message_id, produce_reply, is_final=is_generated_reply
         )
-        logger.info(f"Generated response: {bot_reply[:100]}...")
+        if replayed:
+            logger.info("Serving stored reply for redelivered message_id: %s", message.message_id, extra=PER_REQUEST)
+        else:
+            logger.info("Generated response: %.100s...", bot_reply, extra=PER_REQUEST)
         
         return BotResponse(reply=bot_reply)
     
@@ -138,6 +386,201 @@ async def simulate_direct_message(request: Request, message: DirectMessage):
         )
 
 
+@app.post("/simulate_dm/stream")
+async def simulate_direct_message_stream(request: Request, message: DirectMessage):
+    """
+    Instagram Direct Message simulator streaming the reply as NDJSON
+    
+    The first line carries the retrieved products, followed by "delta" lines with
+    reply text as it is generated, an optional "fallback" line replacing the text
+    streamed so far, and a final "done" line. A redelivered message is answered
+    with its stored reply as a single "delta" line, without the products line.
+    """
+    await enforce_rate_limit(request, message.sender_id)
+    logger.info(
+        "New streaming message - sender_id: %s, message_id: %s, text: %.100s",
+        message.sender_id, message.message_id, message.text,
+        extra=PER_REQUEST
+    )
+    
+    # Events of the delivery that claims the message; None marks the end
+    streamed: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+    retrieved_products: List[Dict[str, Any]] = []
+    
+    async def produce_reply() -> str:
+        nonlocal retrieved_products
+        retrieved_products = await rag_service.retrieve_in_context_async(message.sender_id, message.text)
+        logger.info("Retrieved products count: %d", len(retrieved_products), extra=PER_REQUEST)
+        await streamed.put({"type": "products", "products": retrieved_products})
+        
+        chunks = []
+        async for event in llm_service.generate_response_stream(
+            user_message=message.text,
+            retrieved_products=retrieved_products
+        ):
+            if event["type"] == "fallback":
+                chunks = [event["text"]]
+            else:
+                chunks.append(event["text"])
+            await streamed.put(event)
+        
+        reply = "".join(chunks)
+        if conversation_store is not None:
+            conversation_store.add_reply(message.sender_id, reply)
+        return FallbackReply(reply) if any(isinstance(chunk, FallbackReply) for chunk in chunks) else reply
+    
+    async def events():
+        # Same claim protocol as /simulate_dm: concurrent duplicates wait for the
+        # delivery generating the reply instead of calling the LLM themselves
+        reply_task = asyncio.ensure_future(
+            reply_store.get_or_create(
+                message.sender_id, message.message_id, produce_reply, is_final=is_generated_reply
+            )
+        )
+        reply_task.add_done_callback(lambda _: streamed.put_nowait(None))
+        try:
+            while (event := await streamed.get()) is not None:
+                yield _ndjson(event)
+            
+            try:
+                reply, replayed = reply_task.result()
+            except Exception as e:
+                # The stream still ends with a reply and "done", so clients can tell it from a cut connection
+                logger.error(f"Error streaming reply for message_id {message.message_id}: {e}")
+                yield _ndjson({"type": "fallback", "text": llm_service.fallback_response(retrieved_products)})
+            else:
+                if replayed:
+                    logger.info("Serving stored reply for redelivered message_id: %s", message.message_id, extra=PER_REQUEST)
+                    yield _ndjson({"type": "delta", "text": reply})
+            yield _ndjson({"type": "done"})
+        finally:
+            reply_task.cancel()
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.post("/simulate_dm/batch", response_model=BatchResponse)
+async def simulate_direct_message_batch(request: Request, batch: BatchRequest):
+    """
+    Instagram Direct Message simulator for many messages at once
+    
+    Messages with the same normalized query share one retrieval and one LLM call.
+    Retrieval runs once per unique query against a single database snapshot and
+    LLM calls run concurrently up to BATCH_CONCURRENCY. The batch counts as one
+    request against the rate limit of the client IP and every message as one
+    request against the rate limit of its sender; the batch is rejected as a
+    whole if any of them is exceeded.
+    """
+    results: List[Optional[BatchItemResult]] = [None] * len(batch.messages)
+    texts_by_query: Dict[str, str] = {}
+    indexes_by_query: Dict[str, List[int]] = {}
+    messages: Dict[int, DirectMessage] = {}
+    valid_messages: Dict[int, DirectMessage] = {}
+    limit_keys = rate_limit_keys(request)
+    
+    for i, item in enumerate(batch.messages):
+        try:
+            valid_messages[i] = DirectMessage(**item)
+        except (ValidationError, TypeError) as e:
+            errors = e.errors() if isinstance(e, ValidationError) else [{"msg": str(e)}]
+            results[i] = BatchItemResult(
+                message_id=_optional_str(item.get("message_id")),
+                sender_id=_optional_str(item.get("sender_id")),
+                error="; ".join(error["msg"] for error in errors)
+            )
+        else:
+            limit_keys += rate_limit_keys(None, valid_messages[i].sender_id)
+    
+    over_limit = [key for key, count in Counter(limit_keys).items() if count > rate_limiter.capacity]
+    if over_limit:
+        # Could never be accepted, however long the client waits
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch has more messages from {over_limit[0]} than the rate limit of {RATE_LIMIT}"
+        )
+    await rate_limiter.hit_async(limit_keys)
+    
+    for i, message in valid_messages.items():
+        stored_reply = await reply_store.get_async(message.sender_id, message.message_id)
+        if stored_reply is not None:
+            results[i] = BatchItemResult(
+                message_id=message.message_id,
+                sender_id=message.sender_id,
+                reply=stored_reply
+            )
+            continue
+        
+        messages[i] = message
+        query = normalize_query(message.text)
+        texts_by_query.setdefault(query, message.text)
+        indexes_by_query.setdefault(query, []).append(i)
+    
+    logger.info(
+        "New batch - messages: %d, unique queries: %d",
+        len(batch.messages), len(texts_by_query),
+        extra=PER_REQUEST
+    )
+    
+    products_by_text = await rag_service.retrieve_many_async(list(texts_by_query.values()))
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def reply_for(text: str) -> str:
+        async with semaphore:
+            return await llm_service.generate_response_async(
+                user_message=text,
+                retrieved_products=products_by_text.get(text, [])
+            )
+    
+    # One LLM call per query, started by the first message of the query that needs it
+    reply_tasks: Dict[str, asyncio.Future] = {}
+    
+    def shared_reply(query: str) -> asyncio.Future:
+        if query not in reply_tasks:
+            reply_tasks[query] = asyncio.ensure_future(reply_for(texts_by_query[query]))
+        return reply_tasks[query]
+    
+    async def process(i: int, query: str):
+        message = messages[i]
+        try:
+            reply, _ = await reply_store.get_or_create(
+                message.sender_id, message.message_id, lambda: shared_reply(query), is_final=is_generated_reply
+            )
+            results[i] = BatchItemResult(
+                message_id=message.message_id,
+                sender_id=message.sender_id,
+                reply=reply
+            )
+        except Exception as e:
+            logger.error(f"Error processing batch message_id {message.message_id}: {e}")
+            results[i] = BatchItemResult(
+                message_id=message.message_id,
+                sender_id=message.sender_id,
+                error="Error processing message. Please try again."
+            )
+    
+    await asyncio.gather(*(
+        process(i, query)
+        for query, indexes in indexes_by_query.items()
+        for i in indexes
+    ))
+    
+    return BatchResponse(results=results)
+
+
+def is_generated_reply(reply: str) -> bool:
+    """Only LLM replies are stored for redeliveries; a retry after a fallback tries the LLM again"""
+    return not isinstance(reply, FallbackReply)
+
+
+def _optional_str(value: Any) -> Optional[str]:
+    return str(value) if value is not None else None
+
+
+def _ndjson(event: dict) -> str:
+    """Serialize one streamed event as a line of JSON"""
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     return JSONResponse(
@@ -156,12 +599,32 @@ async def general_exception_handler(request: Request, exc: Exception):
 
 
 if __name__ == "__main__":
-    logger.info(f"Starting service on {API_HOST}:{API_PORT}")
-    uvicorn.run(
-        "main:app",
-        host=API_HOST,
-        port=API_PORT,
-        reload=True,
-        log_level="info"
+    parser = argparse.ArgumentParser(description="Run the direct message API")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument(
+        "--production",
+        action="store_true",
+        help="Run several worker processes without the auto-reloader"
     )
-
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="Worker processes in production mode")
+    args = parser.parse_args()
+    
+    # Services were initialized above, so workers start on an existing database. The
+    # uvicorn CLI replaces this process: worker processes spawned from a script would
+    # import main.py a second time (as __mp_main__) next to the "main" module.
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", args.host,
+        "--port", str(args.port),
+        "--log-level", "info"
+    ]
+    if args.production:
+        logger.info(f"Starting service on {args.host}:{args.port} with {args.workers} workers")
+        command += ["--workers", str(args.workers)]
+    else:
+        logger.info(f"Starting development service on {args.host}:{args.port} with auto-reload")
+        command += ["--reload"]
+    
+    os.chdir(Path(__file__).resolve().parent)
+    os.execv(sys.executable, command)
@@ -0,0 +1,272 @@
+"""
+Lightweight in-process metrics exported in Prometheus text format
+"""
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from tracing import record_span
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base class of a named metric with optional labels"""
+    
+    type_name = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+    
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}"
+        ]
+        lines.extend(self._samples())
+        return lines
+    
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+    
+    type_name = "counter"
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+        if not self.labelnames:
+            self._values[()] = 0
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def value(self, **labels) -> float:
+        return self._values.get(self._label_values(labels), 0)
+    
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(Metric):
+    """Current value, either set explicitly or read from a callback at scrape time"""
+    
+    type_name = "gauge"
+    
+    def __init__(
+        self,
+        *args,
+        callback: Optional[Callable[[], Union[float, Dict[LabelValues, float]]]] = None,
+        **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+        self.callback = callback
+    
+    def set(self, value: float, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+    
+    def _samples(self) -> List[str]:
+        if self.callback is not None:
+            current = self.callback()
+            items = list(current.items()) if isinstance(current, dict) else [((), current)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+    
+    type_name = "histogram"
+    
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last), sum, count]
+        self._values: Dict[LabelValues, list] = {}
+    
+    def observe(self, value: float, **labels):
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+    
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        
+        lines = []
+        bounds = self.buckets + (float("inf"),)
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+    
+    def register(self, metric: Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+    
+    def unregister(self, name: str):
+        with self._lock:
+            self._metrics.pop(name, None)
+    
+    def render(self) -> str:
+        """Metrics in Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_LATENCY = Histogram(
+    "dm_stage_duration_seconds",
+    "Time spent in each stage of direct message processing",
+    ["stage"]
+)
+FALLBACK_RESPONSES = Counter(
+    "dm_fallback_responses_total",
+    "Replies answered with the fallback response instead of the LLM",
+    ["reason"]
+)
+EMPTY_RETRIEVALS = Counter(
+    "dm_empty_retrievals_total",
+    "Retrievals that returned no products"
+)
+BREAKER_STATE = Gauge(
+    "circuit_breaker_state",
+    "State of circuit breakers: 0 closed, 1 half-open, 2 open",
+    ["breaker"]
+)
+BREAKER_TRANSITIONS = Counter(
+    "circuit_breaker_transitions_total",
+    "State transitions of circuit breakers",
+    ["breaker", "from_state", "to_state"]
+)
+COALESCED_CALLS = Counter(
+    "singleflight_calls_total",
+    "Callers of coalesced operations, by whether they started the call (leader) or joined one (follower)",
+    ["flight", "role"]
+)
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Log records not written because they were sampled out or the log queue was full",
+    ["reason"]
+)
+FOLLOW_UP_REUSES = Counter(
+    "dm_follow_up_reuses_total",
+    "Follow-up messages answered with the products of the previous message instead of a new retrieval"
+)
+PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens",
+    "Estimated tokens of the prompts sent to the LLM",
+    buckets=(100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000)
+)
+PROMPT_PRODUCTS_DROPPED = Counter(
+    "llm_prompt_products_dropped_total",
+    "Retrieved products left out of the prompt to stay within the token budget"
+)
+RATE_LIMITED_REQUESTS = Counter(
+    "http_rate_limited_requests_total",
+    "Requests rejected by the rate limiter",
+    ["path"]
+)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """Context manager (or decorator) timing one processing stage, also as a span of the request trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_LATENCY.observe(duration, stage=stage)
+        record_span(stage, duration)
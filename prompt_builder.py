@@ -0,0 +1,189 @@
+"""
+Token-budgeted prompt construction for the LLM
+"""
+import re
+import logging
+from typing import List, Dict, Any, Tuple
+
+from config import PROMPT_TOKEN_BUDGET, PROMPT_BYTES_PER_TOKEN, PROMPT_MIN_DESCRIPTION_BYTES
+from logging_config import PER_REQUEST
+from metrics import PROMPT_TOKENS, PROMPT_PRODUCTS_DROPPED
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS_TEMPLATE = """You are an online store assistant that responds in Persian.
+Your task is to help customers find and buy products.
+
+User message: {user_message}
+
+Related products found:
+{products}
+
+Instructions:
+1. Write the response completely in Persian
+2. If the user asks about price, mention prices clearly and with Persian numbers
+3. If the user asks about specifications, give complete descriptions
+4. If multiple similar products are found, introduce all of them and mention their differences
+5. Use a friendly and professional tone
+6. Keep the response short and useful (maximum 3-4 sentences)
+7. If possible, provide a smart recommendation based on user needs
+8. Don't use English numbers, all numbers should be Persian
+9. Use Persian numbers instead of English ones
+
+Response:"""
+
+NO_PRODUCTS_TEMPLATE = """You are an online store assistant that responds in Persian.
+The user sent a message but no related products were found in the database.
+
+User message: {user_message}
+
+Please inform the user in Persian and in a friendly tone that unfortunately we couldn't find the product they're looking for and ask them to ask their question more clearly or mention another product name.
+"""
+
+PRODUCT_TEMPLATE = """
+Product {number}:
+Name: {name}
+Description: {description}
+Price: {price} تومان
+---
+"""
+
+# Description clauses, so a shortened description ends at a natural break
+CLAUSE_END = re.compile(r'(?<=[،,.;؛])\s+')
+
+ELLIPSIS = "…"
+
+
+def _size(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+def _truncate(text: str, max_bytes: int) -> str:
+    """Longest prefix of text within max_bytes, cut after a clause or word and marked with an ellipsis"""
+    if _size(text) <= max_bytes:
+        return text
+    
+    limit = max_bytes - _size(ELLIPSIS)
+    if limit <= 0:
+        return ""
+    
+    prefix = text.encode("utf-8")[:limit].decode("utf-8", errors="ignore")
+    clauses = CLAUSE_END.split(prefix)
+    if len(clauses) > 1:
+        return " ".join(clauses[:-1]).rstrip("،,.;؛ ") + ELLIPSIS
+    
+    words = prefix.split()
+    if len(words) > 1 and not text[len(prefix):len(prefix) + 1].isspace():
+        words = words[:-1]
+    return " ".join(words) + ELLIPSIS if words else ""
+
+
+class PromptBuilder:
+    """
+    Builds prompts that never exceed a token budget
+    
+    Tokens are estimated from the UTF-8 size (PROMPT_BYTES_PER_TOKEN bytes per token),
+    which is additive, so the budget is enforced exactly on the estimate. The static
+    templates are split and measured once. Products are added by descending score:
+    the lowest-scored products are dropped first when even their name and price do
+    not fit, and the remaining budget is shared between descriptions in proportion
+    to score, cutting them at clause or word boundaries.
+    """
+    
+    def __init__(
+        self,
+        token_budget: int = PROMPT_TOKEN_BUDGET,
+        bytes_per_token: int = PROMPT_BYTES_PER_TOKEN,
+        min_description_bytes: int = PROMPT_MIN_DESCRIPTION_BYTES
+    ):
+        self.token_budget = token_budget
+        self.bytes_per_token = bytes_per_token
+        self.budget_bytes = token_budget * bytes_per_token
+        self.min_description_bytes = min_description_bytes
+        
+        self._products_parts = self._split_template(PRODUCTS_TEMPLATE, "{user_message}", "{products}")
+        self._no_products_parts = self._split_template(NO_PRODUCTS_TEMPLATE, "{user_message}")
+        self._products_static = sum(_size(part) for part in self._products_parts)
+        self._no_products_static = sum(_size(part) for part in self._no_products_parts)
+        self._product_static = _size(PRODUCT_TEMPLATE.format(number="", name="", description="", price=""))
+        
+        if self._products_static >= self.budget_bytes:
+            raise ValueError(f"Prompt token budget {token_budget} is smaller than the instruction template")
+    
+    @staticmethod
+    def _split_template(template: str, *placeholders: str) -> Tuple[str, ...]:
+        """Split a template at its placeholders (in order) into static parts"""
+        parts = []
+        rest = template
+        for placeholder in placeholders:
+            head, rest = rest.split(placeholder)
+            parts.append(head)
+        parts.append(rest)
+        return tuple(parts)
+    
+    def estimate_tokens(self, text: str) -> int:
+        """Estimated number of tokens of text"""
+        return -(-_size(text) // self.bytes_per_token)
+    
+    def build(self, user_message: str, retrieved_products: List[Dict[str, Any]]) -> str:
+        """Build the prompt for a message and its retrieved products within the token budget"""
+        if not retrieved_products:
+            before, after = self._no_products_parts
+            message = _truncate(user_message, self.budget_bytes - self._no_products_static)
+            prompt = before + message + after
+        else:
+            before, between, after = self._products_parts
+            # The user message may use at most half of what the template leaves
+            message = _truncate(user_message, (self.budget_bytes - self._products_static) // 2)
+            available = self.budget_bytes - self._products_static - _size(message)
+            prompt = before + message + between + self._products_text(retrieved_products, available) + after
+        
+        tokens = self.estimate_tokens(prompt)
+        PROMPT_TOKENS.observe(tokens)
+        logger.debug("Prompt built with an estimated %d tokens", tokens, extra=PER_REQUEST)
+        return prompt
+    
+    def _products_text(self, retrieved_products: List[Dict[str, Any]], available: int) -> str:
+        """Product entries fitting in available bytes, best scored first"""
+        # Stable sort keeps retrieval order between equal scores and when there are no scores
+        ranked = sorted(retrieved_products, key=lambda product: -product.get("score", 0))
+        
+        entries = []
+        for product in ranked:
+            price = f"{product['price']:,.0f}".replace(',', '،')
+            entry_bytes = self._product_static + _size(str(len(entries) + 1)) + _size(product["name"]) + _size(price)
+            if entry_bytes > available:
+                break
+            available -= entry_bytes
+            entries.append((product, price))
+        
+        dropped = len(retrieved_products) - len(entries)
+        if dropped:
+            PROMPT_PRODUCTS_DROPPED.inc(dropped)
+        
+        descriptions = self._share_descriptions([product for product, _ in entries], available)
+        return "".join(
+            PRODUCT_TEMPLATE.format(number=number, name=product["name"], description=description, price=price)
+            for number, ((product, price), description) in enumerate(zip(entries, descriptions), 1)
+        )
+    
+    def _share_descriptions(self, products: List[Dict[str, Any]], available: int) -> List[str]:
+        """Descriptions cut to shares of available bytes proportional to product scores"""
+        descriptions = [product.get("description") or "" for product in products]
+        if not products:
+            return descriptions
+        
+        weights = [max(product.get("score", 0), 0) for product in products]
+        if not any(weights):
+            weights = [1] * len(products)
+        
+        result = [""] * len(products)
+        # Best scored first, so bytes a shorter description leaves unused go to the next ones
+        for i, description in enumerate(descriptions):
+            remaining_weight = sum(weights[i:])
+            share = int(available * weights[i] / remaining_weight) if remaining_weight else 0
+            if share < self.min_description_bytes and _size(description) > share:
+                share = min(self.min_description_bytes, available)
+            result[i] = _truncate(description, share)
+            available -= _size(result[i])
+        return result
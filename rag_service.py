@@ -1,10 +1,18 @@
 """
 RAG (Retrieval-Augmented Generation) service
 """
+import asyncio
 import logging
-from typing import List, Dict, Any
-from database import Database
+import threading
+from typing import List, Dict, Any, Optional
+from database import Database, normalize_query
+from lexicon import get_lexicon
+from tfidf_index import TfidfIndex
+from conversation_context import ConversationStore
+from singleflight import SingleFlight
 from config import MAX_RETRIEVAL_RESULTS
+from logging_config import PER_REQUEST
+from metrics import EMPTY_RETRIEVALS, FOLLOW_UP_REUSES, observe_stage
 
 logger = logging.getLogger(__name__)
 
@@ -12,8 +20,13 @@ logger = logging.getLogger(__name__)
 class RAGService:
     """Class for managing RAG information retrieval"""
     
-    def __init__(self, database: Database):
+    def __init__(self, database: Database, conversation_store: Optional[ConversationStore] = None):
         self.db = database
+        self.conversation_store = conversation_store
+        self.retrieval_flight = SingleFlight("retrieve")
+        self._tfidf_index: Optional[TfidfIndex] = None
+        self._tfidf_version = 0
+        self._tfidf_lock = threading.Lock()
     
     def retrieve(self, query: str, max_results: int = MAX_RETRIEVAL_RESULTS) -> List[Dict[str, Any]]:
         """
@@ -28,9 +41,13 @@ class RAGService:
         """
         try:
             # Search in database
-            products = self.db.search_products(query, limit=max_results)
+            with observe_stage("retrieve"):
+                products = self.db.search_products(query, limit=max_results)
             
-            logger.info(f"Found {len(products)} products for query '{query}'")
+            if not products:
+                EMPTY_RETRIEVALS.inc()
+            
+            logger.info("Found %d products for query '%s'", len(products), query, extra=PER_REQUEST)
             
             return products
         
@@ -38,13 +55,162 @@ class RAGService:
             logger.error(f"Error retrieving products: {e}")
             return []
     
+    async def retrieve_async(self, query: str, max_results: int = MAX_RETRIEVAL_RESULTS) -> List[Dict[str, Any]]:
+        """
+        Retrieve products in a worker thread so the event loop is not blocked
+        
+        Concurrent calls for queries with the same keywords share one retrieval.
+        
+        Args:
+            query: Search text
+            max_results: Maximum number of results
+        
+        Returns:
+            List of related products
+        """
+        products, _ = await self.retrieval_flight.do(
+            (normalize_query(query), max_results),
+            lambda: asyncio.to_thread(self.retrieve, query, max_results)
+        )
+        return products
+    
+    async def retrieve_in_context_async(
+        self,
+        sender_id: str,
+        query: str,
+        max_results: int = MAX_RETRIEVAL_RESULTS
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieve products for a message of a conversation without blocking the event loop
+        
+        A follow-up message (e.g. "قیمتش چنده؟") reuses the products of the sender's
+        previous message, but only when its own search finds nothing, so a message
+        naming another product switches the topic.
+        
+        Args:
+            sender_id: Sender of the message
+            query: Search text
+            max_results: Maximum number of results
+        
+        Returns:
+            List of related products
+        """
+        products = await self.retrieve_async(query, max_results)
+        if self.conversation_store is None:
+            return products
+        
+        if not products:
+            products = await asyncio.to_thread(self._follow_up_products, sender_id, query) or []
+        
+        self.conversation_store.add_message(sender_id, query, [product["id"] for product in products])
+        return products
+    
+    def _follow_up_products(self, sender_id: str, query: str) -> Optional[List[Dict[str, Any]]]:
+        """Products of the sender's previous message if query, which found no products, is a follow-up to it"""
+        product_ids = self.conversation_store.last_product_ids(sender_id)
+        if not product_ids or not self.is_follow_up(query):
+            return None
+        
+        try:
+            products = self.db.get_products_by_ids(list(product_ids))
+        except Exception as e:
+            logger.error(f"Error loading products of previous message: {e}")
+            return None
+        
+        if products:
+            FOLLOW_UP_REUSES.inc()
+            logger.info(
+                "Reusing %d products of previous message for follow-up '%s'", len(products), query,
+                extra=PER_REQUEST
+            )
+        return products
+    
+    @staticmethod
+    def is_follow_up(query: str) -> bool:
+        """Whether a message names no brand or product category, so it may refer to earlier products"""
+        brand_keywords, category_keywords, _ = get_lexicon().analyze(query)
+        return not brand_keywords and not category_keywords
+    
+    def retrieve_many(self, queries: List[str], max_results: int = MAX_RETRIEVAL_RESULTS) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Retrieve products for several queries against one snapshot of the database
+        
+        Args:
+            queries: Search texts (duplicates are searched once)
+            max_results: Maximum number of results per query
+        
+        Returns:
+            Related products keyed by query
+        """
+        unique_queries = list(dict.fromkeys(queries))
+        try:
+            with observe_stage("retrieve_many"):
+                results = self.db.search_products_many(unique_queries, limit=max_results)
+            
+            empty = sum(1 for products in results.values() if not products)
+            if empty:
+                EMPTY_RETRIEVALS.inc(empty)
+            
+            logger.info("Retrieved products for %d unique queries", len(unique_queries), extra=PER_REQUEST)
+            
+            return results
+        
+        except Exception as e:
+            logger.error(f"Error retrieving products: {e}")
+            return {query: [] for query in unique_queries}
+    
+    async def retrieve_many_async(
+        self,
+        queries: List[str],
+        max_results: int = MAX_RETRIEVAL_RESULTS
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Retrieve products for several queries in a worker thread"""
+        return await asyncio.to_thread(self.retrieve_many, queries, max_results)
+    
+    def _get_tfidf_index(self) -> TfidfIndex:
+        """Return the TF-IDF index of the catalog, loading or building it on first use and after catalog changes"""
+        version = self.db.catalog_version
+        index = self._tfidf_index
+        if index is not None and self._tfidf_version == version:
+            return index
+        
+        with self._tfidf_lock:
+            if self._tfidf_index is None or self._tfidf_version != version:
+                self._tfidf_index = TfidfIndex.load_or_build(self.db)
+                self._tfidf_version = version
+            return self._tfidf_index
+    
     def retrieve_with_scoring(self, query: str, max_results: int = MAX_RETRIEVAL_RESULTS) -> List[Dict[str, Any]]:
         """
-        Retrieve products with scoring (advanced version)
+        Retrieve products ranked by character n-gram TF-IDF similarity
         
-        In this version, more complex algorithms like TF-IDF or 
-        embedding-based search can be added
+        Unlike the keyword scorer, partial words, spelling variants and ZWNJ
+        differences still match.
+        
+        Args:
+            query: Search text
+            max_results: Maximum number of results
+        
+        Returns:
+            List of related products with their similarity score
         """
-        # Currently using simple retrieve
-        return self.retrieve(query, max_results)
-
+        try:
+            with observe_stage("retrieve_tfidf"):
+                self.db.check_catalog()
+                ranked = self._get_tfidf_index().search(query, limit=max_results)
+                products = self.db.get_products_by_ids([product_id for product_id, _ in ranked])
+            
+            scores = dict(ranked)
+            for product in products:
+                product["score"] = round(scores[product["id"]], 4)
+            
+            if not products:
+                EMPTY_RETRIEVALS.inc()
+            
+            logger.info("Found %d products for query '%s' with TF-IDF", len(products), query, extra=PER_REQUEST)
+            
+            return products
+        
+        except Exception as e:
+            logger.error(f"Error retrieving products with TF-IDF: {e}")
+            return []
@@ -0,0 +1,163 @@
+"""
+Token-bucket rate limiting with state shared by all worker processes
+"""
+import re
+import time
+import asyncio
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Tuple
+
+from connection_pool import ConnectionPool
+from config import RATE_LIMIT, RATE_LIMIT_DB_PATH, RATE_LIMIT_PRUNE_EVERY
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+RATE_PATTERN = re.compile(r'^\s*(\d+)\s*(?:/|per)\s*(second|minute|hour|day)s?\s*$')
+
+
+def parse_rate(rate: str) -> Tuple[int, float]:
+    """Parse a rate such as "10/minute" into (burst capacity, tokens refilled per second)"""
+    match = RATE_PATTERN.match(rate.lower())
+    if match is None:
+        raise ValueError(f"Invalid rate limit {rate!r}, expected e.g. '10/minute'")
+    capacity = int(match.group(1))
+    if capacity < 1:
+        raise ValueError(f"Invalid rate limit {rate!r}, at least one request is required")
+    return capacity, capacity / PERIODS[match.group(2)]
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request exceeds the rate limit of one of its keys"""
+    
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded for {key}")
+        self.key = key
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by arbitrary strings, stored in a SQLite file
+    
+    Each key holds up to `capacity` tokens, refilled continuously at the configured
+    rate, and every request takes one. The refill and the take happen in a single
+    UPSERT statement, so concurrent requests in any worker process see a consistent
+    bucket and the limit holds however many workers serve the API.
+    """
+    
+    def __init__(
+        self,
+        rate: str = RATE_LIMIT,
+        db_path: Path = RATE_LIMIT_DB_PATH,
+        prune_every: int = RATE_LIMIT_PRUNE_EVERY
+    ):
+        self.rate = rate
+        self.capacity, self.refill_rate = parse_rate(rate)
+        self.db_path = db_path
+        self.prune_every = prune_every
+        
+        self.pool = ConnectionPool(db_path, size=2)
+        self._hits_since_prune = 0
+        
+        self._init_db()
+    
+    def _init_db(self):
+        """Create buckets table if it doesn't exist"""
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.pool.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    allowed INTEGER NOT NULL
+                ) WITHOUT ROWID
+            """)
+            conn.commit()
+    
+    def hit(self, keys: Iterable[str]):
+        """
+        Take one token from the bucket of every key, one per occurrence of a repeated key
+        
+        Tokens taken from earlier keys are given back when a later key is exhausted,
+        so a rejected request does not count against any of its keys. Errors of the
+        store are logged and the request is let through.
+        
+        Raises:
+            RateLimitExceeded: If the bucket of any key has fewer tokens than needed
+        """
+        taken = []
+        try:
+            with self.pool.connection() as conn:
+                for key, cost in Counter(keys).items():
+                    allowed, tokens = self._take(conn, key, cost)
+                    if not allowed:
+                        for taken_key, taken_cost in taken:
+                            self._give_back(conn, taken_key, taken_cost)
+                        conn.commit()
+                        raise RateLimitExceeded(key, (cost - tokens) / self.refill_rate)
+                    taken.append((key, cost))
+                conn.commit()
+        except RateLimitExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Rate limit store error, allowing request: {e}")
+            return
+        
+        self._after_hit()
+    
+    async def hit_async(self, keys: Iterable[str]):
+        """Take tokens like hit, in a worker thread so a locked store does not block the event loop"""
+        await asyncio.to_thread(self.hit, list(keys))
+    
+    def _take(self, conn, key: str, cost: int = 1) -> Tuple[bool, float]:
+        """Refill the bucket of key and take cost tokens if available; returns (allowed, tokens left)"""
+        # SET expressions see the stored row, so `available` is computed from the old state
+        available = "min(:capacity, tokens + max(:now - updated_at, 0) * :refill_rate)"
+        row = conn.execute(
+            f"""
+            INSERT INTO rate_limit_buckets (key, tokens, updated_at, allowed)
+            VALUES (:key, CASE WHEN :capacity >= :cost THEN :capacity - :cost ELSE :capacity END, :now, :capacity >= :cost)
+            ON CONFLICT (key) DO UPDATE SET
+                tokens = CASE WHEN {available} >= :cost THEN {available} - :cost ELSE {available} END,
+                allowed = {available} >= :cost,
+                updated_at = max(:now, updated_at)
+            RETURNING allowed, tokens
+            """,
+            {"key": key, "cost": cost, "capacity": self.capacity, "refill_rate": self.refill_rate, "now": time.time()}
+        ).fetchone()
+        return bool(row["allowed"]), row["tokens"]
+    
+    def _give_back(self, conn, key: str, cost: int = 1):
+        conn.execute(
+            "UPDATE rate_limit_buckets SET tokens = min(tokens + ?, ?) WHERE key = ?",
+            (cost, self.capacity, key)
+        )
+    
+    def _after_hit(self):
+        """Delete buckets that refilled completely every prune_every requests"""
+        self._hits_since_prune += 1
+        if self._hits_since_prune < self.prune_every:
+            return
+        self._hits_since_prune = 0
+        
+        # A bucket idle for a full refill period is equivalent to a missing one
+        cutoff = time.time() - self.capacity / self.refill_rate
+        try:
+            with self.pool.connection() as conn:
+                deleted = conn.execute(
+                    "DELETE FROM rate_limit_buckets WHERE updated_at < ?", (cutoff,)
+                ).rowcount
+                conn.commit()
+            if deleted:
+                logger.info(f"Pruned {deleted} idle rate limit buckets")
+        except Exception as e:
+            logger.error(f"Error pruning rate limit buckets: {e}")
+    
+    def close(self):
+        """Close the store's connections"""
+        self.pool.close()
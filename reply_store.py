@@ -0,0 +1,290 @@
+"""
+Durable store of bot replies for idempotent message handling
+"""
+import time
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Callable, Awaitable
+
+from cache import LRUCache
+from connection_pool import ConnectionPool
+from config import (
+    REPLY_STORE_PATH, REPLY_STORE_RETENTION_SECONDS, REPLY_STORE_MEMORY_SIZE,
+    REPLY_STORE_COMPACT_EVERY, REPLY_STORE_IN_FLIGHT_TIMEOUT, REPLY_STORE_POLL_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+ReplyKey = Tuple[str, str]
+
+
+class ReplyStore:
+    """
+    Replies keyed by (sender_id, message_id), kept in SQLite next to the product database
+    
+    Redelivered messages are answered from an in-memory LRU in front of the table.
+    A row with a NULL reply marks a message that is still being processed: concurrent
+    duplicates in this worker wait on the same future, duplicates in other workers poll
+    the row until the reply is stored or the marker goes stale.
+    """
+    
+    def __init__(
+        self,
+        db_path: Path = REPLY_STORE_PATH,
+        retention_seconds: float = REPLY_STORE_RETENTION_SECONDS,
+        memory_size: int = REPLY_STORE_MEMORY_SIZE,
+        compact_every: int = REPLY_STORE_COMPACT_EVERY,
+        in_flight_timeout: float = REPLY_STORE_IN_FLIGHT_TIMEOUT,
+        poll_interval: float = REPLY_STORE_POLL_INTERVAL
+    ):
+        self.db_path = db_path
+        self.retention_seconds = retention_seconds
+        self.compact_every = compact_every
+        self.in_flight_timeout = in_flight_timeout
+        self.poll_interval = poll_interval
+        
+        self.pool = ConnectionPool(db_path, size=2)
+        self._recent = LRUCache(memory_size)
+        self._in_flight: Dict[ReplyKey, asyncio.Future] = {}
+        self._writes_since_compaction = 0
+        
+        self._init_db()
+    
+    def _init_db(self):
+        """Create replies table if it doesn't exist"""
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.pool.connection() as conn:
+            # auto_vacuum only takes effect before the first table is created
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS replies (
+                    sender_id TEXT NOT NULL,
+                    message_id TEXT NOT NULL,
+                    reply TEXT,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (sender_id, message_id)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS replies_created_at ON replies (created_at)")
+            conn.commit()
+    
+    def get(self, sender_id: str, message_id: str) -> Optional[str]:
+        """Return the stored reply of a message, if it was already answered"""
+        key = (sender_id, message_id)
+        reply = self._recent.get(key)
+        if reply is not None:
+            return reply
+        
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT reply FROM replies WHERE sender_id = ? AND message_id = ?",
+                key
+            ).fetchone()
+        
+        if row is None or row["reply"] is None:
+            return None
+        
+        self._recent.set(key, row["reply"])
+        return row["reply"]
+    
+    async def get_async(self, sender_id: str, message_id: str) -> Optional[str]:
+        """Return the stored reply of a message, reading the table in a worker thread"""
+        return await asyncio.to_thread(self.get, sender_id, message_id)
+    
+    def put(self, sender_id: str, message_id: str, reply: str):
+        """Store the reply of a message"""
+        key = (sender_id, message_id)
+        with self.pool.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO replies (sender_id, message_id, reply, created_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (sender_id, message_id)
+                DO UPDATE SET reply = excluded.reply, created_at = excluded.created_at
+                """,
+                (sender_id, message_id, reply, time.time())
+            )
+            conn.commit()
+        
+        self._recent.set(key, reply)
+        self._after_write()
+    
+    async def get_or_create(
+        self,
+        sender_id: str,
+        message_id: str,
+        produce: Callable[[], Awaitable[str]],
+        is_final: Callable[[str], bool] = lambda reply: True
+    ) -> Tuple[str, bool]:
+        """
+        Return the reply of a message, producing it only for its first delivery
+        
+        Table reads and writes run in worker threads, so a locked store file does
+        not block the event loop.
+        
+        Args:
+            sender_id: Sender of the message
+            message_id: Id of the message, unique per sender
+            produce: Generates the reply
+            is_final: Whether a produced reply is stored; other replies (e.g. fallback
+                replies) are only shared with concurrent deliveries in this process,
+                and the next delivery produces the reply again
+        
+        Returns:
+            The reply and whether it was served from the store
+        """
+        key = (sender_id, message_id)
+        reply = self._recent.get(key)
+        if reply is not None:
+            return reply, True
+        
+        while key in self._in_flight:
+            leader = self._in_flight[key]
+            try:
+                return await asyncio.shield(leader), True
+            except asyncio.CancelledError:
+                if not leader.cancelled():
+                    raise
+                # The first delivery was cancelled, try to process the message here
+        
+        future = asyncio.get_running_loop().create_future()
+        # Followers re-raise the leader's error, the future itself must not warn about it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._in_flight[key] = future
+        
+        claimed = False
+        try:
+            while True:
+                claimed, reply = await asyncio.to_thread(self._claim, key)
+                if reply is not None:
+                    replayed = True
+                    break
+                if claimed:
+                    reply = await produce()
+                    if is_final(reply):
+                        await asyncio.to_thread(self._save, key, reply)
+                    else:
+                        await asyncio.to_thread(self._release, key)
+                    replayed = False
+                    break
+                # Another worker is processing this message
+                await asyncio.sleep(self.poll_interval)
+        
+        except BaseException as e:
+            if claimed:
+                # Not awaited, so it also runs when this task is being cancelled
+                asyncio.get_running_loop().run_in_executor(None, self._release, key)
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+            raise
+        
+        finally:
+            self._in_flight.pop(key, None)
+        
+        if replayed or is_final(reply):
+            self._recent.set(key, reply)
+        future.set_result(reply)
+        return reply, replayed
+    
+    def _claim(self, key: ReplyKey) -> Tuple[bool, Optional[str]]:
+        """Mark a message as in flight; returns (claimed, stored reply)"""
+        now = time.time()
+        with self.pool.connection() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO replies (sender_id, message_id, reply, created_at) VALUES (?, ?, NULL, ?)",
+                (*key, now)
+            )
+            if cursor.rowcount == 1:
+                conn.commit()
+                return True, None
+            
+            row = conn.execute(
+                "SELECT reply, created_at FROM replies WHERE sender_id = ? AND message_id = ?",
+                key
+            ).fetchone()
+            if row is None:
+                conn.commit()
+                return False, None
+            if row["reply"] is not None:
+                conn.commit()
+                return False, row["reply"]
+            
+            if now - row["created_at"] < self.in_flight_timeout:
+                conn.commit()
+                return False, None
+            
+            # The worker that claimed this message gave up or died, take over
+            cursor = conn.execute(
+                """
+                UPDATE replies SET created_at = ?
+                WHERE sender_id = ? AND message_id = ? AND reply IS NULL AND created_at = ?
+                """,
+                (now, *key, row["created_at"])
+            )
+            conn.commit()
+            return cursor.rowcount == 1, None
+    
+    def _save(self, key: ReplyKey, reply: str):
+        """Store a produced reply; a storage error must not fail the reply itself"""
+        try:
+            self.put(*key, reply)
+        except Exception as e:
+            logger.error(f"Error storing reply: {e}")
+    
+    def _release(self, key: ReplyKey):
+        """Remove the in-flight marker of a message whose processing failed"""
+        try:
+            with self.pool.connection() as conn:
+                conn.execute(
+                    "DELETE FROM replies WHERE sender_id = ? AND message_id = ? AND reply IS NULL",
+                    key
+                )
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Error releasing in-flight marker: {e}")
+    
+    def _after_write(self):
+        """Compact the store every compact_every writes"""
+        self._writes_since_compaction += 1
+        if self._writes_since_compaction >= self.compact_every:
+            self._writes_since_compaction = 0
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Error compacting reply store: {e}")
+    
+    def compact(self) -> int:
+        """Delete replies older than the retention period and release their pages"""
+        cutoff = time.time() - self.retention_seconds
+        with self.pool.connection() as conn:
+            cursor = conn.execute("DELETE FROM replies WHERE created_at < ?", (cutoff,))
+            conn.commit()
+            conn.execute("PRAGMA incremental_vacuum")
+            deleted = cursor.rowcount
+        
+        if deleted:
+            logger.info(f"Reply store compacted, {deleted} old replies removed")
+        return deleted
+    
+    def stats(self) -> Dict[str, int]:
+        """Entry counts of the store"""
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS total, COUNT(reply) AS answered FROM replies"
+            ).fetchone()
+        return {
+            "stored": row["answered"],
+            "in_flight": row["total"] - row["answered"],
+            "memory": self.memory_size()
+        }
+    
+    def memory_size(self) -> int:
+        """Replies held in the in-memory LRU"""
+        return len(self._recent)
+    
+    def close(self):
+        """Close pooled connections"""
+        self.pool.close()
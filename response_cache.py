@@ -0,0 +1,74 @@
+"""
+Cache of generated LLM replies
+"""
+import threading
+from typing import List, Dict, Any, Optional, Set, Hashable
+
+from cache import LRUCache
+from config import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_SECONDS
+from database import normalize_query
+
+
+class ResponseCache:
+    """
+    LRU/TTL cache of LLM replies keyed on the normalized query and retrieved products
+    
+    The key contains the ordered (id, price) pairs of the retrieved products, so a
+    price change can never serve an old reply. Entries referencing a changed product
+    can also be dropped eagerly with invalidate_product.
+    """
+    
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL_SECONDS):
+        self._cache = LRUCache(maxsize, ttl=ttl, on_evict=self._forget)
+        self._keys_by_product: Dict[int, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._cache)
+    
+    @staticmethod
+    def make_key(user_message: str, retrieved_products: List[Dict[str, Any]]) -> Hashable:
+        """Cache key for a message and the products retrieved for it"""
+        return (
+            normalize_query(user_message),
+            tuple((product["id"], product["price"]) for product in retrieved_products)
+        )
+    
+    def get(self, key: Hashable) -> Optional[str]:
+        """Return a cached reply or None"""
+        return self._cache.get(key)
+    
+    def set(self, key: Hashable, reply: str):
+        """Store a reply"""
+        with self._lock:
+            for product_id, _ in key[1]:
+                self._keys_by_product.setdefault(product_id, set()).add(key)
+        self._cache.set(key, reply)
+    
+    def invalidate_product(self, product_id: int):
+        """Drop every reply that mentions the given product"""
+        with self._lock:
+            keys = self._keys_by_product.pop(product_id, set())
+        for key in keys:
+            self._cache.pop(key)
+            self._forget(key, None)
+    
+    def clear(self):
+        """Drop all replies"""
+        self._cache.clear()
+        with self._lock:
+            self._keys_by_product.clear()
+    
+    def _forget(self, key: Hashable, _value: Any):
+        """Remove an evicted key from the product reverse index"""
+        with self._lock:
+            for product_id, _ in key[1]:
+                keys = self._keys_by_product.get(product_id)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._keys_by_product[product_id]
+    
+    def stats(self) -> Dict[str, Any]:
+        """Size and hit/miss counters"""
+        return self._cache.stats()
@@ -0,0 +1,87 @@
+"""
+Coalescing of concurrent identical calls into one in-flight call
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from metrics import COALESCED_CALLS
+
+
+class _Call:
+    """One in-flight call and the number of callers awaiting it"""
+    
+    __slots__ = ("task", "waiters", "abandoned")
+    
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+        self.abandoned = False
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time and shares its result with every concurrent caller
+    
+    The call runs in its own task, so the caller that started it (the leader) can be
+    cancelled without affecting the others; the task is only cancelled once every
+    caller waiting for it is gone. A failure of the call is raised to all of them.
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.leaders = 0
+        self.followers = 0
+        self._calls: Dict[Hashable, _Call] = {}
+    
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Return the result of fn(), sharing it with concurrent calls of the same key
+        
+        Returns:
+            The result and whether it came from a call started by another caller
+        """
+        call = self._calls.get(key)
+        shared = call is not None and not call.abandoned
+        if shared:
+            self.followers += 1
+            COALESCED_CALLS.inc(flight=self.name, role="follower")
+        else:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._finished(key, call))
+            self.leaders += 1
+            COALESCED_CALLS.inc(flight=self.name, role="leader")
+        
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        except asyncio.CancelledError:
+            if call.task.cancelled():
+                raise
+            # This caller went away; the call keeps running for the others
+            if call.waiters == 1 and not call.task.done():
+                call.abandoned = True
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+    
+    def _finished(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Marks a failure as retrieved even if every caller already went away
+        if not call.task.cancelled():
+            call.task.exception()
+    
+    def __len__(self) -> int:
+        return len(self._calls)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Calls started and joined, and the share of callers served by another call"""
+        callers = self.leaders + self.followers
+        return {
+            "in_flight": len(self._calls),
+            "calls": self.leaders,
+            "coalesced": self.followers,
+            "coalescing_ratio": round(self.followers / callers, 4) if callers else 0.0
+        }
@@ -0,0 +1,25 @@
+"""
+Shared fixtures: services run against a temporary copy of the sample catalog
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# main opens its databases on import; keep them out of the repository
+os.environ.setdefault("DB_DIR", tempfile.mkdtemp(prefix="test_db_"))
+os.environ.setdefault("LLM_BACKEND", "local")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Database with the sample catalog"""
+    database = Database(db_path=tmp_path / "products.sqlite")
+    yield database
+    database.close()
@@ -0,0 +1,91 @@
+"""
+HTTP endpoints against the local LLM backend
+"""
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from rate_limiter import RateLimiter
+from reply_store import ReplyStore
+from tracing import Tracer
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Client with empty caches, reply store and rate limit buckets of 10 requests per minute"""
+    if main.llm_service.response_cache is not None:
+        main.llm_service.response_cache.clear()
+    rate_limiter = RateLimiter("10/minute", db_path=tmp_path / "rate_limits.sqlite")
+    reply_store = ReplyStore(db_path=tmp_path / "replies.sqlite")
+    monkeypatch.setattr(main, "rate_limiter", rate_limiter)
+    monkeypatch.setattr(main, "reply_store", reply_store)
+    with TestClient(main.app) as test_client:
+        yield test_client
+    reply_store.close()
+    rate_limiter.close()
+
+
+def direct_message(i, sender_id=None):
+    return {"sender_id": sender_id or f"u{i}", "message_id": f"m{i}", "text": "قیمت کیبورد Keychron"}
+
+
+def test_batch_larger_than_the_rate_limit_is_accepted(client):
+    response = client.post("/simulate_dm/batch", json={"messages": [direct_message(i) for i in range(12)]})
+    
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert len(results) == 12
+    assert all(result["reply"] and not result["error"] for result in results)
+
+
+def test_batch_charges_each_sender_per_message(client):
+    response = client.post("/simulate_dm/batch", json={"messages": [direct_message(i, "u1") for i in range(12)]})
+    assert response.status_code == 413
+    
+    assert client.post("/simulate_dm/batch", json={"messages": [direct_message(i, "u1") for i in range(8)]}).status_code == 200
+    assert client.post("/simulate_dm/batch", json={"messages": [direct_message(i, "u1") for i in range(8, 11)]}).status_code == 429
+
+
+def test_stream_ends_with_fallback_when_the_reply_fails(client, monkeypatch):
+    async def fail(sender_id, text):
+        raise RuntimeError("search unavailable")
+    monkeypatch.setattr(main.rag_service, "retrieve_in_context_async", fail)
+    
+    response = client.post("/simulate_dm/stream", json=direct_message(1))
+    
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["type"] for event in events] == ["fallback", "done"]
+    assert events[0]["text"]
+
+
+def test_retry_after_a_fallback_reply_asks_the_llm_again(client, monkeypatch):
+    backend = main.llm_service.backend
+    generate_async = backend.generate_async
+    
+    async def fail(*args):
+        raise RuntimeError("backend down")
+    monkeypatch.setattr(backend, "generate_async", fail)
+    fallback = client.post("/simulate_dm", json=direct_message(1)).json()["reply"]
+    
+    monkeypatch.setattr(backend, "generate_async", generate_async)
+    reply = client.post("/simulate_dm", json=direct_message(1)).json()["reply"]
+    
+    assert reply != fallback
+    assert client.post("/simulate_dm", json=direct_message(1)).json()["reply"] == reply
+
+
+@pytest.mark.parametrize("token, header_value, expected", [
+    ("", "1", False),
+    ("secret", None, False),
+    ("secret", "wrong", False),
+    ("secret", "secret", True)
+])
+def test_server_timing_only_for_the_trace_token(client, monkeypatch, token, header_value, expected):
+    monkeypatch.setattr(main, "tracer", Tracer(token=token, sample_rate=1.0))
+    headers = {main.TRACE_HEADER: header_value} if header_value else {}
+    
+    response = client.get("/health", headers=headers)
+    
+    assert ("server-timing" in response.headers) == expected
@@ -0,0 +1,38 @@
+"""
+Follow-up messages reuse the previous products only when they find nothing themselves
+"""
+import asyncio
+
+from conversation_context import ConversationStore
+from rag_service import RAGService
+
+
+def names(products):
+    return " ".join(product["name"] for product in products)
+
+
+def test_switching_topic_ignores_stale_context(db):
+    rag_service = RAGService(db, ConversationStore())
+    
+    keyboards = asyncio.run(rag_service.retrieve_in_context_async("s3", "کیبورد Keychron"))
+    assert "Keychron" in names(keyboards)
+    
+    consoles = asyncio.run(rag_service.retrieve_in_context_async("s3", "Xbox چنده"))
+    assert consoles
+    assert "Xbox" in names(consoles)
+    assert "Keychron" not in names(consoles)
+
+
+def test_follow_up_reuses_previous_products(db):
+    rag_service = RAGService(db, ConversationStore())
+    
+    consoles = asyncio.run(rag_service.retrieve_in_context_async("s4", "Xbox چنده"))
+    follow_up = asyncio.run(rag_service.retrieve_in_context_async("s4", "قیمتش چنده؟"))
+    assert [product["id"] for product in follow_up] == [product["id"] for product in consoles]
+
+
+def test_follow_up_of_another_sender_finds_nothing(db):
+    rag_service = RAGService(db, ConversationStore())
+    
+    asyncio.run(rag_service.retrieve_in_context_async("s5", "Xbox چنده"))
+    assert asyncio.run(rag_service.retrieve_in_context_async("s6", "قیمتش چنده؟")) == []
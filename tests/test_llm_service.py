@@ -0,0 +1,67 @@
+"""
+Circuit breaker accounting of the LLM service under queueing and backend timeouts, and the backend interface
+"""
+import asyncio
+
+import pytest
+
+from llm_backends import LLMBackend, LocalBackend
+from llm_service import LLMService
+
+PRODUCTS = [{"id": 1, "name": "گوشی سامسونگ Galaxy S23", "description": "", "price": 35000000}]
+
+
+async def generate_concurrently(llm_service: LLMService, count: int):
+    return await asyncio.gather(*(
+        llm_service.generate_response_async(f"قیمت گوشی مدل{i}", PRODUCTS) for i in range(count)
+    ))
+
+
+def test_queueing_does_not_open_breaker():
+    backend = LocalBackend(latency_distribution="fixed", latency_ms=300)
+    llm_service = LLMService(backend=backend, max_concurrency=1, timeout=1.0)
+    
+    replies = asyncio.run(generate_concurrently(llm_service, 20))
+    
+    assert len(replies) == 20
+    stats = llm_service.breaker.stats()
+    assert stats["state"] == "closed"
+    assert stats["recent_failure_rate"] == 0.0
+    # The calls that got a slot in time succeeded, the rest were shed
+    assert 1 <= stats["recent_calls"] < 20
+
+
+def test_backend_timeouts_open_breaker():
+    backend = LocalBackend(latency_distribution="fixed", latency_ms=1000)
+    llm_service = LLMService(backend=backend, max_concurrency=20, timeout=0.2)
+    
+    asyncio.run(generate_concurrently(llm_service, 12))
+    
+    assert llm_service.breaker.state == "open"
+
+
+def test_queueing_does_not_open_breaker_when_streaming():
+    backend = LocalBackend(latency_distribution="fixed", latency_ms=300)
+    llm_service = LLMService(backend=backend, max_concurrency=1, timeout=1.0)
+    
+    async def stream(i: int):
+        return [event async for event in llm_service.generate_response_stream(f"قیمت گوشی مدل{i}", PRODUCTS)]
+    
+    async def run():
+        return await asyncio.gather(*(stream(i) for i in range(20)))
+    
+    streams = asyncio.run(run())
+    
+    assert any(events[-1]["type"] == "fallback" for events in streams)
+    assert any(events[-1]["type"] == "delta" for events in streams)
+    assert llm_service.breaker.stats()["recent_failure_rate"] == 0.0
+    assert llm_service.breaker.state == "closed"
+
+
+def test_backend_missing_a_method_fails_on_creation():
+    class SyncOnlyBackend(LLMBackend):
+        def generate(self, prompt, user_message, retrieved_products):
+            return "reply"
+    
+    with pytest.raises(TypeError):
+        SyncOnlyBackend()
@@ -0,0 +1,37 @@
+"""
+Token buckets charged once per occurrence of a key
+"""
+import asyncio
+
+import pytest
+
+from rate_limiter import RateLimiter, RateLimitExceeded
+
+
+@pytest.fixture
+def rate_limiter(tmp_path):
+    limiter = RateLimiter("5/minute", db_path=tmp_path / "rate_limits.sqlite")
+    yield limiter
+    limiter.close()
+
+
+def test_repeated_keys_take_one_token_each(rate_limiter):
+    rate_limiter.hit(["ip:a", "sender:x"] * 3)
+    
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        rate_limiter.hit(["ip:a"] * 3)
+    assert exc_info.value.key == "ip:a"
+    
+    rate_limiter.hit(["ip:a", "ip:a"])
+    with pytest.raises(RateLimitExceeded):
+        rate_limiter.hit(["ip:a"])
+
+
+def test_rejected_request_gives_tokens_back(rate_limiter):
+    rate_limiter.hit(["sender:x"] * 5)
+    
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(rate_limiter.hit_async(["ip:b"] * 4 + ["sender:x"]))
+    
+    # The 4 tokens taken from ip:b before sender:x was rejected were returned
+    rate_limiter.hit(["ip:b"] * 5)
@@ -0,0 +1,68 @@
+"""
+Replies produced once per message, across workers sharing the store file
+"""
+import asyncio
+
+import pytest
+
+from reply_store import ReplyStore
+
+
+@pytest.fixture
+def stores(tmp_path):
+    """Two stores on one file, as used by two workers"""
+    opened = [ReplyStore(db_path=tmp_path / "replies.sqlite", poll_interval=0.01) for _ in range(2)]
+    yield opened
+    for store in opened:
+        store.close()
+
+
+def test_concurrent_deliveries_produce_once(stores):
+    calls = []
+    
+    async def produce() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "reply"
+    
+    async def deliver_twice_per_worker():
+        return await asyncio.gather(*(
+            store.get_or_create("s1", "m1", produce) for store in stores for _ in range(2)
+        ))
+    
+    results = asyncio.run(deliver_twice_per_worker())
+    
+    assert len(calls) == 1
+    assert [reply for reply, _ in results] == ["reply"] * 4
+    assert sorted(replayed for _, replayed in results) == [False, True, True, True]
+
+
+def test_failed_delivery_releases_the_claim(stores):
+    async def fail() -> str:
+        raise RuntimeError("backend down")
+    
+    async def produce() -> str:
+        return "reply"
+    
+    async def deliver():
+        with pytest.raises(RuntimeError):
+            await stores[0].get_or_create("s1", "m1", fail)
+        # The release runs in a worker thread; the other worker waits for it
+        return await asyncio.wait_for(stores[1].get_or_create("s1", "m1", produce), 5)
+    
+    assert asyncio.run(deliver()) == ("reply", False)
+
+
+def test_replies_that_are_not_final_are_produced_again(stores):
+    replies = iter(["fallback", "reply"])
+    
+    async def produce() -> str:
+        return next(replies)
+    
+    async def deliver_twice():
+        first = await stores[0].get_or_create("s1", "m1", produce, is_final=lambda reply: reply != "fallback")
+        second = await stores[0].get_or_create("s1", "m1", produce, is_final=lambda reply: reply != "fallback")
+        return first, second
+    
+    assert asyncio.run(deliver_twice()) == (("fallback", False), ("reply", False))
+    assert stores[1].get("s1", "m1") == "reply"
@@ -0,0 +1,33 @@
+"""
+Cached search results never outlive the catalog version they were computed on
+"""
+import pytest
+
+import database
+from database import Database
+
+
+@pytest.mark.parametrize("search_engine", Database.SEARCH_ENGINES)
+def test_write_by_another_worker_invalidates_cached_results(tmp_path, monkeypatch, search_engine):
+    monkeypatch.setattr(database, "CATALOG_REFRESH_INTERVAL", 0)
+    db = Database(tmp_path / "products.sqlite", search_engine=search_engine)
+    other_worker = Database(db.db_path, search_engine=search_engine)
+    try:
+        query = "کیبورد Keychron"
+        before = db.search_products(query)
+        assert db.search_products(query) == before
+        assert len(db.retrieval_cache) == 1
+        
+        [new_id] = other_worker.upsert_products([
+            {"name": "کیبورد Keychron Q1", "description": "کیبورد مکانیکال", "price": 1.0}
+        ])
+        after = db.search_products(query)
+        
+        assert db.catalog_version == other_worker.catalog_version
+        assert new_id in [product["id"] for product in after]
+        assert new_id not in [product["id"] for product in before]
+        # The entry of the previous version was dropped, not just bypassed
+        assert len(db.retrieval_cache) == 1
+    finally:
+        other_worker.close()
+        db.close()
@@ -0,0 +1,72 @@
+"""
+Search snapshots: copy-on-write updates and catching up with other workers
+"""
+import database
+from database import normalized_product
+from search_index import ProductIndex
+
+
+def product_row(product_id, name, description=""):
+    """Products table row as read by the index"""
+    columns = (
+        "name", "description", "price",
+        "name_normalized", "description_normalized", "name_tokens", "description_tokens"
+    )
+    return dict(zip(columns, normalized_product(name, description, 1000.0)), id=product_id)
+
+
+def found_ids(index, *other_keywords):
+    return {product["id"] for product in index.search([], [], list(other_keywords), limit=10)}
+
+
+def test_apply_changes_leaves_the_previous_snapshot_unchanged():
+    base = ProductIndex([
+        product_row(1, "Keychron keyboard", "mechanical"),
+        product_row(2, "Logitech mouse", "wireless"),
+        product_row(3, "Razer keyboard", "gaming")
+    ], version=1)
+    
+    updated = base.apply_changes([product_row(2, "Logitech keyboard", "wireless")], deleted_ids=[3], version=2)
+    
+    assert (base.version, updated.version) == (1, 2)
+    assert (len(base), len(updated)) == (3, 2)
+    assert found_ids(base, "keyboard") == {1, 3}
+    assert found_ids(base, "mouse") == {2}
+    assert found_ids(base, "gaming") == {3}
+    assert base.products[2]["name"] == "Logitech mouse"
+    
+    assert found_ids(updated, "keyboard") == {1, 2}
+    assert found_ids(updated, "mouse") == set()
+    assert found_ids(updated, "gaming") == set()
+    assert found_ids(updated, "wireless") == {2}
+
+
+def test_searches_see_writes_without_touching_held_snapshots(db):
+    snapshot = db._get_index()
+    
+    [new_id] = db.upsert_products([{"name": "Zorblax gadget", "description": "", "price": 10.0}])
+    assert [product["id"] for product in db.search_products("zorblax")] == [new_id]
+    
+    db.delete_products([new_id])
+    assert db.search_products("zorblax") == []
+    
+    assert found_ids(snapshot, "zorblax") == set()
+    assert db._get_index() is not snapshot
+
+
+def test_change_log_is_pruned_and_lagging_workers_reload(db, monkeypatch):
+    monkeypatch.setattr(database, "CATALOG_CHANGES_RETAINED", 2)
+    other_worker = database.Database(db_path=db.db_path)
+    try:
+        other_worker._get_index()
+        
+        new_ids = db.upsert_products(
+            {"name": f"Zorblax gadget {i}", "description": "", "price": 10.0} for i in range(5)
+        )
+        with db.get_read_connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM catalog_changes").fetchone()[0] <= 3
+        
+        assert other_worker.refresh_catalog() == db.catalog_version
+        assert {product["id"] for product in other_worker.search_products("zorblax", limit=10)} == set(new_ids)
+    finally:
+        other_worker.close()
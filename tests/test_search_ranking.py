@@ -0,0 +1,22 @@
+"""
+The in-memory index ranks like the full-scan reference scorer
+"""
+from benchmark_search import build_query_corpus, reference_search
+from catalog_generator import build_catalog_db
+from database import Database
+
+
+def test_index_ranking_matches_reference_scorer(tmp_path):
+    db = Database(build_catalog_db(tmp_path / "catalog.sqlite", 500), search_engine="python")
+    try:
+        with db.get_read_connection() as conn:
+            rows = conn.execute(
+                "SELECT id, name_normalized, description_normalized FROM products ORDER BY id"
+            ).fetchall()
+        
+        queries = [query for _, query in build_query_corpus(100)] + ["کیبورد Keychron", "گوشی سامسونگ"]
+        for query in queries:
+            expected = reference_search(db, rows, query, 5)
+            assert [product["id"] for product in db.search_products(query, limit=5)] == expected, query
+    finally:
+        db.close()
@@ -0,0 +1,15 @@
+"""
+Saved TF-IDF indexes follow the catalog
+"""
+from tfidf_index import TfidfIndex
+
+
+def test_rebuild_after_write_removes_the_stale_index(db, tmp_path):
+    base_dir = tmp_path / "tfidf"
+    first = TfidfIndex.load_or_build(db, base_dir)
+    
+    db.upsert_products([{"name": "Zorblax gadget", "description": "", "price": 10.0}])
+    second = TfidfIndex.load_or_build(db, base_dir)
+    
+    assert len(second) == len(first) + 1
+    assert len([directory for directory in base_dir.iterdir() if not directory.name.startswith(".")]) == 1
@@ -0,0 +1,47 @@
+"""
+Persian/English text normalization shared by product ingest and query analysis
+"""
+import re
+from typing import List
+
+# Characters treated as part of a word (same boundary rule as the original regex matcher)
+TOKEN_PATTERN = re.compile(r'[\w\u0600-\u06FF]+')
+
+CHARACTER_MAP = str.maketrans({
+    # Arabic yeh, alef maksura and kaf typed instead of the Persian letters
+    "\u064a": "\u06cc",
+    "\u0649": "\u06cc",
+    "\u0643": "\u06a9",
+    # Persian and Arabic-Indic digits
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    # ZWNJ/ZWJ are dropped so "لپ‌تاپ" and "لپتاپ" are the same word
+    "\u200c": None,
+    "\u200d": None,
+    # Tatweel and Arabic diacritics
+    "\u0640": None,
+    **{chr(code): None for code in range(0x064B, 0x0653)},
+})
+
+# Most text has none of the mapped characters; a regex scan is much cheaper than translate
+MAPPED_CHARACTERS = re.compile("[" + "".join(re.escape(chr(code)) for code in CHARACTER_MAP) + "]")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase text, unify Persian letter and digit variants and collapse whitespace"""
+    if not text:
+        return ""
+    text = text.lower()
+    if MAPPED_CHARACTERS.search(text):
+        text = text.translate(CHARACTER_MAP)
+    return " ".join(text.split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into word tokens"""
+    return TOKEN_PATTERN.findall(text)
+
+
+def token_string(normalized_text: str) -> str:
+    """Space separated unique tokens of normalized text, as stored in the tokens columns"""
+    return " ".join(dict.fromkeys(tokenize(normalized_text)))
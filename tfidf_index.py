@@ -0,0 +1,246 @@
+"""
+Character n-gram TF-IDF index over the product catalog, persisted as memory-mapped NumPy arrays
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import zlib
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Tuple, Iterable, Any
+
+import numpy as np
+
+from config import (
+    TFIDF_INDEX_DIR, TFIDF_NGRAM_RANGE, TFIDF_FEATURES, TFIDF_NAME_WEIGHT, TFIDF_MIN_SCORE
+)
+from database import Database, query_keywords
+from text_normalizer import tokenize
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+ARRAY_NAMES = ("indptr", "indices", "data", "ids", "idf")
+
+
+class TfidfIndex:
+    """
+    Hashed character n-gram TF-IDF matrix of product names and descriptions
+    
+    The matrix is stored column-major (one column per hashed n-gram), so scoring a
+    query is a sparse matrix-vector product over the query's columns only. The arrays
+    are saved as .npy files and opened with mmap_mode, so loading is instant and
+    worker processes share the pages through the OS cache.
+    """
+    
+    def __init__(
+        self,
+        arrays: Dict[str, np.ndarray],
+        ngram_range: Tuple[int, int] = TFIDF_NGRAM_RANGE,
+        n_features: int = TFIDF_FEATURES
+    ):
+        self.indptr = arrays["indptr"]
+        self.indices = arrays["indices"]
+        self.data = arrays["data"]
+        self.ids = arrays["ids"]
+        self.idf = arrays["idf"]
+        self.ngram_range = ngram_range
+        self.n_features = n_features
+        self._features: Dict[str, int] = {}
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def _feature(self, ngram: str) -> int:
+        """Hashed column of an n-gram (crc32 is stable across processes, unlike hash())"""
+        feature = self._features.get(ngram)
+        if feature is None:
+            if len(self._features) > 1_000_000:
+                self._features.clear()
+            feature = self._features[ngram] = zlib.crc32(ngram.encode("utf-8")) % self.n_features
+        return feature
+    
+    def ngram_counts(self, normalized_text: str) -> Counter:
+        """Hashed n-gram counts of normalized text, n-grams do not cross word boundaries"""
+        n_min, n_max = self.ngram_range
+        counts: Counter = Counter()
+        for word in tokenize(normalized_text):
+            padded = f" {word} "
+            for n in range(n_min, n_max + 1):
+                for start in range(len(padded) - n + 1):
+                    counts[self._feature(padded[start:start + n])] += 1
+        return counts
+    
+    @classmethod
+    def build(
+        cls,
+        rows: Iterable[Any],
+        ngram_range: Tuple[int, int] = TFIDF_NGRAM_RANGE,
+        n_features: int = TFIDF_FEATURES,
+        name_weight: int = TFIDF_NAME_WEIGHT
+    ) -> "TfidfIndex":
+        """Build the index from product rows (id, name_normalized, description_normalized)"""
+        index = cls({name: np.empty(0) for name in ARRAY_NAMES}, ngram_range, n_features)
+        
+        ids: List[int] = []
+        row_numbers = array("i")
+        features = array("i")
+        counts = array("f")
+        for row in rows:
+            row_counts = index.ngram_counts(row["name_normalized"])
+            for feature in row_counts:
+                row_counts[feature] *= name_weight
+            row_counts.update(index.ngram_counts(row["description_normalized"]))
+            
+            row_number = len(ids)
+            ids.append(row["id"])
+            row_numbers.extend(array("i", [row_number]) * len(row_counts))
+            features.extend(row_counts.keys())
+            counts.extend(row_counts.values())
+        
+        row_array = np.frombuffer(row_numbers, dtype=np.int32)
+        feature_array = np.frombuffer(features, dtype=np.int32)
+        weights = 1 + np.log(np.frombuffer(counts, dtype=np.float32))  # Sublinear term frequency
+        
+        document_frequency = np.bincount(feature_array, minlength=n_features)
+        idf = (np.log((1 + len(ids)) / (1 + document_frequency)) + 1).astype(np.float32)
+        weights *= idf[feature_array]
+        
+        # L2-normalize rows so scores are cosine similarities
+        norms = np.sqrt(np.bincount(row_array, weights=weights * weights, minlength=len(ids)))
+        weights /= np.where(norms > 0, norms, 1)[row_array]
+        
+        order = np.lexsort((row_array, feature_array))
+        indptr = np.zeros(n_features + 1, dtype=np.int64)
+        np.cumsum(document_frequency, out=indptr[1:])
+        
+        index.indptr = indptr
+        index.indices = row_array[order]
+        index.data = weights[order].astype(np.float32)
+        index.ids = np.array(ids, dtype=np.int64)
+        index.idf = idf
+        return index
+    
+    def save(self, directory: Path):
+        """Write the arrays as .npy files into directory"""
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(directory / f"{name}.npy", getattr(self, name))
+        with open(directory / "meta.json", "w") as f:
+            json.dump({"ngram_range": list(self.ngram_range), "n_features": self.n_features}, f)
+    
+    @classmethod
+    def load(cls, directory: Path) -> "TfidfIndex":
+        """Open a saved index with memory-mapped arrays"""
+        with open(directory / "meta.json") as f:
+            meta = json.load(f)
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in ARRAY_NAMES}
+        return cls(arrays, tuple(meta["ngram_range"]), meta["n_features"])
+    
+    @classmethod
+    def load_or_build(cls, db: Database, base_dir: Path = TFIDF_INDEX_DIR) -> "TfidfIndex":
+        """Load the index of the current catalog, building and saving it if needed"""
+        directory = base_dir / catalog_signature(db)
+        if (directory / "meta.json").exists():
+            index = cls.load(directory)
+            logger.info(f"TF-IDF index loaded with {len(index)} products")
+            return index
+        
+        with db.get_read_connection() as conn, observe_stage("tfidf_build"):
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name_normalized, description_normalized FROM products ORDER BY id")
+            index = cls.build(cursor)
+        
+        # Build in a private directory and rename, so other workers never see a partial index
+        temp_directory = base_dir / f".{directory.name}.{os.getpid()}"
+        index.save(temp_directory)
+        try:
+            os.rename(temp_directory, directory)
+        except OSError:
+            # Another worker saved the same snapshot first
+            shutil.rmtree(temp_directory, ignore_errors=True)
+        
+        logger.info(f"TF-IDF index built with {len(index)} products")
+        remove_stale_indexes(base_dir, keep=directory.name)
+        return cls.load(directory)
+    
+    def query_vector(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Hashed columns and L2-normalized TF-IDF weights of a query"""
+        counts = self.ngram_counts(" ".join(query_keywords(query)))
+        if not counts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        
+        features = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        weights = (1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))) * self.idf[features]
+        norm = np.sqrt(np.dot(weights, weights))
+        return features, weights / norm if norm > 0 else weights
+    
+    def scores(self, query: str) -> np.ndarray:
+        """Cosine similarity of the query with every product"""
+        features, weights = self.query_vector(query)
+        starts = self.indptr[features]
+        ends = self.indptr[features + 1]
+        lengths = ends - starts
+        if not lengths.sum():
+            return np.zeros(len(self.ids), dtype=np.float32)
+        
+        # Gather the nonzeros of the query's columns and sum them per product
+        positions = np.repeat(ends - lengths.cumsum(), lengths) + np.arange(lengths.sum())
+        column_weights = np.repeat(weights, lengths)
+        return np.bincount(
+            self.indices[positions],
+            weights=self.data[positions] * column_weights,
+            minlength=len(self.ids)
+        )
+    
+    def search(self, query: str, limit: int = 5, min_score: float = TFIDF_MIN_SCORE) -> List[Tuple[int, float]]:
+        """Return (product id, score) of the top products, best first"""
+        scores = self.scores(query)
+        if limit <= 0 or not len(scores):
+            return []
+        
+        if limit < len(scores):
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(len(scores))
+        # Best score first, ties broken by catalog order
+        top = top[np.lexsort((top, -scores[top]))]
+        
+        return [
+            (int(self.ids[row]), float(scores[row]))
+            for row in top
+            if scores[row] >= min_score
+        ]
+
+
+def catalog_signature(db: Database) -> str:
+    """Digest of the catalog text and index settings, naming the index directory"""
+    with db.get_read_connection() as conn:
+        row = conn.execute(
+            """
+            SELECT COUNT(*), COALESCE(MAX(id), 0),
+                   TOTAL(LENGTH(name_normalized)), TOTAL(LENGTH(description_normalized))
+            FROM products
+            """
+        ).fetchone()
+    # The catalog version also tells apart edits that keep the counts and lengths
+    settings = (tuple(row), db.catalog_version, TFIDF_NGRAM_RANGE, TFIDF_FEATURES, TFIDF_NAME_WEIGHT)
+    return hashlib.sha1(repr(settings).encode("utf-8")).hexdigest()[:16]
+
+
+def remove_stale_indexes(base_dir: Path, keep: str):
+    """
+    Delete the saved indexes of other catalog signatures
+    
+    Every catalog write changes the signature, so without this each write would
+    leave a full copy of the index behind. Workers that still have an old index
+    mapped keep reading it until they unmap it; partial builds of other workers
+    (hidden directories) are left alone.
+    """
+    for directory in base_dir.iterdir():
+        if directory.name != keep and not directory.name.startswith(".") and directory.is_dir():
+            shutil.rmtree(directory, ignore_errors=True)
+            logger.info(f"Removed stale TF-IDF index {directory.name}")
@@ -0,0 +1,129 @@
+"""
+Opt-in per-request tracing: stage spans for a Server-Timing header and cProfile captures
+"""
+import os
+import time
+import random
+import secrets
+import cProfile
+import logging
+import threading
+from pathlib import Path
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from config import (
+    TRACE_TOKEN, TRACE_SAMPLE_RATE, TRACE_PROFILE_DIR, TRACE_PROFILE_MAX_FILES
+)
+
+logger = logging.getLogger(__name__)
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Spans recorded while handling one request"""
+    
+    def __init__(self, name: str, sampled: bool, requested: bool = False):
+        self.name = name
+        self.sampled = sampled
+        # Only requests carrying the trace token get their timings back
+        self.requested = requested
+        self.started = time.perf_counter()
+        # (stage, duration in seconds); appended from the event loop and worker threads
+        self.spans: List[Tuple[str, float]] = []
+    
+    def add_span(self, stage: str, duration: float):
+        self.spans.append((stage, duration))
+    
+    def server_timing(self) -> str:
+        """Spans and the total time as a Server-Timing header value (durations in milliseconds)"""
+        entries = [f"{stage};dur={duration * 1000:.2f}" for stage, duration in self.spans]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(entries)
+
+
+def current_trace() -> Optional[Trace]:
+    """Trace of the request being handled, None when it is not traced"""
+    return _current_trace.get()
+
+
+def record_span(stage: str, duration: float):
+    """Add a span to the current trace, if any"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(stage, duration)
+
+
+class Tracer:
+    """
+    Decides which requests are traced and captures profiles of sampled ones
+    
+    A request is traced when it carries the trace header with TRACE_TOKEN as its
+    value (never when no token is configured) or when it is picked by
+    TRACE_SAMPLE_RATE. Only the former get the Server-Timing header.
+    Sampled requests are also profiled with cProfile when a profile directory is
+    set. Only one request is profiled at a time, and the profile covers the event
+    loop thread, so it also includes other requests served concurrently.
+    """
+    
+    def __init__(
+        self,
+        token: str = TRACE_TOKEN,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        profile_dir: str = TRACE_PROFILE_DIR,
+        profile_max_files: int = TRACE_PROFILE_MAX_FILES
+    ):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self.profile_max_files = profile_max_files
+        self._profiling = threading.Lock()
+        
+        if self.profile_dir is not None:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+    
+    def start(self, name: str, header_value: Optional[str]) -> Optional[Trace]:
+        """Start a trace for a request and make it current, or return None"""
+        requested = bool(self.token) and secrets.compare_digest(header_value or "", self.token)
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not requested and not sampled:
+            return None
+        
+        trace = Trace(name, sampled, requested)
+        _current_trace.set(trace)
+        return trace
+    
+    def start_profile(self, trace: Trace) -> Optional[cProfile.Profile]:
+        """Profile a sampled request if profiling is enabled and no other request is profiled"""
+        if not trace.sampled or self.profile_dir is None or not self._profiling.acquire(blocking=False):
+            return None
+        
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active in this thread
+            self._profiling.release()
+            return None
+        return profile
+    
+    def finish_profile(self, trace: Trace, profile: cProfile.Profile):
+        """Stop a profile and write it as a pstats file"""
+        profile.disable()
+        self._profiling.release()
+        
+        safe_name = "".join(char if char.isalnum() else "_" for char in trace.name).strip("_")
+        path = self.profile_dir / f"{time.time():.6f}-{os.getpid()}-{safe_name}.pstats"
+        try:
+            profile.dump_stats(path)
+            self._remove_old_profiles()
+            logger.info(f"Request profile written to {path}")
+        except OSError as e:
+            logger.error(f"Error writing request profile {path}: {e}")
+    
+    def _remove_old_profiles(self):
+        """Keep the newest profile_max_files captures"""
+        profiles = sorted(self.profile_dir.glob("*.pstats"), key=lambda path: path.stat().st_mtime)
+        for path in profiles[:-self.profile_max_files or None]:
+            path.unlink(missing_ok=True)